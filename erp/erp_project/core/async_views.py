@@ -0,0 +1,274 @@
+# core/async_views.py
+"""
+Async versions of registration, login and the read-only list endpoints for
+deployments served through ``erp_project.asgi``.
+
+Database access goes through Django's async ORM and password hashing runs on
+a bounded thread pool (``ASYNC_HASH_WORKERS`` threads), so one ASGI process
+keeps serving other requests while slow PBKDF2 logins are in flight.
+Responses match their synchronous DRF counterparts, and requests take
+tokens from the same TenantThrottle buckets; list pages use the same
+``{"next", "previous", "results"}`` shape with forward-only cursors.
+"""
+import asyncio
+import base64
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import Throttled
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .lockout import AccountLocked, lockout_remaining, record_failed_login, record_successful_login
+from .middleware import get_tenant
+from .models import Company, Permission, Role, User, UserCompanyMembership
+from .pagination import KeysetPagination, RolePagination, UserPagination
+from .permissions import get_permission_map
+from .serializers import PermissionSerializer, RoleSerializer, UserRegistrationSerializer, UserSerializer
+from .throttling import TenantThrottle
+from .utils import log_action
+from .views import ROLE_PERMISSIONS_PREFETCH, USER_MEMBERSHIPS_PREFETCH
+
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+
+
+def get_hash_executor():
+    """Returns the bounded thread pool used for password hashing."""
+    global _hash_executor
+    if _hash_executor is None:
+        with _hash_executor_lock:
+            if _hash_executor is None:
+                _hash_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ASYNC_HASH_WORKERS', 4),
+                    thread_name_prefix='password-hash',
+                )
+    return _hash_executor
+
+
+async def run_hashing(func, *args):
+    """Runs a CPU-bound hashing call off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), partial(func, *args))
+
+
+def error(detail, status):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def locked(wait):
+    response = error(AccountLocked.default_detail, 403)
+    response['Retry-After'] = str(AccountLocked(wait).wait)
+    return response
+
+
+async def throttle(request, view):
+    """
+    Takes the request's tokens from the TenantThrottle buckets, as DRF does
+    for the sync views. Returns a 429 response when they are refused.
+    """
+    throttle = TenantThrottle()
+    # Sync: reading the buckets may resolve request.user from the session.
+    if await sync_to_async(throttle.allow_request)(request, view):
+        return None
+    exc = Throttled(throttle.wait())
+    response = error(exc.detail, 429)
+    response['Retry-After'] = '%d' % exc.wait
+    return response
+
+
+def parse_json(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def authenticate(request):
+    """
+    Authenticates a ``Bearer`` access token like JWTAuthentication does and
+    sets ``request.user``. Returns None when the request is not authenticated.
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) != 2 or header[0] not in jwt_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        token = AccessToken(header[1])
+    except TokenError:
+        return None
+    user = await User.objects.filter(
+        **{jwt_settings.USER_ID_FIELD: token[jwt_settings.USER_ID_CLAIM]}
+    ).afirst()
+    if user is None or not user.is_active:
+        return None
+    request.user = user
+    return user
+
+
+class AsyncUserRegistrationView(View):
+    """Async version of UserRegistrationView."""
+    throttle_cost = 5
+
+    async def post(self, request):
+        throttled = await throttle(request, self)
+        if throttled:
+            return throttled
+        data = parse_json(request)
+        if data is None:
+            return error("JSON parse error.", 400)
+        serializer = UserRegistrationSerializer(data=data)
+        # Field validation checks username uniqueness, which is a sync query.
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=400)
+
+        validated = serializer.validated_data
+        password = await run_hashing(make_password, validated['password'])
+        company, created = await Company.objects.aget_or_create(name=validated['company_name'])
+        # Normalized as UserManager.create_user does, which cannot be used
+        # here: it would hash the password again, outside the hashing pool.
+        user = await User.objects.acreate(
+            username=User.normalize_username(validated['username']),
+            email=User.objects.normalize_email(validated['email']),
+            password=password,
+        )
+        await UserCompanyMembership.objects.acreate(user=user, company=company)
+        await sync_to_async(log_action)(user, 'create', f"New user account created: {user.username}", company=company)
+        return JsonResponse({"message": "User registered successfully."}, status=201)
+
+
+class AsyncTokenObtainPairView(View):
+    """Async version of TokenObtainPairView; the password check runs off-loop."""
+    async def post(self, request):
+        throttled = await throttle(request, self)
+        if throttled:
+            return throttled
+        data = parse_json(request)
+        if data is None:
+            return error("JSON parse error.", 400)
+        username, password = data.get('username'), data.get('password')
+        errors = {field: ["This field is required."] for field in ('username', 'password') if not data.get(field)}
+        if errors:
+            return JsonResponse(errors, status=400)
+
+        remaining = await sync_to_async(lockout_remaining)(username)
+        if remaining:
+            return locked(remaining)
+        user = await User.objects.filter(username=username).afirst()
+        if user is None:
+            # Hash anyway so unknown usernames take as long as wrong passwords.
+            await run_hashing(make_password, password)
+            valid = False
+        else:
+            valid = await run_hashing(user.check_password, password)
+        if not valid or not user.is_active:
+            remaining = await sync_to_async(record_failed_login)(username)
+            if remaining:
+                return locked(remaining)
+            return error("No active account found with the given credentials", 401)
+        try:
+            await sync_to_async(record_successful_login)(user)
+        except AccountLocked as e:
+            return locked(e.wait)
+
+        refresh = RefreshToken.for_user(user)
+        return JsonResponse({'refresh': str(refresh), 'access': str(refresh.access_token)})
+
+
+class AsyncListView(View):
+    """
+    Base for async read-only list endpoints: authenticates and throttles the
+    request, scopes the queryset to the active company and pages it by ``id``.
+    """
+    queryset = None
+    serializer_class = None
+    pagination_class = KeysetPagination
+    company_field = 'company'
+    permission_codename = None
+
+    async def get(self, request):
+        user = await authenticate(request)
+        if user is None:
+            return error("Authentication credentials were not provided.", 401)
+        company = await get_tenant(request).aget_company()
+        if self.permission_codename and not user.is_superuser:
+            permissions = await sync_to_async(get_permission_map)(user)
+            if self.permission_codename not in permissions.get(company.pk if company else None, ()):
+                return error("You do not have permission to perform this action.", 403)
+        throttled = await throttle(request, self)
+        if throttled:
+            return throttled
+
+        queryset = self.queryset.all()
+        if self.company_field and not user.is_superuser:
+            if company is None:
+                queryset = queryset.none()
+            else:
+                queryset = queryset.filter(**{self.company_field: company})
+
+        page_size = self.get_page_size(request)
+        after = self.decode_cursor(request)
+        if after is None:
+            return error("Invalid cursor", 404)
+        if after:
+            queryset = queryset.filter(pk__gt=after)
+        rows = [obj async for obj in queryset.order_by('pk')[:page_size + 1]]
+        next_url = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_url = self.next_url(request, rows[-1].pk)
+        return JsonResponse({
+            'next': next_url,
+            'previous': None,
+            'results': self.serializer_class(rows, many=True).data,
+        })
+
+    def get_page_size(self, request):
+        pagination = self.pagination_class
+        try:
+            size = int(request.GET.get(pagination.page_size_query_param, pagination.page_size))
+        except ValueError:
+            size = pagination.page_size
+        return max(1, min(size, pagination.max_page_size))
+
+    def decode_cursor(self, request):
+        cursor = request.GET.get('cursor')
+        if cursor is None:
+            return 0
+        try:
+            return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except ValueError:
+            return None
+
+    def next_url(self, request, last_pk):
+        params = request.GET.copy()
+        params['cursor'] = base64.urlsafe_b64encode(str(last_pk).encode()).decode()
+        return request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+
+class AsyncUserListView(AsyncListView):
+    queryset = User.objects.filter(deleted_at__isnull=True).prefetch_related(USER_MEMBERSHIPS_PREFETCH)
+    serializer_class = UserSerializer
+    pagination_class = UserPagination
+    company_field = 'usercompanymembership__company'
+
+
+class AsyncRoleListView(AsyncListView):
+    queryset = Role.objects.filter(company__deleted_at__isnull=True).select_related('company').prefetch_related(ROLE_PERMISSIONS_PREFETCH)
+    serializer_class = RoleSerializer
+    pagination_class = RolePagination
+
+
+class AsyncPermissionListView(AsyncListView):
+    queryset = Permission.objects.all()
+    serializer_class = PermissionSerializer
+    company_field = None
+    permission_codename = 'permission.view'
@@ -0,0 +1,188 @@
+# core/audit.py
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import AuditLog, Company, User, UserCompanyMembership
+from .rollups import add_counts, count_records
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def make_record(user, action, description, company=None):
+    """Builds an unsaved ``AuditLog`` stamped with the current time."""
+    return AuditLog(
+        user_id=user.pk if user is not None else None,
+        company_id=company.pk if company is not None else None,
+        action=action,
+        description=description,
+        created_at=timezone.now(),
+    )
+
+
+class AuditLogWriter:
+    """
+    Collects audit records in a bounded in-memory queue and writes them with
+    ``bulk_create`` from a background thread, either when ``batch_size``
+    records are pending or every ``flush_interval`` seconds. Each batch
+    also adds its counts to the activity rollups (core.rollups).
+
+    When the queue is full the caller writes the pending records itself, so
+    memory stays bounded without dropping records.
+    """
+    def __init__(self, batch_size=200, flush_interval=1.0, max_pending=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def log(self, user, action, description, company=None):
+        record = make_record(user, action, description, company)
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Backpressure: drain the queue in the calling thread.
+            self.flush()
+            self.write([record])
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Writes every pending record. Safe to call from any thread."""
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                self.write(batch)
+
+    def write(self, records, verify=True):
+        """
+        Inserts ``records`` with a single ``bulk_create``. With ``verify`` the
+        referenced users and companies are checked to still exist first.
+        """
+        try:
+            self._resolve_relations(records, verify)
+            # Like bulk_create's own transaction: no savepoint inside a request's.
+            with transaction.atomic(savepoint=False):
+                AuditLog.objects.bulk_create(records, batch_size=self.batch_size)
+                add_counts(count_records(records))
+        except Exception:
+            # A failed batch is lost; the request that logged it goes on.
+            logger.exception("Failed to write %s audit log entries", len(records))
+
+    def stop(self):
+        """Stops the background flusher after writing pending records."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.flush()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self.flush()
+        finally:
+            connection.close()
+
+    def _resolve_relations(self, records, verify):
+        # Records without a company get the user's first membership, looked
+        # up for the whole batch at once. References to rows deleted since
+        # the record was queued are nulled, mirroring on_delete=SET_NULL.
+        missing_company = {
+            record.user_id for record in records
+            if record.company_id is None and record.user_id is not None
+        }
+        first_company = {}
+        if missing_company:
+            memberships = UserCompanyMembership.objects.filter(
+                user_id__in=missing_company
+            ).order_by('-pk').values_list('user_id', 'company_id')
+            first_company = dict(memberships)
+        for record in records:
+            if record.company_id is None and record.user_id is not None:
+                record.company_id = first_company.get(record.user_id)
+        if not verify:
+            return
+
+        user_ids = {record.user_id for record in records if record.user_id is not None}
+        existing_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        company_ids = {record.company_id for record in records if record.company_id is not None}
+        existing_companies = set(Company.objects.filter(pk__in=company_ids).values_list('pk', flat=True))
+        for record in records:
+            if record.user_id not in existing_users:
+                record.user_id = None
+            if record.company_id not in existing_companies:
+                record.company_id = None
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    """Returns the process-wide buffered writer, creating it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditLogWriter(
+                    batch_size=_setting('AUDIT_LOG_BATCH_SIZE', 200),
+                    flush_interval=_setting('AUDIT_LOG_FLUSH_INTERVAL', 1.0),
+                    max_pending=_setting('AUDIT_LOG_MAX_PENDING', 10000),
+                )
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def write_audit_log(user, action, description, company=None):
+    """
+    Records an audit entry, either buffered (the default) or written inline
+    when ``AUDIT_LOG_MODE`` is ``'sync'``.
+    """
+    if _setting('AUDIT_LOG_MODE', 'buffered') == 'sync':
+        # The record is written right away, so its references are known to exist.
+        get_audit_writer().write([make_record(user, action, description, company)], verify=False)
+    else:
+        get_audit_writer().log(user, action, description, company=company)
@@ -0,0 +1,496 @@
+# core/benchmarks.py
+"""
+In-process benchmark helpers. Benchmarks run against a throwaway test
+database, never against the configured one.
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .audit import get_audit_writer
+from .models import Permission, User, UserCompanyMembership
+from .seeding import SEED_EPOCH, SEED_PASSWORD
+from .throttling import TokenBucket
+
+
+@contextmanager
+def temporary_database():
+    """Creates and migrates a test database for the duration of the block."""
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            # A file rather than the shared in-memory database, whose table
+            # locks fail concurrent writers instead of making them wait.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Benchmarks send far more requests than the API throttle lets
+            # through; benchmark_throttle turns it back on.
+            with override_settings(API_THROTTLE_BUCKETS={}):
+                yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    """Summary statistics for a run, latencies in milliseconds."""
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+    }
+
+
+def run_wsgi(path, payloads, concurrency):
+    """
+    Posts each JSON payload to ``path`` through the WSGI handler from
+    ``concurrency`` threads, like a threaded WSGI server.
+    """
+    def call(payload):
+        started = time.perf_counter()
+        response = Client().post(path, payload, content_type='application/json')
+        return (time.perf_counter() - started) * 1000, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, payloads))
+    elapsed = time.perf_counter() - started
+    connection.close()
+    return results, elapsed
+
+
+def run_asgi(path, payloads, concurrency):
+    """
+    Posts each JSON payload to ``path`` through the ASGI handler from one
+    event loop, keeping at most ``concurrency`` requests in flight.
+    """
+    async def main():
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+
+        async def call(payload):
+            async with gate:
+                started = time.perf_counter()
+                response = await client.post(path, payload, content_type='application/json')
+                return (time.perf_counter() - started) * 1000, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(payload) for payload in payloads))
+        return results, time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def compare_login_concurrency(users, requests, concurrency):
+    """
+    Logs ``users`` in ``requests`` times through the synchronous
+    TokenObtainPairView under WSGI and through the async token view under
+    ASGI. ``users`` is a list of ``(username, password)`` pairs that must
+    exist already. Returns summaries for both.
+    """
+    payloads = [
+        {'username': username, 'password': password}
+        for username, password in (users[i % len(users)] for i in range(requests))
+    ]
+    report = {}
+    for name, runner, path in (
+        ('wsgi', run_wsgi, '/api/token/'),
+        ('asgi', run_asgi, '/api/async/token/'),
+    ):
+        results, elapsed = runner(path, payloads, concurrency)
+        summary = summarize([latency for latency, _ in results], elapsed)
+        summary['errors'] = sum(1 for _, status in results if status != 200)
+        report[name] = summary
+    return report
+
+
+class TableWriteCounter:
+    """An ``execute_wrapper`` counting UPDATE/INSERT/DELETE statements on ``table``."""
+    def __init__(self, table):
+        self.table = f'"{table}"'
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(('UPDATE', 'INSERT', 'DELETE')) and self.table in sql:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def failed_login_load(username, attempts, rate, concurrency, path='/api/token/'):
+    """
+    Sends ``attempts`` logins with a wrong password for ``username`` through
+    the WSGI handler, paced at ``rate`` per second from ``concurrency``
+    threads. Reports latencies, response statuses, the achieved rate and how
+    many statements wrote to the user table.
+    """
+    payload = {'username': username, 'password': 'not-the-password'}
+    started = time.perf_counter()
+
+    def call(index):
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        counter = TableWriteCounter('core_user')
+        with connection.execute_wrapper(counter):
+            sent = time.perf_counter()
+            response = Client().post(path, payload, content_type='application/json')
+            latency = (time.perf_counter() - sent) * 1000
+        return latency, response.status_code, counter.count
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(attempts)))
+    elapsed = time.perf_counter() - started
+    connection.close()
+
+    report = summarize([latency for latency, _, _ in results], elapsed)
+    report['offered_rate'] = rate
+    report['statuses'] = dict(Counter(str(status) for _, status, _ in results))
+    report['user_row_writes'] = sum(writes for _, _, writes in results)
+    return report
+
+
+def benchmark_user():
+    """
+    The user benchmarks act as: the administrator of the first company seeded
+    by ``TenantSeeder(seed=0)``, made staff for the admin-only routes.
+    """
+    user = User.objects.get(username='s0c0u0')
+    user.is_staff = True
+    user.save(update_fields=['is_staff'])
+    return user
+
+
+def _register(i, ctx):
+    return {
+        'username': f'bench-new-{ctx["run"]}-{i}', 'email': f'new{i}@example.com',
+        'password': SEED_PASSWORD, 'company_name': 's0 Company 0',
+    }
+
+
+def _login(i, ctx):
+    return {'username': ctx['username'], 'password': SEED_PASSWORD}
+
+
+# (name, method, path, body) for every route in core/urls.py and the token
+# routes. ``path`` is formatted with the benchmark context and ``body`` is
+# called with the request index and the context. DELETE routes and the bulk
+# user import are left out: they would change the data later routes read.
+ENDPOINTS = [
+    ('users.register', 'post', '/api/users/register/', _register),
+    ('users.list', 'get', '/api/users/', None),
+    ('users.search', 'get', '/api/users/?search=s0c0u1', None),
+    ('users.export', 'get', '/api/users/?format=ndjson', None),
+    ('users.retrieve', 'get', '/api/users/{user}/', None),
+    ('users.update', 'patch', '/api/users/{user}/', lambda i, ctx: {'email': f'bench{i}@example.com'}),
+    ('companies.list', 'get', '/api/companies/', None),
+    ('companies.retrieve', 'get', '/api/companies/{company}/', None),
+    ('roles.list', 'get', '/api/roles/', None),
+    ('roles.retrieve', 'get', '/api/roles/{role}/', None),
+    ('roles.create', 'post', '/api/roles/', lambda i, ctx: {
+        'name': f'Bench role {ctx["run"]}-{i}', 'permissions': ['permission.view'],
+    }),
+    ('roles.update', 'patch', '/api/roles/{role}/', lambda i, ctx: {'description': f'Updated {i}'}),
+    ('permissions.list', 'get', '/api/permissions/', None),
+    ('permissions.retrieve', 'get', '/api/permissions/{permission}/', None),
+    ('memberships.list', 'get', '/api/memberships/', None),
+    ('memberships.retrieve', 'get', '/api/memberships/{membership}/', None),
+    ('memberships.bulk', 'post', '/api/memberships/bulk/', lambda i, ctx: {
+        'assignments': [{'user': user, 'roles': [ctx['role_name']]} for user in ctx['member_ids']],
+    }),
+    ('audit_logs.list', 'get', '/api/audit-logs/', None),
+    ('audit_logs.filtered', 'get', '/api/audit-logs/?action=update', None),
+    ('audit_logs.summary', 'get', '/api/audit-logs/summary/?action=failed_login&until={audit_until}', None),
+    ('token.obtain', 'post', '/api/token/', _login),
+    ('token.refresh', 'post', '/api/token/refresh/', lambda i, ctx: {'refresh': ctx['refresh']}),
+    ('token.stateless', 'post', '/api/token/stateless/', _login),
+    ('async.token', 'post', '/api/async/token/', _login),
+    ('async.users.register', 'post', '/api/async/users/register/', lambda i, ctx: {
+        **_register(i, ctx), 'username': f'bench-async-{ctx["run"]}-{i}',
+    }),
+    ('async.users.list', 'get', '/api/async/users/', None),
+    ('async.roles.list', 'get', '/api/async/roles/', None),
+    ('async.permissions.list', 'get', '/api/async/permissions/', None),
+]
+
+
+def benchmark_context(user):
+    """Ids and credentials the endpoint paths and bodies refer to."""
+    membership = UserCompanyMembership.objects.select_related('company').get(user=user)
+    role = membership.company.role_set.order_by('pk').first()
+    refresh = RefreshToken.for_user(user)
+    return {
+        'run': int(time.time()),
+        'username': user.username,
+        'user': user.pk,
+        'company': membership.company_id,
+        'membership': membership.pk,
+        'role': role.pk,
+        'role_name': role.name,
+        'permission': Permission.objects.order_by('pk').values_list('pk', flat=True).first(),
+        'member_ids': list(
+            UserCompanyMembership.objects.filter(company=membership.company_id)
+            .order_by('pk').values_list('user_id', flat=True)[:10]
+        ),
+        'access': str(refresh.access_token),
+        'refresh': str(refresh),
+        # The seeded audit log ends there.
+        'audit_until': SEED_EPOCH.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+
+
+def _response_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def benchmark_endpoint(method, path, body, ctx, requests, concurrency):
+    """
+    Sends ``requests`` requests to one endpoint through the WSGI handler from
+    ``concurrency`` threads. Returns the latency summary with queries (from
+    the ``X-Query-Count`` header) and bytes per request.
+    """
+    path = path.format(**ctx)
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {ctx["access"]}'}
+
+    def call(index):
+        # Server errors (e.g. SQLite lock timeouts) are reported as 500s.
+        client = Client(raise_request_exception=False)
+        data = body(index, ctx) if body else None
+        started = time.perf_counter()
+        if method == 'get':
+            response = client.get(path, **headers)
+        else:
+            response = getattr(client, method)(path, data, content_type='application/json', **headers)
+        size = _response_size(response)
+        latency = (time.perf_counter() - started) * 1000
+        return latency, response.status_code, int(response.get('X-Query-Count', 0)), size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    report = summarize([latency for latency, _, _, _ in results], elapsed)
+    queries = [count for _, _, count, _ in results]
+    sizes = [size for _, _, _, size in results]
+    report.update({
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'bytes_per_request': round(statistics.fmean(sizes), 1),
+        'statuses': dict(Counter(str(status) for _, status, _, _ in results)),
+        'errors': sum(1 for _, status, _, _ in results if status >= 400),
+    })
+    return report
+
+
+# Searches of the user list, for a tenant seeded by core.seeding with seed
+# 0: usernames and emails are "s0c<company>u<n>".
+USER_SEARCHES = [
+    ('search.exact_prefix', '/api/users/?search=s0c0u12345'),
+    ('search.broad_prefix', '/api/users/?search=s0c0u1'),
+    ('search.email_prefix', '/api/users/?search=s0c0u4242%40'),
+    ('search.no_match', '/api/users/?search=nobody'),
+    ('search.ordered_by_username', '/api/users/?search=s0c0u2&ordering=username'),
+    ('search.contains', '/api/users/?contains=u31337'),
+    ('filter.role', '/api/users/?role={role}'),
+    ('filter.inactive', '/api/users/?is_active=false'),
+    ('filter.joined', '/api/users/?joined_since=2024-06-01T00:00:00Z&joined_until=2024-06-08T00:00:00Z'),
+]
+
+
+def benchmark_user_search(user, requests, only=None):
+    """
+    Runs each of USER_SEARCHES ``requests`` times, one at a time. Reports the
+    latency summary, queries per request and the rows on the first page.
+    """
+    ctx = benchmark_context(user)
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {ctx["access"]}'}
+    client = Client(raise_request_exception=False)
+    report = {}
+    for name, path in USER_SEARCHES:
+        if only and name not in only:
+            continue
+        path = path.format(**ctx)
+        latencies, queries, statuses, rows = [], [], Counter(), 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            begun = time.perf_counter()
+            response = client.get(path, **headers)
+            latencies.append((time.perf_counter() - begun) * 1000)
+            queries.append(int(response.get('X-Query-Count', 0)))
+            statuses[str(response.status_code)] += 1
+            if response.status_code == 200:
+                rows = len(response.json()['results'])
+        result = summarize(latencies, time.perf_counter() - started)
+        result.update({
+            'path': path,
+            'queries_per_request': round(statistics.fmean(queries), 2),
+            'rows': rows,
+            'statuses': dict(statuses),
+        })
+        report[name] = result
+    get_audit_writer().flush()
+    return report
+
+
+# List endpoints with a values() read path (core.fastpath).
+READ_PATH_ENDPOINTS = [
+    ('users.list', '/api/users/?page_size={page_size}'),
+    ('roles.list', '/api/roles/?page_size={page_size}'),
+    ('permissions.list', '/api/permissions/?page_size={page_size}'),
+    ('memberships.list', '/api/memberships/?page_size={page_size}'),
+]
+
+
+def benchmark_read_paths(user, requests, page_size):
+    """
+    Times each of READ_PATH_ENDPOINTS through the serializers and stdlib JSON
+    (``FAST_READ_PATH = False``) and through the values() path, one request
+    at a time. Reports both summaries, the throughput ratio, and whether the
+    two responses were byte-identical.
+    """
+    ctx = benchmark_context(user)
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {ctx["access"]}'}
+    client = Client(raise_request_exception=False)
+    report = {}
+    for name, path in READ_PATH_ENDPOINTS:
+        path = path.format(page_size=page_size)
+        result = {'path': path}
+        bodies = {}
+        for label, enabled in (('serializer', False), ('values', True)):
+            with override_settings(FAST_READ_PATH=enabled):
+                client.get(path, **headers)  # warm-up
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(requests):
+                    begun = time.perf_counter()
+                    response = client.get(path, **headers)
+                    latencies.append((time.perf_counter() - begun) * 1000)
+                result[label] = summarize(latencies, time.perf_counter() - started)
+                result[label]['status'] = response.status_code
+                result[label]['queries_per_request'] = int(response.get('X-Query-Count', 0))
+                bodies[label] = response.content
+        result['speedup'] = round(result['values']['throughput'] / result['serializer']['throughput'], 2)
+        result['identical'] = bodies['serializer'] == bodies['values']
+        result['bytes'] = len(bodies['values'])
+        report[name] = result
+    get_audit_writer().flush()
+    return report
+
+
+def benchmark_endpoints(user, requests, concurrency, only=None):
+    """Benchmarks every endpoint in ENDPOINTS (or those named in ``only``) in turn."""
+    ctx = benchmark_context(user)
+    report = {}
+    for name, method, path, body in ENDPOINTS:
+        if only and name not in only:
+            continue
+        report[name] = benchmark_endpoint(method, path, body, ctx, requests, concurrency)
+    # Buffered audit entries belong to the throwaway database.
+    get_audit_writer().flush()
+    connection.close()
+    return report
+
+
+# Buckets that never refuse a request, to time the throttle's work alone.
+UNLIMITED_BUCKETS = {scope: {'rate': 10 ** 6, 'burst': 10 ** 9} for scope in ('user', 'company', 'anon')}
+
+
+def time_bucket(bucket, key, calls):
+    """Microseconds per ``TokenBucket.take`` over ``calls`` calls."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        bucket.take(key, 1)
+    return round((time.perf_counter() - started) / calls * 1e6, 2)
+
+
+def benchmark_throttle(user, requests, quiet_user=None, buckets=None):
+    """
+    Measures what core.throttling costs and what it does under load.
+
+    ``buckets`` times TokenBucket.take alone for a full bucket (the usual
+    case), a draining one and a refusing one. ``overhead`` sends
+    ``requests`` requests with the throttle off and on (with buckets that
+    never refuse), alternating, and compares their latencies. With
+    ``quiet_user`` of another company, ``fairness`` floods the API as
+    ``user`` under ``buckets`` (default: the configured ones) and reports
+    both users' statuses.
+    """
+    cases = {
+        'full': (TokenBucket(rate=10 ** 6, burst=10), 'bench:full'),
+        'draining': (TokenBucket(rate=1, burst=10 ** 9), 'bench:draining'),
+        'refusing': (TokenBucket(rate=0.001, burst=1), 'bench:refusing'),
+    }
+    report = {'buckets_us_per_take': {
+        name: time_bucket(bucket, key, requests * 10) for name, (bucket, key) in cases.items()
+    }}
+
+    ctx = benchmark_context(user)
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {ctx["access"]}'}
+    client = Client(raise_request_exception=False)
+    path = '/api/permissions/'
+    latencies = {'off': [], 'on': []}
+    codes = Counter()
+    client.get(path, **headers)  # warm-up
+    for _ in range(requests):
+        # Alternating, so both sides see the same drift (caches, the audit writer).
+        for label, config in (('off', {}), ('on', UNLIMITED_BUCKETS)):
+            with override_settings(API_THROTTLE_BUCKETS=config):
+                started = time.perf_counter()
+                response = client.get(path, **headers)
+                latencies[label].append((time.perf_counter() - started) * 1000)
+                codes[str(response.status_code)] += 1
+    overhead = {label: summarize(values, sum(values) / 1000) for label, values in latencies.items()}
+    overhead['statuses'] = dict(codes)
+    overhead['path'] = path
+    overhead['added_p50_ms'] = round(overhead['on']['p50_ms'] - overhead['off']['p50_ms'], 3)
+    overhead['added_mean_ms'] = round(overhead['on']['mean_ms'] - overhead['off']['mean_ms'], 3)
+    report['overhead'] = overhead
+
+    if quiet_user is not None:
+        buckets = buckets or settings.API_THROTTLE_BUCKETS
+        quiet_headers = {'HTTP_AUTHORIZATION': f'Bearer {benchmark_context(quiet_user)["access"]}'}
+        statuses = {'noisy': Counter(), 'quiet': Counter()}
+        retry_after = set()
+        with override_settings(API_THROTTLE_BUCKETS=buckets):
+            for i in range(requests):
+                response = client.get(path, **headers)
+                statuses['noisy'][str(response.status_code)] += 1
+                if response.has_header('Retry-After'):
+                    retry_after.add(int(response['Retry-After']))
+                if i % 10 == 0:
+                    response = client.get(path, **quiet_headers)
+                    statuses['quiet'][str(response.status_code)] += 1
+        report['fairness'] = {
+            'buckets': buckets,
+            'statuses': {name: dict(counts) for name, counts in statuses.items()},
+            'retry_after_seconds': sorted(retry_after),
+        }
+    get_audit_writer().flush()
+    return report
@@ -0,0 +1,108 @@
+# core/caching.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Version counters used to invalidate cached permission sets.
+# ``GLOBAL`` covers the permission catalog itself, ``COMPANY`` covers role
+# definitions of a company and ``USER`` covers the roles held by a user.
+PERMISSION_GLOBAL_VERSION_KEY = 'perms:v:global'
+PERMISSION_COMPANY_VERSION_KEY = 'perms:v:company:%s'
+PERMISSION_USER_VERSION_KEY = 'perms:v:user:%s'
+PERMISSION_MAP_KEY = 'perms:map:%s'
+
+# Version counters for API responses, used to build ETags. A resource is
+# either global (the permission catalog) or kept per company, in which case
+# the ``*`` counter moves with every company's and covers superusers.
+CONTENT_VERSION_KEY = 'content:v:%s:%s'
+ALL_COMPANIES = '*'
+
+
+def get_cache():
+    """Returns the shared cache backend used by the core app."""
+    return caches[getattr(settings, 'CORE_CACHE_ALIAS', 'default')]
+
+
+def _fresh_version():
+    # Counters start from a time-based value instead of 1, so a counter that
+    # was evicted from the cache never comes back at a value it already had.
+    return time.time_ns()
+
+
+def bump_version(key):
+    """Increments the version counter stored under ``key``."""
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, _fresh_version(), timeout=None):
+            return cache.get(key)
+        return cache.incr(key)
+
+
+def content_version_key(resource, company_id=None):
+    return CONTENT_VERSION_KEY % (resource, 'global' if company_id is None else company_id)
+
+
+def bump_content_version(resource, company_id=None):
+    """Marks API responses listing ``resource`` (of one company, if given) as changed."""
+    if company_id is None:
+        bump_version(content_version_key(resource))
+    else:
+        bump_version(content_version_key(resource, company_id))
+        bump_version(content_version_key(resource, ALL_COMPANIES))
+
+
+def get_versions(keys):
+    """
+    Returns a dict of ``key -> version`` for the given counter keys, creating
+    any counter that does not exist yet. Costs one cache round trip when all
+    counters are present.
+    """
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _fresh_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+class LRUCache:
+    """
+    A small thread-safe, process-local LRU mapping used in front of the shared
+    cache backend.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
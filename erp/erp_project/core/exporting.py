@@ -0,0 +1,135 @@
+# core/exporting.py
+"""
+Streaming NDJSON and CSV exports for list endpoints.
+
+Rows are read with ``QuerySet.iterator(chunk_size=...)`` (prefetches run per
+chunk) and serialized a few at a time into a StreamingHttpResponse, so
+memory use does not grow with the number of rows. The CSV header goes out
+before the first query runs.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Rows serialized per write to the response.
+ROWS_PER_WRITE = 100
+
+
+def encode_json(value):
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def _csv_value(value):
+    # Nested lists and objects are written as JSON so the cell stays lossless.
+    if isinstance(value, (list, dict)):
+        return encode_json(value)
+    return value
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One JSON object per line. List views stream instead of rendering."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used for non-list responses such as errors.
+        if data is None:
+            return b''
+        return (encode_json(data) + '\n').encode()
+
+    def header(self, fields):
+        return ''
+
+    def rows(self, rows, fields):
+        return ''.join(encode_json(row) + '\n' for row in rows)
+
+
+class CSVRenderer(BaseRenderer):
+    """CSV with a header line. List views stream instead of rendering."""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used for non-list responses such as errors.
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        fields = list(rows[0]) if rows and isinstance(rows[0], dict) else []
+        return (self.header(fields) + self.rows(rows, fields)).encode()
+
+    def header(self, fields):
+        return self._write([fields])
+
+    def rows(self, rows, fields):
+        return self._write([_csv_value(row.get(field)) for field in fields] for row in rows)
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+
+EXPORT_RENDERERS = (NDJSONRenderer, CSVRenderer)
+
+
+def keyset_after(obj, ordering):
+    """
+    A Q object matching the rows that come after ``obj`` in ``ordering``
+    (field names, ``-`` for descending), which must end in a unique field.
+    """
+    condition = Q()
+    equal = Q()
+    for field in ordering:
+        name = field.lstrip('-')
+        value = getattr(obj, name)
+        lookup = f'{name}__lt' if field.startswith('-') else f'{name}__gt'
+        condition |= equal & Q(**{lookup: value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def iter_export(queryset, ordering, serializer, renderer, chunk_size=2000):
+    """
+    Yields the encoded export of ``queryset`` sorted by ``ordering``: the
+    renderer's header, then ``serializer``'s representation of every row.
+
+    The first ROWS_PER_WRITE rows are fetched on their own so the response
+    starts before a full chunk (and its prefetches) has been loaded; the rest
+    continue from the last of them by keyset.
+    """
+    fields = [name for name, field in serializer.fields.items() if not field.write_only]
+    header = renderer.header(fields)
+    if header:
+        yield header.encode()
+    queryset = queryset.order_by(*ordering)
+    first = list(queryset[:ROWS_PER_WRITE])
+    if first:
+        yield renderer.rows([serializer.to_representation(obj) for obj in first], fields).encode()
+    if len(first) < ROWS_PER_WRITE:
+        return
+    objects = queryset.filter(keyset_after(first[-1], ordering)).iterator(chunk_size=chunk_size)
+    while True:
+        batch = list(islice(objects, ROWS_PER_WRITE))
+        if not batch:
+            break
+        yield renderer.rows([serializer.to_representation(obj) for obj in batch], fields).encode()
+
+
+def streaming_export(queryset, ordering, serializer, renderer, filename, chunk_size=2000):
+    """Returns a StreamingHttpResponse exporting ``queryset`` as an attachment."""
+    response = StreamingHttpResponse(
+        iter_export(queryset, ordering, serializer, renderer, chunk_size=chunk_size),
+        content_type=f'{renderer.media_type}; charset={renderer.charset}',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{renderer.format}"'
+    return response
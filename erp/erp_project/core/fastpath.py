@@ -0,0 +1,179 @@
+# core/fastpath.py
+"""
+A values()-based read path for list endpoints.
+
+ValuesReader builds the same dicts a view's serializer would, straight from
+``queryset.values()``: plain columns are copied (or converted by the
+serializer field when a conversion is needed, e.g. datetimes), and related
+lists are read with one query per relation for the whole page instead of
+going through model instances and prefetch caches. Views enable it with
+``values_reader`` (see core.views.FastListMixin).
+
+FastJSONRenderer renders exactly the bytes of DRF's JSONRenderer, through
+orjson when it is installed. ``FAST_READ_PATH = False`` turns both off.
+"""
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Role, UserCompanyMembership
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# Fields whose representation of a database value is the value itself.
+PLAIN_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.ModelField,
+    serializers.PrimaryKeyRelatedField,
+    serializers.ReadOnlyField,
+)
+
+
+def fast_read_enabled():
+    return getattr(settings, 'FAST_READ_PATH', True)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when available. Falls back to the
+    stdlib encoder for indented output, non-compact or ASCII-only settings,
+    and anything orjson rejects (non-string keys, integers over 64 bits).
+    orjson formats floats' exponents differently (``1e16``, not
+    ``1e+16``); no endpoint here renders floats.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or not fast_read_enabled() or not self.compact or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # Datetimes and everything else orjson does not know go through
+            # DRF's encoder, which formats them differently from orjson.
+            ret = orjson.dumps(
+                data, default=JSONEncoder().default, option=orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped like JSONRenderer does, to stay a strict JavaScript subset.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def datetime_representation(field):
+    """
+    ``field.to_representation`` for datetimes, skipping DRF's time zone
+    handling for the common case of UTC values rendered in UTC as ISO 8601.
+    """
+    convert = field.to_representation
+
+    def represent(value):
+        if (
+            value.tzinfo is dt_timezone.utc and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+            and timezone.get_current_timezone_name() == 'UTC'
+        ):
+            return value.isoformat()[:-6] + 'Z'
+        return convert(value)
+    return represent
+
+
+class ValuesReader:
+    """
+    Reads ``serializer_class``'s representation of a page of rows with
+    ``values()``. ``relations`` maps the serializer's related list fields to
+    functions taking the page's primary keys and returning
+    ``{pk: [representation, ...]}``.
+    """
+    def __init__(self, serializer_class, relations=None):
+        self.serializer_class = serializer_class
+        self.relations = relations or {}
+        self._plan = None
+
+    def plan(self):
+        """``[(name, column, converter)]`` in field order; column None for relations."""
+        if self._plan is None:
+            plan = []
+            for name, field in self.serializer_class().fields.items():
+                if field.write_only:
+                    continue
+                if name in self.relations:
+                    plan.append((name, None, None))
+                elif isinstance(field, serializers.DateTimeField):
+                    plan.append((name, field.source, datetime_representation(field)))
+                elif isinstance(field, PLAIN_FIELDS):
+                    plan.append((name, field.source, None))
+                else:
+                    raise TypeError(f"{self.serializer_class.__name__}.{name} cannot be read from values()")
+            self._plan = plan
+        return self._plan
+
+    def columns(self):
+        columns = [column for _, column, _ in self.plan() if column is not None]
+        return columns if 'pk' in columns or 'id' in columns else ['pk', *columns]
+
+    def values(self, queryset, extra=()):
+        """``queryset.values()`` of the columns read, plus ``extra`` (e.g. pagination ordering)."""
+        columns = self.columns()
+        columns += [column for column in extra if column not in columns]
+        return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+    def read(self, rows):
+        """Turns ``values()`` rows into the serializer's representations."""
+        pk = 'id' if 'id' in self.columns() else 'pk'
+        keys = [row[pk] for row in rows]
+        related = {name: load(keys) for name, load in self.relations.items()} if keys else {}
+        results = []
+        for row in rows:
+            item = {}
+            for name, column, convert in self.plan():
+                if column is None:
+                    item[name] = related[name].get(row[pk], [])
+                else:
+                    value = row[column]
+                    item[name] = convert(value) if convert is not None and value is not None else value
+            results.append(item)
+        return results
+
+
+def user_membership_labels(user_ids):
+    """``UserSerializer.company_memberships``: "<username> @ <company>" per membership."""
+    labels = defaultdict(list)
+    rows = (
+        UserCompanyMembership.objects.filter(user_id__in=user_ids, company__deleted_at__isnull=True).order_by('pk')
+        .values_list('user_id', 'user__username', 'company__name')
+    )
+    for user_id, username, company in rows:
+        labels[user_id].append(f"{username} @ {company}")
+    return labels
+
+
+def role_permission_codenames(role_ids):
+    codenames = defaultdict(list)
+    rows = (
+        Role.permissions.through.objects.filter(role_id__in=role_ids).order_by('permission_id')
+        .values_list('role_id', 'permission__codename')
+    )
+    for role_id, codename in rows:
+        codenames[role_id].append(codename)
+    return codenames
+
+
+def membership_role_names(membership_ids):
+    names = defaultdict(list)
+    rows = (
+        UserCompanyMembership.roles.through.objects.filter(usercompanymembership_id__in=membership_ids)
+        .order_by('role_id').values_list('usercompanymembership_id', 'role__name')
+    )
+    for membership_id, name in rows:
+        names[membership_id].append(name)
+    return names
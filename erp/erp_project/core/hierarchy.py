@@ -0,0 +1,89 @@
+# core/hierarchy.py
+"""
+Role inheritance.
+
+A role grants its own permissions and those of every ancestor. RoleAncestor
+holds the transitive closure of ``Role.parent`` (each role is its own
+ancestor at depth 0), so effective permissions are a plain join from a
+membership's roles through RoleAncestor to the ancestors' permissions, with
+no recursive walk.
+
+core.signals keeps the closure up to date incrementally: a new role copies
+its parent's rows, a re-parented role's subtree swaps its old ancestors for
+the new parent's, and deleting a role cuts its subtree loose (children
+become roots, as ``on_delete=SET_NULL`` makes them). Code that writes roles
+or parents with ``bulk_create`` or ``QuerySet.update()`` must write the
+closure rows itself.
+"""
+from django.core.exceptions import ValidationError
+
+from .models import RoleAncestor
+
+CYCLE_ERROR = "A role cannot inherit from itself or from one of its descendants."
+COMPANY_ERROR = "A role can only inherit from a role of the same company."
+
+
+def validate_parent(role, parent):
+    """Raises ValidationError unless ``parent`` may become the parent of ``role``."""
+    if parent is None:
+        return
+    if parent.company_id != role.company_id:
+        raise ValidationError({'parent': COMPANY_ERROR})
+    if role.pk is not None and RoleAncestor.objects.filter(descendant_id=parent.pk, ancestor_id=role.pk).exists():
+        raise ValidationError({'parent': CYCLE_ERROR})
+
+
+def _inherited_ancestors(role):
+    """
+    ``[(ancestor_id, depth)]`` that ``role`` gets through its parent, depths
+    counted from ``role``. Raises ValidationError for a cycle or a parent of
+    another company.
+    """
+    if role.parent_id is None:
+        return []
+    rows = list(
+        RoleAncestor.objects.filter(descendant_id=role.parent_id)
+        .values_list('ancestor_id', 'depth', 'ancestor__company_id')
+    )
+    for ancestor_id, _, company_id in rows:
+        if company_id != role.company_id:
+            raise ValidationError({'parent': COMPANY_ERROR})
+        if ancestor_id == role.pk:
+            raise ValidationError({'parent': CYCLE_ERROR})
+    return [(ancestor_id, depth + 1) for ancestor_id, depth, _ in rows]
+
+
+def insert_role(role):
+    """Adds the closure rows of a newly created ``role``."""
+    RoleAncestor.objects.bulk_create(
+        [RoleAncestor(descendant_id=role.pk, ancestor_id=role.pk, depth=0)]
+        + [
+            RoleAncestor(descendant_id=role.pk, ancestor_id=ancestor_id, depth=depth)
+            for ancestor_id, depth in _inherited_ancestors(role)
+        ]
+    )
+
+
+def move_role(role):
+    """Updates the closure after ``role.parent`` changed, for its whole subtree."""
+    inherited = _inherited_ancestors(role)
+    subtree = list(RoleAncestor.objects.filter(ancestor_id=role.pk).values_list('descendant_id', 'depth'))
+    subtree_ids = [descendant_id for descendant_id, _ in subtree]
+    # Any ancestor of a subtree role outside the subtree came from the old parent.
+    RoleAncestor.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+    RoleAncestor.objects.bulk_create(
+        RoleAncestor(descendant_id=descendant_id, ancestor_id=ancestor_id, depth=below + above)
+        for descendant_id, below in subtree
+        for ancestor_id, above in inherited
+    )
+
+
+def detach_role(role):
+    """Before ``role`` is deleted: its descendants stop inheriting from it and its ancestors."""
+    descendant_ids = list(
+        RoleAncestor.objects.filter(ancestor_id=role.pk, depth__gt=0).values_list('descendant_id', flat=True)
+    )
+    if not descendant_ids:
+        return
+    ancestor_ids = list(RoleAncestor.objects.filter(descendant_id=role.pk).values_list('ancestor_id', flat=True))
+    RoleAncestor.objects.filter(descendant_id__in=descendant_ids, ancestor_id__in=ancestor_ids).delete()
@@ -0,0 +1,268 @@
+# core/importing.py
+import csv
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .caching import bump_content_version
+from .models import Company, User, UserCompanyMembership
+
+FORMATS = ('csv', 'ndjson')
+
+# Most errors are kept per import; the rest are only counted.
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def guess_format(name):
+    """Guesses the import format from a file name, defaulting to CSV."""
+    return 'ndjson' if name and name.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def iter_rows(stream, format='csv'):
+    """
+    Yields ``(line_number, row_dict)`` from a text or binary stream of CSV
+    (with a header line) or NDJSON, one row at a time.
+    """
+    if format not in FORMATS:
+        raise ImportFormatError(f"Unknown import format: {format}")
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            row = {'__error__': "Line is not a JSON object."}
+        yield line_number, row
+
+
+def _hash_password(raw_password):
+    # Runs in the worker processes; must stay importable at module level.
+    return make_password(raw_password or None)
+
+
+def clean_user_fields(row):
+    """
+    Returns the ``(username, email)`` of ``row`` normalized and validated as
+    on registration (UserManager.create_user and the model fields'
+    validators). Raises ValidationError with a message for the import report.
+    """
+    username = User.normalize_username((row.get('username') or '').strip())
+    email = User.objects.normalize_email((row.get('email') or '').strip())
+    if not username:
+        raise ValidationError("username is required.")
+    for name, value in (('username', username), ('email', email)):
+        try:
+            User._meta.get_field(name).run_validators(value)
+        except ValidationError as e:
+            raise ValidationError(f"Invalid {name}: {' '.join(e.messages)}")
+    return username, email
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+class UserImporter:
+    """
+    Imports users from an iterable of rows with ``username``, ``email``,
+    ``password`` and ``company_name`` columns.
+
+    Usernames and emails are normalized and validated as on registration
+    (``clean_user_fields``). Rows are handled in chunks of ``batch_size`` so
+    memory stays bounded. Each chunk hashes its passwords on ``executor`` (a
+    process pool, or inline when None) and is written with ``bulk_create`` in
+    one transaction; rows whose username was registered meanwhile are
+    reported and the rest written again.
+    Company names are resolved through a name -> id map kept for the whole
+    import.
+    """
+    def __init__(self, batch_size=1000, executor=None):
+        self.batch_size = batch_size
+        self.executor = executor
+        self.company_ids = {}
+
+    def run(self, rows):
+        result = ImportResult()
+        started = time.perf_counter()
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.batch_size))
+            if not chunk:
+                break
+            result.rows += len(chunk)
+            self._import_chunk(chunk, result)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def _import_chunk(self, chunk, result):
+        valid = []
+        seen = set()
+        for line, row in chunk:
+            if '__error__' in row:
+                result.add_error(line, row['__error__'])
+                continue
+            try:
+                username, email = clean_user_fields(row)
+            except ValidationError as e:
+                result.add_error(line, e.messages[0])
+                continue
+            if username in seen:
+                result.add_error(line, f"Duplicate username {username} in this import.")
+            else:
+                seen.add(username)
+                valid.append((line, username, email, row))
+
+        taken = self._taken_usernames([username for _, username, _, _ in valid])
+        # Companies already resolved by this import are known to be live.
+        unknown = {(row.get('company_name') or '').strip() for *_, row in valid} - {''} - set(self.company_ids)
+        deleted = set()
+        if unknown:
+            deleted = set(
+                Company.objects.filter(name__in=unknown, deleted_at__isnull=False).values_list('name', flat=True)
+            )
+        new_rows = []
+        for line, username, email, row in valid:
+            company_name = (row.get('company_name') or '').strip()
+            if username in taken:
+                result.add_error(line, f"A user with username {username} already exists.")
+            elif company_name in deleted:
+                result.add_error(line, f"Company {company_name} is being deleted.")
+            else:
+                new_rows.append((line, username, email, row))
+        if not new_rows:
+            return
+
+        passwords = [row.get('password') or '' for *_, row in new_rows]
+        if self.executor is not None:
+            hashes = list(self.executor.map(_hash_password, passwords, chunksize=max(1, len(passwords) // 32)))
+        else:
+            hashes = [_hash_password(password) for password in passwords]
+        new_rows = [(*new_row, password_hash) for new_row, password_hash in zip(new_rows, hashes)]
+
+        while True:
+            known_companies = dict(self.company_ids)
+            try:
+                users, memberships = self._write_chunk(new_rows)
+                break
+            except IntegrityError:
+                # Names registered since they were checked. Companies created
+                # in the rolled back transaction are gone again.
+                self.company_ids = known_companies
+                taken = self._taken_usernames([username for _, username, *_ in new_rows])
+                if not taken:
+                    raise
+                for line, username, *_ in new_rows:
+                    if username in taken:
+                        result.add_error(line, f"A user with username {username} already exists.")
+                new_rows = [new_row for new_row in new_rows if new_row[1] not in taken]
+                if not new_rows:
+                    return
+        # bulk_create sends no signals; membership listings change per company.
+        for company_id in {membership.company_id for membership in memberships}:
+            bump_content_version('memberships', company_id)
+        result.created += len(users)
+
+    def _taken_usernames(self, usernames):
+        return set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+    def _write_chunk(self, new_rows):
+        """Creates the users and memberships of ``new_rows`` in one transaction."""
+        with transaction.atomic():
+            company_ids = self._resolve_companies(
+                {(row.get('company_name') or '').strip() for _, _, _, row, _ in new_rows} - {''}
+            )
+            users = User.objects.bulk_create([
+                User(username=username, email=email, password=password_hash)
+                for _, username, email, _, password_hash in new_rows
+            ])
+            memberships = UserCompanyMembership.objects.bulk_create([
+                UserCompanyMembership(user=user, company_id=company_ids[company_name])
+                for user, (_, _, _, row, _) in zip(users, new_rows)
+                for company_name in [(row.get('company_name') or '').strip()]
+                if company_name
+            ])
+        return users, memberships
+
+    def _resolve_companies(self, names):
+        missing = [name for name in names if name not in self.company_ids]
+        if missing:
+            Company.objects.bulk_create([Company(name=name) for name in missing], ignore_conflicts=True)
+            self.company_ids.update(
+                Company.objects.filter(name__in=missing).values_list('name', 'pk')
+            )
+        return self.company_ids
+
+
+def create_hash_executor(workers=None, mp_context=None):
+    """
+    Returns a process pool for password hashing, or None to hash inline when
+    ``workers`` is 0.
+    """
+    if workers is None:
+        workers = getattr(settings, 'USER_IMPORT_WORKERS', None) or os.cpu_count()
+    if not workers:
+        return None
+    # Workers started with spawn or forkserver begin with Django unconfigured,
+    # and cannot import this module (it imports the models) until set up.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=django.setup)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hash_executor():
+    """Returns the process pool shared by API imports, creating it on first use."""
+    global _executor
+    if _executor is None and getattr(settings, 'USER_IMPORT_WORKERS', None) != 0:
+        with _executor_lock:
+            if _executor is None:
+                _executor = create_hash_executor()
+    return _executor
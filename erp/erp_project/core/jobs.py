@@ -0,0 +1,268 @@
+# core/jobs.py
+"""
+A database-backed job queue.
+
+``enqueue('name', **payload)`` stores a Job in the current transaction, so
+a job is only visible to workers once the work that queued it commits.
+``manage.py run_workers --concurrency N`` runs N worker threads; each
+claims the oldest due job, calls the handler ``JOB_HANDLERS[name]`` (a
+dotted path) with the payload as keyword arguments, and records the
+outcome.
+
+Claiming uses ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it, so workers never wait on each other's rows. Elsewhere (SQLite)
+a worker picks candidates and takes one with a conditional UPDATE; losing
+the race to another worker just moves on to the next candidate.
+
+A failed job is retried after ``JOB_RETRY_BACKOFF * 2 ** (attempts - 1)``
+seconds, capped at ``JOB_RETRY_MAX_DELAY``, until ``max_attempts``. A job
+whose worker died is requeued once its lease (``JOB_LEASE_SECONDS``)
+expires, so handlers should be idempotent; claiming counts as an attempt,
+so a job that keeps taking its worker down fails after ``max_attempts``.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_WRITE_ATTEMPTS = 5
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_handler(name):
+    handlers = _setting('JOB_HANDLERS', {})
+    if name not in handlers:
+        raise KeyError(f"Unknown job {name!r}; add it to JOB_HANDLERS.")
+    return import_string(handlers[name])
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """Queues job ``name`` to run ``delay`` seconds from now with ``payload`` (JSON) as arguments."""
+    get_handler(name)
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or _setting('JOB_MAX_ATTEMPTS', 5),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds before the next try of a job that has failed ``attempts`` times."""
+    base = _setting('JOB_RETRY_BACKOFF', 5)
+    return min(base * 2 ** (attempts - 1), _setting('JOB_RETRY_MAX_DELAY', 3600))
+
+
+def claim_job(worker_id):
+    """Marks the oldest due job as running for ``worker_id`` and returns it, or None."""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')
+    claim = {
+        'status': Job.RUNNING, 'locked_by': worker_id, 'locked_at': now, 'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = due.select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**claim)
+    else:
+        # No row locks: take the first candidate nobody else took meanwhile.
+        for pk in due.values_list('pk', flat=True)[:5]:
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**claim):
+                break
+        else:
+            return None
+    return Job.objects.get(pk=pk)
+
+
+def requeue_expired():
+    """
+    Requeues running jobs whose lease expired, or fails those that have no
+    attempts left. Returns how many were requeued or failed.
+    """
+    now = timezone.now()
+    expired = Job.objects.filter(
+        status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=_setting('JOB_LEASE_SECONDS', 600)),
+    )
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, locked_by='', locked_at=None,
+        last_error="Lease expired after the last attempt.",
+    )
+    return failed + expired.update(status=Job.QUEUED, locked_by='', locked_at=None, last_error="Lease expired.")
+
+
+def prune_finished():
+    """Deletes jobs that succeeded more than ``JOB_RETENTION_SECONDS`` ago."""
+    cutoff = timezone.now() - timedelta(seconds=_setting('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+    return Job.objects.filter(status=Job.SUCCEEDED, finished_at__lt=cutoff).delete()[0]
+
+
+def run_job(job, worker_id):
+    """Runs a claimed ``job`` and records its outcome. Returns the new status."""
+    try:
+        get_handler(job.name)(**job.payload)
+    except Exception as e:
+        error = ''.join(traceback.format_exception(e))
+        if job.attempts < job.max_attempts:
+            changes = {
+                'status': Job.QUEUED,
+                'run_after': timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+            }
+        else:
+            changes = {'status': Job.FAILED, 'finished_at': timezone.now()}
+        changes.update(last_error=error, locked_by='', locked_at=None)
+        logger.warning("Job %s #%s failed (attempt %s of %s): %s", job.name, job.pk, job.attempts,
+                       job.max_attempts, e)
+    else:
+        changes = {'status': Job.SUCCEEDED, 'finished_at': timezone.now(), 'locked_by': '', 'locked_at': None}
+    # A job requeued after its lease expired belongs to someone else now.
+    outcome = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=worker_id)
+    for attempt in range(OUTCOME_WRITE_ATTEMPTS):
+        try:
+            outcome.update(**changes)
+            break
+        except OperationalError:
+            # SQLite reports a busy database instead of waiting on row
+            # locks; otherwise the job would run again after its lease.
+            if attempt == OUTCOME_WRITE_ATTEMPTS - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+    return changes['status']
+
+
+def run_due_jobs(worker_id, metrics=None):
+    """Claims and runs due jobs in the calling thread until none is due. Returns how many ran."""
+    ran = 0
+    while True:
+        job = claim_job(worker_id)
+        if job is None:
+            return ran
+        started = time.perf_counter()
+        status = run_job(job, worker_id)
+        if metrics is not None:
+            metrics.record(job, status, time.perf_counter() - started)
+        ran += 1
+
+
+class WorkerMetrics:
+    """Thread-safe counters of one ``run_workers`` process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.outcomes = Counter()
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.claims = 0
+
+    def record(self, job, status, duration):
+        with self._lock:
+            self.claims += 1
+            self.outcomes[status] += 1
+            self.busy_seconds += duration
+            # Time from when the job became due to when it was claimed.
+            self.wait_seconds += max((job.locked_at - job.run_after).total_seconds(), 0.0)
+
+    def as_dict(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'jobs': self.claims,
+                'succeeded': self.outcomes[Job.SUCCEEDED],
+                'retried': self.outcomes[Job.QUEUED],
+                'failed': self.outcomes[Job.FAILED],
+                'jobs_per_second': round(self.claims / elapsed, 2) if elapsed else 0.0,
+                'mean_run_ms': round(self.busy_seconds / self.claims * 1000, 2) if self.claims else 0.0,
+                'mean_wait_ms': round(self.wait_seconds / self.claims * 1000, 2) if self.claims else 0.0,
+            }
+
+
+def queue_stats():
+    """Jobs per status and name, and the age of the oldest due job, from the job table."""
+    now = timezone.now()
+    counts = {status: 0 for status, _ in Job.STATUS_CHOICES}
+    by_name = {}
+    for row in Job.objects.order_by().values('status', 'name').annotate(jobs=Count('pk')):
+        counts[row['status']] += row['jobs']
+        by_name.setdefault(row['name'], {})[row['status']] = row['jobs']
+    oldest = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).aggregate(oldest=Min('run_after'))['oldest']
+    return {
+        'status': counts,
+        'jobs': by_name,
+        'oldest_due_seconds': round((now - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+
+class WorkerPool:
+    """
+    ``concurrency`` threads claiming and running jobs until ``stop()``.
+    With ``burst`` each thread exits as soon as it finds no due job.
+    """
+    def __init__(self, concurrency=1, poll_interval=1.0, burst=False):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.metrics = WorkerMetrics()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def start(self):
+        self.maintain()
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._work, args=(f'{self._name}:{index}',), name=f'job-worker-{index}')
+            thread.start()
+            self._threads.append(thread)
+
+    def maintain(self):
+        """Housekeeping, run at start and then periodically by ``run_workers``."""
+        requeue_expired()
+        prune_finished()
+
+    def stop(self):
+        """Lets the running jobs finish, then stops the workers."""
+        self._stopping.set()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _work(self, worker_id):
+        try:
+            while not self._stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim_job(worker_id)
+                except OperationalError as e:
+                    # Typically a busy SQLite database; try again shortly.
+                    logger.info("Could not claim a job: %s", e)
+                    self._stopping.wait(0.05)
+                    continue
+                if job is None:
+                    if self.burst:
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                started = time.perf_counter()
+                status = run_job(job, worker_id)
+                self.metrics.record(job, status, time.perf_counter() - started)
+        finally:
+            connection.close()
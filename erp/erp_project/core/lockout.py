@@ -0,0 +1,128 @@
+# core/lockout.py
+"""
+Login lockout for the token-obtain views.
+
+Failed logins are counted per username in the shared cache with a sliding
+window: two fixed buckets of ``LOGIN_LOCKOUT_WINDOW`` seconds, the previous
+one weighted by how much of it still overlaps the window. Buckets are bumped
+with atomic ``incr`` and expire on their own, so failed logins never write to
+the database. Once the count reaches ``LOGIN_LOCKOUT_THRESHOLD`` a lock key is
+added for ``LOGIN_LOCKOUT_DURATION`` seconds; the request that adds it is the
+only one that writes ``failed_login_attempts``/``lockout_until`` to the User
+row. Locked usernames are rejected before the password is hashed.
+"""
+import math
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from .caching import get_cache
+from .models import User
+
+FAILURE_BUCKET_KEY = 'login:fail:%s:%d'
+LOCK_KEY = 'login:lock:%s'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class AccountLocked(APIException):
+    status_code = status.HTTP_403_FORBIDDEN
+    default_detail = "Too many failed login attempts. Try again later."
+    default_code = 'account_locked'
+
+    def __init__(self, wait):
+        super().__init__()
+        # DRF's exception handler turns ``wait`` into a Retry-After header.
+        self.wait = max(1, math.ceil(wait))
+
+
+def lockout_remaining(username):
+    """Seconds left on a lockout of ``username``, or 0. Reads the cache only."""
+    locked_until = get_cache().get(LOCK_KEY % username)
+    return max(0.0, locked_until - time.time()) if locked_until else 0.0
+
+
+def _bump_bucket(cache, key, timeout):
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add and incr.
+        cache.add(key, 1, timeout=timeout)
+        return 1
+
+
+def record_failed_login(username):
+    """
+    Counts a failed login for ``username``. Returns the lockout duration in
+    seconds when the account is locked (by this or an earlier failure),
+    else 0.
+    """
+    cache = get_cache()
+    window = _setting('LOGIN_LOCKOUT_WINDOW', 300)
+    duration = _setting('LOGIN_LOCKOUT_DURATION', 900)
+    now = time.time()
+    bucket = int(now // window)
+    current = _bump_bucket(cache, FAILURE_BUCKET_KEY % (username, bucket), timeout=2 * window)
+    previous = cache.get(FAILURE_BUCKET_KEY % (username, bucket - 1), 0)
+    count = previous * (1 - (now % window) / window) + current
+    if count < _setting('LOGIN_LOCKOUT_THRESHOLD', 5):
+        return 0
+
+    if not cache.add(LOCK_KEY % username, now + duration, timeout=duration):
+        return lockout_remaining(username)
+    # Imported here for the same reason as in core.tokens.add_stateless_claims:
+    # core.utils imports rest_framework.generics.
+    from .utils import log_action
+
+    # Only the request that took the lock records it on the row.
+    user = User.objects.filter(username=username).first()
+    if user is not None:
+        user.failed_login_attempts = math.ceil(count)
+        user.lockout_until = timezone.now() + timedelta(seconds=duration)
+        user.save(update_fields=['failed_login_attempts', 'lockout_until'])
+        log_action(user, 'failed_login', f"Account locked after {user.failed_login_attempts} failed logins")
+    return duration
+
+
+def record_successful_login(user):
+    """
+    Clears the failure counters after a correct password. Raises
+    AccountLocked when the row still holds a lockout the cache has lost.
+    """
+    if user.is_locked_out:
+        raise AccountLocked((user.lockout_until - timezone.now()).total_seconds())
+    window = _setting('LOGIN_LOCKOUT_WINDOW', 300)
+    bucket = int(time.time() // window)
+    get_cache().delete_many([
+        FAILURE_BUCKET_KEY % (user.username, bucket - 1), FAILURE_BUCKET_KEY % (user.username, bucket),
+    ])
+    if user.failed_login_attempts or user.lockout_until:
+        user.failed_login_attempts = 0
+        user.lockout_until = None
+        user.save(update_fields=['failed_login_attempts', 'lockout_until'])
+
+
+class LockoutTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """TokenObtainPairSerializer that enforces the login lockout."""
+    def validate(self, attrs):
+        username = attrs[self.username_field]
+        remaining = lockout_remaining(username)
+        if remaining:
+            raise AccountLocked(remaining)
+        try:
+            data = super().validate(attrs)
+        except AuthenticationFailed:
+            remaining = record_failed_login(username)
+            if remaining:
+                raise AccountLocked(remaining)
+            raise
+        record_successful_login(self.user)
+        return data
@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import compare_login_concurrency, temporary_database
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares login concurrency of the WSGI token view and the async ASGI "
+        "token view on a throwaway test database, printing JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=32)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--users', type=int, default=4)
+
+    def handle(self, *args, **options):
+        with temporary_database():
+            users = [(f'bench{i}', f'bench-password-{i}') for i in range(options['users'])]
+            for username, password in users:
+                User.objects.create_user(username=username, password=password)
+            report = compare_login_concurrency(users, options['requests'], options['concurrency'])
+        report['config'] = {key: options[key] for key in ('requests', 'concurrency', 'users')}
+        self.stdout.write(json.dumps(report, indent=2))
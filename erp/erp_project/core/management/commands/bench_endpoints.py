@@ -0,0 +1,62 @@
+import json
+import logging
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import ENDPOINTS, benchmark_endpoints, benchmark_user, temporary_database
+from core.seeding import TenantSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and benchmarks every API endpoint in "
+        "process, printing latency percentiles, throughput, queries and bytes "
+        "per request as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=10)
+        parser.add_argument('--users', type=int, default=200, help="Users per company.")
+        parser.add_argument('--roles', type=int, default=10, help="Roles per company.")
+        parser.add_argument('--audit-logs', type=int, default=2000, help="Audit log entries per company.")
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint.")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help="Only benchmark this endpoint; may be repeated.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        names = {name for name, _, _, _ in ENDPOINTS}
+        unknown = set(options['endpoints'] or ()) - names
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        # Over-budget and 4xx responses are counted in the report, not logged.
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        logging.getLogger('core.middleware').setLevel(logging.CRITICAL)
+
+        with temporary_database():
+            TenantSeeder(
+                seed=0, companies=options['companies'], users_per_company=options['users'],
+                roles_per_company=options['roles'], audit_logs_per_company=options['audit_logs'], uniform=True,
+            ).run()
+            endpoints = benchmark_endpoints(
+                benchmark_user(), options['requests'], options['concurrency'], only=options['endpoints'],
+            )
+        report = {
+            'config': {key: options[key] for key in (
+                'companies', 'users', 'roles', 'audit_logs', 'requests', 'concurrency',
+            )},
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'endpoints': endpoints,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
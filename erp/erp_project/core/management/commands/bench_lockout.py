@@ -0,0 +1,43 @@
+import json
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import failed_login_load, temporary_database
+from core.lockout import lockout_remaining, record_failed_login
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the login lockout with failed logins against one account "
+        "on a throwaway test database, printing JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=10000)
+        parser.add_argument('--rate', type=float, default=10000, help="Offered failed logins per second.")
+        parser.add_argument('--concurrency', type=int, default=16)
+
+    def handle(self, *args, **options):
+        # Every rejected login would otherwise log a "Forbidden" warning.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with temporary_database():
+            User.objects.create_user(username='target', password='correct-password')
+            report = failed_login_load('target', options['attempts'], options['rate'], options['concurrency'])
+            user = User.objects.get(username='target')
+            report['failed_login_attempts'] = user.failed_login_attempts
+            report['locked_out'] = bool(user.is_locked_out)
+            report['lockout_only'] = self.time_lockout_path('target', options['attempts'])
+        report['config'] = {key: options[key] for key in ('attempts', 'rate', 'concurrency')}
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def time_lockout_path(self, username, attempts):
+        """Rate of the cache-only work a locked login costs, without the HTTP stack."""
+        started = time.perf_counter()
+        for _ in range(attempts):
+            if not lockout_remaining(username):
+                record_failed_login(username)
+        elapsed = time.perf_counter() - started
+        return {'attempts': attempts, 'per_second': round(attempts / elapsed, 1) if elapsed else 0.0}
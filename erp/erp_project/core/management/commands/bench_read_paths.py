@@ -0,0 +1,42 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import benchmark_read_paths, temporary_database
+from core.models import User
+from core.seeding import TenantSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and compares the serializer and values() "
+        "read paths of the list endpoints, printing JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=5)
+        parser.add_argument('--users', type=int, default=2000, help="Users per company.")
+        parser.add_argument('--roles', type=int, default=200, help="Roles per company.")
+        parser.add_argument('--permissions', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint and path.")
+
+    def handle(self, *args, **options):
+        logging.getLogger('core.middleware').setLevel(logging.CRITICAL)
+        with temporary_database():
+            TenantSeeder(
+                seed=0, companies=options['companies'], users_per_company=options['users'],
+                roles_per_company=options['roles'], permissions=options['permissions'],
+                audit_logs_per_company=0, uniform=True,
+            ).run()
+            endpoints = benchmark_read_paths(
+                User.objects.get(username='s0c0u0'), options['requests'], options['page_size'],
+            )
+        report = {
+            'config': {key: options[key] for key in (
+                'companies', 'users', 'roles', 'permissions', 'page_size', 'requests',
+            )},
+            'endpoints': endpoints,
+        }
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,37 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import benchmark_throttle, benchmark_user, temporary_database
+from core.models import User
+from core.seeding import TenantSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the per-request cost of the API throttle and floods it from "
+        "one tenant on a throwaway test database, printing JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--rate', type=float, default=20, help="Tokens per second of the flooding user's buckets.")
+        parser.add_argument('--burst', type=int, default=100, help="Tokens of the flooding user's buckets.")
+
+    def handle(self, *args, **options):
+        # Every refused request would otherwise log a warning.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        logging.getLogger('core.middleware').setLevel(logging.CRITICAL)
+        bucket = {'rate': options['rate'], 'burst': options['burst']}
+        with temporary_database():
+            TenantSeeder(
+                seed=0, companies=2, users_per_company=2, roles_per_company=1, audit_logs_per_company=0, uniform=True,
+            ).run()
+            quiet = User.objects.get(username='s0c1u0')
+            report = benchmark_throttle(
+                benchmark_user(), options['requests'], quiet_user=quiet,
+                buckets={'user': bucket, 'company': {'rate': options['rate'] * 5, 'burst': options['burst'] * 5}},
+            )
+        report['config'] = {key: options[key] for key in ('requests', 'rate', 'burst')}
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
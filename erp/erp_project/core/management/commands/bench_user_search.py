@@ -0,0 +1,44 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import USER_SEARCHES, benchmark_user_search, temporary_database
+from core.models import User
+from core.seeding import TenantSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds one large tenant on a throwaway test database and times searches "
+        "and filters of the user list, printing JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500000, help="Users in the searched company.")
+        parser.add_argument('--companies', type=int, default=2, help="Companies, all of --users users.")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per search.")
+        parser.add_argument('--search', action='append', dest='searches',
+                            help="Only run this search; may be repeated.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['searches'] or ()) - {name for name, _ in USER_SEARCHES}
+        if unknown:
+            raise CommandError(f"Unknown searches: {', '.join(sorted(unknown))}")
+        logging.getLogger('core.middleware').setLevel(logging.CRITICAL)
+        with temporary_database():
+            seeded = TenantSeeder(
+                seed=0, companies=options['companies'], users_per_company=options['users'],
+                audit_logs_per_company=0, uniform=True, batch_size=20000,
+            ).run()
+            # A share of inactive users for the is_active filter.
+            User.objects.filter(pk__in=User.objects.filter(username__endswith='7').values('pk')).update(is_active=False)
+            searches = benchmark_user_search(
+                User.objects.get(username='s0c0u0'), options['requests'], only=options['searches'],
+            )
+        report = {
+            'config': {key: options[key] for key in ('users', 'companies', 'requests')},
+            'seed_seconds': round(seeded.elapsed, 1),
+            'searches': searches,
+        }
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
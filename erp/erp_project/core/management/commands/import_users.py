@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importing import FORMATS, ImportFormatError, UserImporter, create_hash_executor, guess_format, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Imports users, their companies and memberships from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else CSV.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Password hashing processes; 0 hashes inline. Defaults to the CPU count.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(e)
+
+        executor = create_hash_executor(options['workers'])
+        importer = UserImporter(batch_size=options['batch_size'], executor=executor)
+        try:
+            result = importer.run(iter_rows(stream, format))
+        except ImportFormatError as e:
+            raise CommandError(e)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} of {result.rows} rows ({result.failed} failed) "
+            f"in {result.elapsed:.2f}s, {result.rows_per_second:.0f} rows/s"
+        ))
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Purge
+from core.purging import purge_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Purges soft-deleted companies and users, resuming interrupted purges "
+        "where they stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help="Rows per chunk; defaults to PURGE_CHUNK_SIZE.")
+        parser.add_argument('--pause', type=float, help="Seconds between chunks; defaults to PURGE_CHUNK_PAUSE.")
+        parser.add_argument('--status', action='store_true', help="Only list unfinished purges.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        if options['status']:
+            purges = Purge.objects.filter(finished_at__isnull=True).order_by('created_at', 'pk')
+        else:
+            purges = purge_pending(chunk_size=options['chunk_size'], pause=options['pause'])
+        report = [
+            {
+                'kind': purge.kind,
+                'id': purge.object_id,
+                'step': purge.step,
+                'progress': purge.progress,
+                'finished_at': purge.finished_at.isoformat() if purge.finished_at else None,
+            }
+            for purge in purges
+        ]
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts the audit activity rollups from the audit log, one company "
+        "at a time. Needed after writing audit entries around core.audit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='companies',
+                            help="Only rebuild this company; may be repeated.")
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(options['companies'])
+        self.stdout.write(json.dumps({'rollups': written}))
@@ -0,0 +1,42 @@
+import json
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import WorkerPool, queue_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs background jobs from the job table with a pool of worker threads. "
+        "SIGINT or SIGTERM stops it once the running jobs finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Worker threads.")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds an idle worker waits before looking for jobs again.")
+        parser.add_argument('--metrics-interval', type=float, default=60.0,
+                            help="Seconds between metrics reports and housekeeping.")
+        parser.add_argument('--burst', action='store_true', help="Exit once no job is due.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be positive.")
+        pool = WorkerPool(
+            concurrency=options['concurrency'], poll_interval=options['poll_interval'], burst=options['burst'],
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: pool.stop())
+        pool.start()
+        next_report = time.monotonic() + options['metrics_interval']
+        while not pool.join(timeout=min(1.0, options['metrics_interval'])):
+            if time.monotonic() >= next_report:
+                self.report(pool)
+                pool.maintain()
+                next_report = time.monotonic() + options['metrics_interval']
+        self.report(pool)
+
+    def report(self, pool):
+        self.stdout.write(json.dumps({'workers': pool.metrics.as_dict(), 'queue': queue_stats()}, sort_keys=True))
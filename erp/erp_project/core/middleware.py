@@ -0,0 +1,273 @@
+# core/middleware.py
+import logging
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Company, UserCompanyMembership
+from .replicas import end_request, start_request
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# SQLite opens and closes transactions with plain statements, which other
+# backends do not send; they are not counted so budgets hold everywhere.
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements run on every configured database while used as
+    a context manager, leaving out transaction control.
+    """
+    def __init__(self):
+        self.count = 0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(TRANSACTION_STATEMENTS):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+def get_query_budget(view_func, method):
+    """
+    Returns the ``query_budget`` declared by the view behind ``view_func`` for
+    an HTTP ``method``, or None when the view declares none.
+
+    A budget is either an int covering every request, or a dict keyed by
+    viewset action (``'list'``, ``'create'``, ...) or, for plain views, by
+    lowercase HTTP method.
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    budget = getattr(view_class, 'query_budget', None)
+    if not isinstance(budget, dict):
+        return budget
+    method = method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return budget.get(actions.get(method, method))
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries each request runs and compares them with the view's
+    declared ``query_budget``.
+
+    The count is returned in the ``X-Query-Count`` header. Requests over budget
+    are logged, or fail with ``QueryBudgetExceeded`` when
+    ``QUERY_BUDGET_STRICT`` is set (as the test suite does).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        return self.check_budget(request, response, counter)
+
+    async def __acall__(self, request):
+        with QueryCounter() as counter:
+            response = await self.get_response(request)
+        return self.check_budget(request, response, counter)
+
+    def check_budget(self, request, response, counter):
+        response['X-Query-Count'] = str(counter.count)
+        match = request.resolver_match
+        budget = get_query_budget(match.func, request.method) if match else None
+        if budget is not None and counter.count > budget:
+            message = (
+                f"{request.method} {request.path} ran {counter.count} queries, "
+                f"over its budget of {budget}"
+            )
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+# Header letting a user who belongs to several companies pick the active one.
+TENANT_HEADER = 'HTTP_X_COMPANY_ID'
+
+
+def _company_memberships(user, company_id):
+    memberships = UserCompanyMembership.objects.filter(
+        user=user, company__deleted_at__isnull=True,
+    ).select_related('company')
+    if company_id is not None:
+        try:
+            memberships = memberships.filter(company_id=int(company_id))
+        except (TypeError, ValueError):
+            return None
+    return memberships.order_by('pk')
+
+
+def resolve_company(user, company_id=None):
+    """
+    Returns the company ``user`` is acting for: the one given by
+    ``company_id`` if they are a member of it, otherwise their first
+    membership's company. Costs a single query.
+    """
+    memberships = _company_memberships(user, company_id)
+    membership = memberships.first() if memberships is not None else None
+    return membership.company if membership else None
+
+
+async def aresolve_company(user, company_id=None):
+    """Async version of ``resolve_company``."""
+    memberships = _company_memberships(user, company_id)
+    membership = await memberships.afirst() if memberships is not None else None
+    return membership.company if membership else None
+
+
+class TenantContext:
+    """
+    The active company of a request, resolved on first access and then kept
+    for the rest of the request.
+
+    Resolution is lazy because DRF authenticates inside the view, after the
+    middleware has run; DRF copies the authenticated user onto the request.
+    """
+    def __init__(self, request):
+        self._request = request
+        self._resolved = False
+        self._company = None
+        self._companies = None
+
+    @property
+    def company(self):
+        if not self._resolved:
+            user = getattr(self._request, 'user', None)
+            if user is None or not user.is_authenticated:
+                return None
+            if self._is_stateless(user):
+                company_id = self.company_id
+                self._company = (
+                    Company.objects.filter(pk=company_id, deleted_at__isnull=True).first() if company_id else None
+                )
+            else:
+                meta = getattr(self._request, 'META', {})
+                self._company = resolve_company(user, meta.get(TENANT_HEADER))
+            self._resolved = True
+        return self._company
+
+    @property
+    def company_id(self):
+        user = getattr(self._request, 'user', None)
+        if self._is_stateless(user):
+            # Stateless tokens name their company; a header asking for any
+            # other company gets none rather than a membership query.
+            company_id = user.token_company_id
+            requested = getattr(self._request, 'META', {}).get(TENANT_HEADER)
+            if requested and requested != str(company_id):
+                return None
+            if company_id is not None and company_id not in self._token_companies(user):
+                # Deleted (or left) since the token was issued.
+                return None
+            return company_id
+        company = self.company
+        return company.pk if company is not None else None
+
+    def _token_companies(self, user):
+        if self._companies is None:
+            # Imported here: core.permissions imports this module.
+            from .permissions import get_permission_map
+
+            self._companies = get_permission_map(user)
+        return self._companies
+
+    @staticmethod
+    def _is_stateless(user):
+        return getattr(user, 'stateless', False) is True
+
+    async def aget_company(self):
+        """Async version of ``company``, for async views."""
+        if not self._resolved:
+            user = getattr(self._request, 'user', None)
+            if user is None or not user.is_authenticated:
+                return None
+            meta = getattr(self._request, 'META', {})
+            self._company = await aresolve_company(user, meta.get(TENANT_HEADER))
+            self._resolved = True
+        return self._company
+
+
+def get_tenant(request):
+    """
+    Returns the ``TenantContext`` of a Django or DRF request, attaching one
+    if TenantMiddleware did not run (e.g. requests built by a test factory).
+    """
+    request = getattr(request, '_request', request)
+    tenant = getattr(request, 'tenant', None)
+    if tenant is None:
+        tenant = request.tenant = TenantContext(request)
+    return tenant
+
+
+class TenantMiddleware:
+    """Attaches ``request.tenant``, the request's active company context."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.tenant = TenantContext(request)
+        # Returns the coroutine itself when serving an async chain.
+        return self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets ``core.replicas.ReplicaRouter`` send reads of views declaring
+    ``replica_methods`` to a read replica, and remembers users who wrote.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            end_request()
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(end_request)()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        start_request(request, view_func)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_auditlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['company', 'created_at', 'id'], name='auditlog_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='role',
+            index=models.Index(fields=['company', 'id'], name='role_company_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usercompanymembership',
+            index=models.Index(fields=['company', 'id'], name='membership_company_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usercompanymembership',
+            index=models.Index(fields=['company', 'user'], name='membership_company_user_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_self_links(apps, schema_editor):
+    # Existing roles have no parent, so each is only its own ancestor.
+    Role = apps.get_model('core', 'Role')
+    RoleAncestor = apps.get_model('core', 'RoleAncestor')
+    RoleAncestor.objects.bulk_create(
+        (RoleAncestor(descendant_id=pk, ancestor_id=pk, depth=0) for pk in Role.objects.values_list('pk', flat=True).iterator()),
+        batch_size=5000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auditlog_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='role',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='core.role'),
+        ),
+        migrations.CreateModel(
+            name='RoleAncestor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='core.role')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='core.role')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'descendant'], name='roleancestor_ancestor_idx')],
+                'unique_together': {('descendant', 'ancestor')},
+            },
+        ),
+        migrations.RunPython(add_self_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0006_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Purge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('company', 'Company'), ('user', 'User')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('step', models.CharField(blank=True, max_length=50)),
+                ('progress', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='company_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='user_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purge',
+            index=models.Index(condition=models.Q(('finished_at__isnull', True)), fields=['created_at'], name='purge_pending_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='purge',
+            unique_together={('kind', 'object_id')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete'), ('login', 'Login'), ('logout', 'Logout'), ('failed_login', 'Failed Login')], max_length=50)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.company')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('company', 'period', 'action', 'bucket'), name='auditrollup_unique')],
+            },
+        ),
+    ]
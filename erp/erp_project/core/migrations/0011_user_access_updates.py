@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:37
+
+import core.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_auditlog_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', core.models.AccessUserManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0011_user_access_updates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['id'], name='company_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True)), fields=['id'], name='user_live_idx'),
+        ),
+    ]
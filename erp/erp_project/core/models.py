@@ -2,15 +2,29 @@ from django.db import models
 
 # Create your models here.
 # core/models.py
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db import models, transaction
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db.models.functions import Lower
 from django.utils import timezone
 from datetime import timedelta
 
+from .caching import PERMISSION_USER_VERSION_KEY, bump_version
+
 class Company(models.Model):
     name = models.CharField(max_length=255, unique=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the company is deleted; core.purging removes it and its
+    # dependants later, in the background.
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Companies waiting to be purged; live rows stay out of the index
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='company_deleted_idx'),
+            # Live companies in id order, for the company list
+            models.Index(fields=['id'], condition=models.Q(deleted_at__isnull=True), name='company_live_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -32,22 +46,111 @@ class Role(models.Model):
     description = models.TextField(blank=True)
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     permissions = models.ManyToManyField(Permission, blank=True)
+    # A role also grants every permission of its ancestors. The ancestry is
+    # kept in RoleAncestor by core.hierarchy.
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='children')
 
     class Meta:
         unique_together = ('name', 'company')
+        indexes = [
+            # Keyset pagination of a company's roles
+            models.Index(fields=['company', 'id'], name='role_company_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.company.name})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets core.signals tell a re-parenting from other saves.
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def clean(self):
+        # core.hierarchy imports this module.
+        from .hierarchy import validate_parent
+
+        validate_parent(self, self.parent)
+
+    def save(self, *args, **kwargs):
+        # The closure is updated from post_save and may reject the new
+        # parent, which has to undo the save.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class RoleAncestor(models.Model):
+    """
+    Closure table of role inheritance: one row per role and each of its
+    ancestors, including the role itself at depth 0.
+    """
+    descendant = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='ancestor_links')
+    ancestor = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='descendant_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('descendant', 'ancestor')
+        indexes = [
+            # Subtree lookups when a role is re-parented or deleted
+            models.Index(fields=['ancestor', 'descendant'], name='roleancestor_ancestor_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.descendant_id} < {self.ancestor_id} ({self.depth})"
     
 # core/models.py
 # ... (other models and imports)
 
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        if not set(kwargs) & set(User.ACCESS_FIELDS):
+            return super().update(**kwargs)
+        # Stateless tokens carry the access flags; core.signals makes them
+        # stale on save(), which update() goes around.
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        for user_id in user_ids:
+            bump_version(PERMISSION_USER_VERSION_KEY % user_id)
+        return rows
+
+
+class AccessUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     # Fields for account lockout policy
     failed_login_attempts = models.PositiveIntegerField(default=0)
     lockout_until = models.DateTimeField(null=True, blank=True)
+    # Set when the user is deleted, see Company.deleted_at.
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
     # We remove the ForeignKey to company here, as it will be managed by UserCompanyMembership
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive prefix search on the user list
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+            models.Index(fields=['date_joined'], name='user_date_joined_idx'),
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='user_deleted_idx'),
+            # Live users in id order, for the user list
+            models.Index(fields=['id'], condition=models.Q(deleted_at__isnull=True), name='user_live_idx'),
+        ]
+
+    # The fields besides roles that decide what a user may do; stateless
+    # tokens carry them as claims.
+    ACCESS_FIELDS = ('is_active', 'is_staff', 'is_superuser')
+
+    objects = AccessUserManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets core.signals tell an access change from other saves.
+        instance._loaded_access = tuple(instance.__dict__.get(field) for field in cls.ACCESS_FIELDS)
+        return instance
+
     @property
     def is_locked_out(self):
         """Returns True if the user's account is currently locked out."""
@@ -64,6 +167,11 @@ class UserCompanyMembership(models.Model):
     class Meta:
         # Ensures a user can only have one membership per company
         unique_together = ('user', 'company')
+        indexes = [
+            # Keyset pagination of a company's memberships and users
+            models.Index(fields=['company', 'id'], name='membership_company_id_idx'),
+            models.Index(fields=['company', 'user'], name='membership_company_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} @ {self.company.name}"
@@ -85,10 +193,119 @@ class AuditLog(models.Model):
     company = models.ForeignKey(Company, on_delete=models.SET_NULL, null=True, blank=True)
     action = models.CharField(max_length=50, choices=ACTION_CHOICES)
     description = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Stamped when the action happens rather than when the row is inserted,
+    # since core.audit writes records in batches.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a company's log, newest first
+            models.Index(fields=['company', 'created_at', 'id'], name='auditlog_company_created_idx'),
+            # Time-range queries filtered by action or by user
+            models.Index(fields=['company', 'action', 'created_at'], name='auditlog_company_action_idx'),
+            models.Index(fields=['company', 'user', 'created_at'], name='auditlog_company_user_idx'),
+            # The admin's changelist, date hierarchy and action filter, across companies
+            models.Index(fields=['created_at', 'id'], name='auditlog_created_idx'),
+            models.Index(fields=['action', 'created_at', 'id'], name='auditlog_action_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.action} - {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+class AuditRollup(models.Model):
+    """
+    Number of audit log entries per company, action and hour or day (UTC),
+    kept up to date by core.audit as entries are written (see core.rollups).
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    action = models.CharField(max_length=50, choices=AuditLog.ACTION_CHOICES)
+    bucket = models.DateTimeField()
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        # Also the index of summary queries: one company, period and action
+        # over a range of buckets.
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'period', 'action', 'bucket'], name='auditrollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} {self.action} {self.period} {self.bucket:%Y-%m-%d %H:00}: {self.count}"
+
+
+class Purge(models.Model):
+    """Progress of purging a soft-deleted company or user (see core.purging)."""
+    COMPANY = 'company'
+    USER = 'user'
+    KIND_CHOICES = [
+        (COMPANY, 'Company'),
+        (USER, 'User'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # The step being worked on and the rows removed so far, per step.
+    step = models.CharField(max_length=50, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(finished_at__isnull=True), name='purge_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} ({'done' if self.finished_at else self.step or 'pending'})"
+
+
+
+class Job(models.Model):
+    """A unit of deferred work, run by ``manage.py run_workers`` (see core.jobs)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Not claimed before this time; pushed back after each failed attempt.
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest due job; finished jobs stay out of the index.
+            models.Index(fields=['run_after', 'id'], condition=models.Q(status='queued'), name='job_queued_idx'),
+            # Jobs of crashed workers, found by their lease
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='job_running_idx'),
+            models.Index(fields=['status', 'finished_at'], name='job_status_finished_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user} - {self.action} - {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
\ No newline at end of file
+        return f"{self.name} #{self.pk} ({self.status})"
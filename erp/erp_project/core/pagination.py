@@ -0,0 +1,75 @@
+# core/pagination.py
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Default pagination for list endpoints.
+
+    Pages are fetched with an indexed ``WHERE id > <position>`` filter and an
+    opaque cursor, so deep pages stay cheap and no ``COUNT(*)`` is issued.
+    Querysets are already scoped to one company, so ordering by ``id`` walks
+    the ``(company, id)`` indexes.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class UserPagination(KeysetPagination):
+    max_page_size = 100
+
+
+class RolePagination(KeysetPagination):
+    max_page_size = 200
+
+
+class MembershipPagination(KeysetPagination):
+    max_page_size = 500
+
+
+class AuditLogPagination(KeysetPagination):
+    """Newest first, walking the ``(company, created_at, id)`` index."""
+    ordering = ('-created_at', '-id')
+    max_page_size = 500
+
+
+def table_row_estimate(model, using='default'):
+    """
+    A cheap estimate of the rows in ``model``'s table: the planner's
+    statistics on PostgreSQL, else the largest primary key (an upper bound
+    for auto-incremented keys, read from the primary key index).
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table is first analyzed
+        if row and row[0] >= 0:
+            return int(row[0])
+    return model._default_manager.using(using).order_by().aggregate(rows=Max('pk'))['rows'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of large tables, which never counts
+    more than ``exact_count_limit`` rows. An unfiltered list of a bigger
+    table reports the table's estimated size; a filtered one counts up to
+    the limit, so pages past it are not offered.
+    """
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = table_row_estimate(queryset.model, queryset.db)
+            if estimate > self.exact_count_limit:
+                return estimate
+        return queryset.order_by()[:self.exact_count_limit].count()
@@ -9,15 +9,128 @@ from .serializers import RoleSerializer
 from rest_framework import serializers
 from django.contrib.auth.models import Permission
 from rest_framework import serializers, generics
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import (
+    PERMISSION_COMPANY_VERSION_KEY,
+    PERMISSION_GLOBAL_VERSION_KEY,
+    PERMISSION_MAP_KEY,
+    PERMISSION_USER_VERSION_KEY,
+    LRUCache,
+    get_cache,
+    get_versions,
+)
+from .middleware import get_tenant
+from .models import UserCompanyMembership
+
+_local_permission_cache = LRUCache(getattr(settings, 'PERMISSION_CACHE_LOCAL_SIZE', 1024))
+_stats_lock = threading.Lock()
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def permission_cache_stats():
+    """Returns hit/miss counters of the effective-permission cache."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['hits'] = stats['local_hits'] + stats['shared_hits']
+    return stats
+
+
+def reset_permission_cache():
+    """Drops the process-local entries and resets the counters."""
+    _local_permission_cache.clear()
+    with _stats_lock:
+        for stat in _stats:
+            _stats[stat] = 0
+
+
+def _version_keys(user_id, company_ids):
+    keys = [PERMISSION_GLOBAL_VERSION_KEY, PERMISSION_USER_VERSION_KEY % user_id]
+    keys.extend(PERMISSION_COMPANY_VERSION_KEY % company_id for company_id in company_ids)
+    return keys
+
+
+def _is_current(entry, user_id):
+    keys = _version_keys(user_id, entry['permissions'])
+    return get_versions(keys) == entry['versions']
+
+
+def _build_permission_map(user_id):
+    # Read from the primary even when the request reads from a replica: the
+    # entry is cached as current for the versions read below.
+    memberships = UserCompanyMembership.objects.using(DEFAULT_DB_ALIAS).filter(company__deleted_at__isnull=True)
+    company_ids = list(memberships.filter(user_id=user_id).values_list('company_id', flat=True))
+    # Versions are read before the permission rows so that a concurrent
+    # change always leaves the entry looking stale rather than current.
+    versions = get_versions(_version_keys(user_id, company_ids))
+    permissions = {company_id: set() for company_id in company_ids}
+    # Roles inherit their ancestors' permissions; the closure table makes
+    # that a join rather than a walk up the hierarchy.
+    rows = memberships.filter(
+        user_id=user_id,
+        roles__ancestor_links__ancestor__permissions__isnull=False,
+    ).values_list('company_id', 'roles__ancestor_links__ancestor__permissions__codename')
+    for company_id, codename in rows:
+        permissions.setdefault(company_id, set()).add(codename)
+    return {
+        'versions': versions,
+        'permissions': {company_id: frozenset(codenames) for company_id, codenames in permissions.items()},
+    }
+
+
+def get_permission_map(user):
+    """
+    Returns ``{company_id: frozenset(codenames)}`` with the effective
+    permissions of ``user`` in each company they are a member of.
+
+    Entries live in a process-local LRU backed by the shared cache and are
+    validated against version counters, so a warm lookup costs no queries.
+    """
+    entry = _local_permission_cache.get(user.pk)
+    if entry is not None and _is_current(entry, user.pk):
+        _count('local_hits')
+        return entry['permissions']
+
+    cache = get_cache()
+    entry = cache.get(PERMISSION_MAP_KEY % user.pk)
+    if entry is not None and _is_current(entry, user.pk):
+        _count('shared_hits')
+    else:
+        _count('misses')
+        entry = _build_permission_map(user.pk)
+        cache.set(
+            PERMISSION_MAP_KEY % user.pk,
+            entry,
+            getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 60 * 60),
+        )
+    _local_permission_cache.set(user.pk, entry)
+    return entry['permissions']
+
 
 class HasPermission(permissions.BasePermission):
     """
-    Custom permission to check if a user has a specific permission
-    across all their company memberships.
+    Custom permission to check if a user has a specific permission in the
+    company they are acting for (see core.middleware.TenantContext):
+    through the roles of that membership, or, for a stateless token, the
+    permission bitmap it carries for its company. Permissions held in the
+    user's other companies do not count. Superusers have every permission.
     """
     def __init__(self, permission_codename):
         self.permission_codename = permission_codename
 
+    def __call__(self):
+        # Lets an instance be listed in ``permission_classes``, which DRF
+        # instantiates by calling each entry.
+        return self
+
     def has_permission(self, request, view):
         user = request.user
         if not user.is_authenticated:
@@ -27,12 +140,13 @@ class HasPermission(permissions.BasePermission):
         if user.is_superuser:
             return True
 
-        # Use a more robust query to check for the permission
-        # This checks if ANY of the user's roles, across ANY of their company memberships,
-        # have the required permission.
-        return user.usercompanymembership_set.filter(
-            roles__permissions__codename=self.permission_codename
-        ).exists()
+        # This checks if ANY of the user's roles in the company they are acting
+        # for has the required permission. The sets come from the permission cache.
+        company_id = get_tenant(request).company_id
+        if getattr(user, 'stateless', False) is True:
+            # Stateless tokens carry the permission set of their company.
+            return company_id is not None and user.has_company_permission(self.permission_codename)
+        return self.permission_codename in get_permission_map(user).get(company_id, ())
     
 # core/views.py
 # ... (existing imports)
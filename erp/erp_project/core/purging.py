@@ -0,0 +1,222 @@
+# core/purging.py
+"""
+Soft deletion of companies and users.
+
+Deleting a company in one request cascades to its roles, memberships and
+their link tables, and nulls its audit log references, all in one
+transaction that holds the database's write lock for as long as that takes.
+Instead, ``soft_delete_company`` and ``soft_delete_user`` only stamp
+``deleted_at``, which hides the row from every view straight away, and
+record a ``Purge``. The purge then removes the dependants in chunks of
+``PURGE_CHUNK_SIZE`` rows, one short transaction per chunk, and deletes the
+row itself last.
+
+Every chunk is idempotent and saves its progress, so an interrupted purge
+resumes where it stopped: ``purge_pending`` (also the ``purge_deleted``
+management command) finishes every unfinished purge. ``PURGE_MODE`` chooses
+when purges run after a delete: ``'queue'`` (a core.jobs job),
+``'background'`` (a thread of the deleting process), ``'sync'`` (inside the
+request, after commit) or ``'manual'`` (only from the management command).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import (
+    PERMISSION_COMPANY_VERSION_KEY,
+    PERMISSION_USER_VERSION_KEY,
+    bump_content_version,
+    bump_version,
+)
+from .jobs import enqueue
+from .models import AuditLog, AuditRollup, Company, Job, Purge, Role, RoleAncestor, User, UserCompanyMembership
+
+logger = logging.getLogger(__name__)
+
+MembershipRole = UserCompanyMembership.roles.through
+RolePermission = Role.permissions.through
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def soft_delete_company(company):
+    """Hides ``company`` and everything scoped to it, and schedules its purge."""
+    with transaction.atomic():
+        company.deleted_at = timezone.now()
+        Company.objects.filter(pk=company.pk).update(deleted_at=company.deleted_at)
+        Purge.objects.get_or_create(kind=Purge.COMPANY, object_id=company.pk)
+    # Tokens and cached permission sets naming the company go stale.
+    bump_version(PERMISSION_COMPANY_VERSION_KEY % company.pk)
+    for resource in ('roles', 'memberships'):
+        bump_content_version(resource, company.pk)
+    schedule_purge()
+
+
+def soft_delete_user(user):
+    """Hides ``user``, blocks their logins and tokens, and schedules their purge."""
+    with transaction.atomic():
+        user.deleted_at = timezone.now()
+        user.is_active = False
+        User.objects.filter(pk=user.pk).update(deleted_at=user.deleted_at, is_active=False)
+        Purge.objects.get_or_create(kind=Purge.USER, object_id=user.pk)
+    bump_version(PERMISSION_USER_VERSION_KEY % user.pk)
+    company_ids = UserCompanyMembership.objects.filter(user_id=user.pk).values_list('company_id', flat=True)
+    for company_id in company_ids:
+        bump_content_version('memberships', company_id)
+    schedule_purge()
+
+
+def _chunk_ids(queryset, size):
+    # Unordered, so the scan stops after ``size`` index entries; rows already
+    # handled no longer match the queryset.
+    return list(queryset.order_by().values_list('pk', flat=True)[:size])
+
+
+def _delete_rows(model, ids):
+    """
+    Deletes rows by primary key with a single DELETE. Dependants are purged
+    by earlier steps and the cache invalidation done on soft deletion, so
+    the ORM's cascade collection and per-row ``pre_delete``/``post_delete``
+    signals are skipped.
+    """
+    quote = connection.ops.quote_name
+    sql = 'DELETE FROM %s WHERE %s IN (%s)' % (
+        quote(model._meta.db_table), quote(model._meta.pk.column), ', '.join(['%s'] * len(ids)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ids)
+        return cursor.rowcount
+
+
+def _null_rows(field):
+    def null(model, ids):
+        return model.objects.filter(pk__in=ids).update(**{field: None})
+    return null
+
+
+def _company_steps(company_id):
+    """``[(name, model, queryset, apply)]`` in the order a company is purged."""
+    return [
+        ('audit_logs', AuditLog, AuditLog.objects.filter(company_id=company_id), _null_rows('company')),
+        ('audit_rollups', AuditRollup, AuditRollup.objects.filter(company_id=company_id), _delete_rows),
+        (
+            'membership_roles', MembershipRole,
+            MembershipRole.objects.filter(usercompanymembership__company_id=company_id), _delete_rows,
+        ),
+        ('memberships', UserCompanyMembership, UserCompanyMembership.objects.filter(company_id=company_id), _delete_rows),
+        ('role_permissions', RolePermission, RolePermission.objects.filter(role__company_id=company_id), _delete_rows),
+        ('role_ancestors', RoleAncestor, RoleAncestor.objects.filter(descendant__company_id=company_id), _delete_rows),
+        # Parents first, so no chunk deletes a role still referenced by a later one.
+        ('role_parents', Role, Role.objects.filter(company_id=company_id, parent__isnull=False), _null_rows('parent')),
+        ('roles', Role, Role.objects.filter(company_id=company_id), _delete_rows),
+    ]
+
+
+def _user_steps(user_id):
+    return [
+        ('audit_logs', AuditLog, AuditLog.objects.filter(user_id=user_id), _null_rows('user')),
+        (
+            'membership_roles', MembershipRole,
+            MembershipRole.objects.filter(usercompanymembership__user_id=user_id), _delete_rows,
+        ),
+        ('memberships', UserCompanyMembership, UserCompanyMembership.objects.filter(user_id=user_id), _delete_rows),
+    ]
+
+
+PURGE_TARGETS = {
+    Purge.COMPANY: (Company, _company_steps),
+    Purge.USER: (User, _user_steps),
+}
+
+
+class Purger:
+    """
+    Runs purges chunk by chunk. ``pause`` seconds between chunks leave room
+    for other writers, which matters on SQLite's single write lock.
+    """
+    def __init__(self, chunk_size=1000, pause=0.0):
+        self.chunk_size = chunk_size
+        self.pause = pause
+
+    def run(self, purge):
+        """Finishes ``purge``, resuming from its recorded step."""
+        model, steps = PURGE_TARGETS[purge.kind]
+        steps = steps(purge.object_id)
+        names = [name for name, *_ in steps]
+        start = names.index(purge.step) if purge.step in names else 0
+        for name, step_model, queryset, apply in steps[start:]:
+            purge.step = name
+            while True:
+                with transaction.atomic():
+                    ids = _chunk_ids(queryset, self.chunk_size)
+                    if ids:
+                        done = apply(step_model, ids)
+                        purge.progress[name] = purge.progress.get(name, 0) + done
+                    purge.save(update_fields=['step', 'progress', 'updated_at'])
+                if len(ids) < self.chunk_size:
+                    break
+                if self.pause:
+                    time.sleep(self.pause)
+        with transaction.atomic():
+            # Whatever is left (auth tables, rows added since) is small and
+            # goes through the regular cascade.
+            model.objects.filter(pk=purge.object_id).delete()
+            purge.step = ''
+            purge.finished_at = timezone.now()
+            purge.save(update_fields=['step', 'finished_at', 'updated_at'])
+        return purge
+
+
+_purge_lock = threading.Lock()
+
+
+def purge_pending(chunk_size=None, pause=None):
+    """Runs every unfinished purge, oldest first. Returns the purges finished."""
+    purger = Purger(
+        chunk_size=chunk_size or _setting('PURGE_CHUNK_SIZE', 1000),
+        pause=_setting('PURGE_CHUNK_PAUSE', 0.0) if pause is None else pause,
+    )
+    finished = []
+    # One purge at a time per process; other processes only repeat no-op chunks.
+    with _purge_lock:
+        for purge in Purge.objects.filter(finished_at__isnull=True).order_by('created_at', 'pk'):
+            finished.append(purger.run(purge))
+    return finished
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _purge_in_background():
+    try:
+        purge_pending()
+    except Exception:
+        # Chunks already done stay done; purge_deleted picks up the rest.
+        logger.exception("Purge failed")
+    finally:
+        connection.close()
+
+
+def schedule_purge():
+    """Starts the pending purges once the current transaction commits, as ``PURGE_MODE`` says."""
+    global _executor
+    mode = _setting('PURGE_MODE', 'queue')
+    if mode == 'queue':
+        # One queued purge job finishes every pending purge.
+        if not Job.objects.filter(name='purge', status=Job.QUEUED).exists():
+            enqueue('purge')
+    elif mode == 'sync':
+        transaction.on_commit(purge_pending)
+    elif mode == 'background':
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+        transaction.on_commit(lambda: _executor.submit(_purge_in_background))
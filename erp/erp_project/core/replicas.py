@@ -0,0 +1,119 @@
+# core/replicas.py
+"""
+Read-replica routing.
+
+Views opt in by declaring ``replica_methods``, the HTTP methods whose
+requests may read from a replica (``DATABASE_REPLICAS``). ReplicaRouter sends
+those requests' reads to one replica, picked per request, and everything
+else to ``default``. A request is pinned to ``default`` as soon as it
+writes, and a user who wrote is kept on ``default`` for
+``REPLICA_PIN_SECONDS`` afterwards so they read their own writes while the
+replicas catch up.
+
+Anything cached or tagged with the current version counters (permission
+sets, stateless token claims, ETags) must not come from a replica, which
+may lag behind them: such reads use ``default`` explicitly, and ETags are
+not sent for responses read from a replica (``read_from_replica``).
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .caching import get_cache
+
+RECENT_WRITE_KEY = 'replica:pin:%s'
+
+_routing = ContextVar('replica_routing', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def replica_methods(view_func):
+    """The HTTP methods the view behind ``view_func`` serves from replicas."""
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    return getattr(view_class, 'replica_methods', ())
+
+
+class RequestRouting:
+    """Routing state of one request."""
+    def __init__(self, request, replica=None):
+        self.request = request
+        self.replica = replica
+        self.wrote = False
+        self.used_replica = False
+        self._checked_user = None
+
+    @property
+    def user_id(self):
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def read_alias(self):
+        if self.replica is None or self.wrote:
+            return DEFAULT_DB_ALIAS
+        # The user is only known once DRF has authenticated the request.
+        user_id = self.user_id
+        if user_id is not None and user_id != self._checked_user:
+            self._checked_user = user_id
+            if get_cache().get(RECENT_WRITE_KEY % user_id):
+                self.replica = None
+                return DEFAULT_DB_ALIAS
+        self.used_replica = True
+        return self.replica
+
+    def finish(self):
+        """Pins a user who wrote during this request to ``default`` for a while."""
+        user_id = self.user_id
+        if self.wrote and user_id is not None:
+            get_cache().set(RECENT_WRITE_KEY % user_id, True, getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+
+
+def start_request(request, view_func):
+    """Starts routing the reads of ``request``, which is served by ``view_func``."""
+    replicas = get_replicas()
+    replica = None
+    if replicas and request.method in replica_methods(view_func):
+        replica = random.choice(replicas)
+    _routing.set(RequestRouting(request, replica))
+
+
+def read_from_replica():
+    """Whether the current request has read anything from a replica."""
+    state = _routing.get()
+    return state is not None and state.used_replica
+
+
+def end_request():
+    state = _routing.get()
+    # Not reset with a token: under ASGI the view middleware may have run in
+    # a copied context.
+    _routing.set(None)
+    if state is not None:
+        state.finish()
+
+
+class ReplicaRouter:
+    """Database router for ``DATABASE_ROUTERS``; see the module docstring."""
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        # Always answer, so reads of objects loaded from a replica do not
+        # stay there after the request has been pinned.
+        return state.read_alias() if state is not None else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
@@ -0,0 +1,112 @@
+# core/rollups.py
+"""
+Audit activity rollups.
+
+AuditRollup holds the number of audit entries per company, action and hour
+or day (UTC buckets). core.audit adds every batch of entries it writes with
+one upsert in the same transaction, so the counts stay exact without ever
+counting AuditLog rows; a summary over N buckets reads at most N rows per
+action through the table's unique index, however large the log is.
+
+Entries written around the writer (``bulk_create`` in the seeders, or data
+from before the table existed) are counted by ``rebuild_rollups``, which is
+also the ``rebuild_audit_rollups`` management command.
+"""
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDay, TruncHour
+
+from .models import AuditLog, AuditRollup, Company
+
+PERIODS = {AuditRollup.HOUR: TruncHour, AuditRollup.DAY: TruncDay}
+PERIOD_LENGTHS = {AuditRollup.HOUR: timedelta(hours=1), AuditRollup.DAY: timedelta(days=1)}
+# Buckets the summary API covers when not given a start
+SUMMARY_DEFAULT_BUCKETS = {AuditRollup.HOUR: 24, AuditRollup.DAY: 90}
+
+# Rows per upsert statement, well under SQLite's bound parameter limit.
+UPSERT_BATCH_SIZE = 150
+
+
+def bucket_start(value, period):
+    """The start of the UTC hour or day holding ``value``."""
+    value = value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if period == AuditRollup.DAY else value
+
+
+def count_records(records):
+    """``Counter({(company_id, period, action, bucket): n})`` of audit records with a company."""
+    counts = Counter()
+    for record in records:
+        if record.company_id is None:
+            continue
+        for period in PERIODS:
+            counts[record.company_id, period, record.action, bucket_start(record.created_at, period)] += 1
+    return counts
+
+
+def add_counts(counts):
+    """Adds ``counts`` (see ``count_records``) to the rollup table."""
+    if not counts:
+        return
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        for (company_id, period, action, bucket), n in counts.items():
+            rollup, _ = AuditRollup.objects.get_or_create(
+                company_id=company_id, period=period, action=action, bucket=bucket,
+            )
+            AuditRollup.objects.filter(pk=rollup.pk).update(count=F('count') + n)
+        return
+    # Both backends increment existing rows in the same statement that
+    # inserts the new ones; the ORM's update_conflicts can only overwrite.
+    qn = connection.ops.quote_name
+    table = qn(AuditRollup._meta.db_table)
+    columns = ', '.join(qn(AuditRollup._meta.get_field(name).column) for name in (
+        'company', 'period', 'action', 'bucket', 'count',
+    ))
+    conflict = ', '.join(qn(AuditRollup._meta.get_field(name).column) for name in (
+        'company', 'period', 'action', 'bucket',
+    ))
+    rows = list(counts.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for (company_id, period, action, bucket), n in batch:
+                params += [company_id, period, action, connection.ops.adapt_datetimefield_value(bucket), n]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {qn('count')} = {table}.{qn('count')} + excluded.{qn('count')}",
+                params,
+            )
+
+
+def rebuild_rollups(company_ids=None, batch_size=5000):
+    """
+    Recounts the rollups of ``company_ids`` (every company by default) from
+    AuditLog, one company per transaction. Returns the rows written.
+    """
+    if company_ids is None:
+        company_ids = list(Company.objects.order_by('pk').values_list('pk', flat=True))
+    written = 0
+    for company_id in company_ids:
+        with transaction.atomic():
+            AuditRollup.objects.filter(company_id=company_id).delete()
+            rollups = []
+            for period, trunc in PERIODS.items():
+                grouped = (
+                    AuditLog.objects.filter(company_id=company_id).order_by()
+                    .values('action', bucket=trunc('created_at', tzinfo=dt_timezone.utc))
+                    .annotate(entries=Count('pk'))
+                )
+                rollups += [
+                    AuditRollup(
+                        company_id=company_id, period=period, action=row['action'], bucket=row['bucket'],
+                        count=row['entries'],
+                    )
+                    for row in grouped.iterator()
+                ]
+            AuditRollup.objects.bulk_create(rollups, batch_size=batch_size)
+            written += len(rollups)
+    return written
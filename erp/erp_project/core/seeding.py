@@ -0,0 +1,258 @@
+# core/seeding.py
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, reset_queries, transaction
+from django.utils.crypto import RANDOM_STRING_CHARS
+
+from .caching import PERMISSION_GLOBAL_VERSION_KEY, bump_content_version, bump_version
+from .models import AuditLog, Company, Permission, Role, RoleAncestor, User, UserCompanyMembership
+from .rollups import rebuild_rollups
+
+# Codenames the views check for; every seeded company has an administrator
+# role holding all of them.
+VIEW_PERMISSIONS = ('role.manage', 'user.manage_memberships', 'permission.view', 'audit.view')
+
+SEED_PASSWORD = 'seed-password'
+
+# Seeded timestamps count back from here, so a seed always gives the same rows.
+SEED_EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+AUDIT_ACTIONS = [action for action, _ in AuditLog.ACTION_CHOICES]
+
+
+class SeedResult:
+    def __init__(self):
+        self.counts = {}
+        self.elapsed = 0.0
+
+    def add(self, name, count):
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def as_dict(self):
+        return {**self.counts, 'seconds': round(self.elapsed, 3)}
+
+
+class TenantSeeder:
+    """
+    Seeds synthetic tenants with ``bulk_create`` in batches of ``batch_size``.
+
+    Everything is derived from ``seed``: company sizes vary around
+    ``users_per_company`` (unless ``uniform``), each role gets a random subset
+    of the permission catalog, each membership one to three roles, and audit
+    entries are spread over the ``audit_days`` before SEED_EPOCH. Roles form
+    an inheritance tree (see ``_seed_roles``). Every user shares one password hash, computed
+    once. The first user of each company holds its ``Administrator`` role,
+    which has every permission.
+    """
+    def __init__(self, seed=0, companies=10, users_per_company=100, roles_per_company=10,
+                 permissions=50, permissions_per_role=10, audit_logs_per_company=1000,
+                 audit_days=90, batch_size=5000, password=SEED_PASSWORD, uniform=False):
+        self.seed = seed
+        self.companies = companies
+        self.users_per_company = users_per_company
+        self.roles_per_company = roles_per_company
+        self.permissions = permissions
+        self.permissions_per_role = permissions_per_role
+        self.audit_logs_per_company = audit_logs_per_company
+        self.audit_days = audit_days
+        self.batch_size = batch_size
+        self.password = password
+        self.uniform = uniform
+        self.random = random.Random(seed)
+
+    def run(self):
+        result = SeedResult()
+        started = time.perf_counter()
+        permission_ids = self._seed_permissions(result)
+        company_ids = self._seed_companies(result)
+        roles = self._seed_roles(company_ids, permission_ids, result)
+        users = self._seed_users(company_ids, roles, result)
+        self._seed_audit_logs(company_ids, users, result)
+        self._invalidate(company_ids)
+        self._analyze()
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def _prefix(self):
+        return f's{self.seed}'
+
+    def _bulk_create(self, model, objects, result, name):
+        """Creates ``objects`` (any iterable) in batches; returns the created rows."""
+        created = []
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                created.extend(model.objects.bulk_create(batch))
+                batch = []
+                # With DEBUG on, every multi-megabyte INSERT would be kept.
+                reset_queries()
+        if batch:
+            created.extend(model.objects.bulk_create(batch))
+        result.add(name, len(created))
+        return created
+
+    def _seed_permissions(self, result):
+        codenames = list(VIEW_PERMISSIONS) + [
+            f'seed.{i}' for i in range(max(0, self.permissions - len(VIEW_PERMISSIONS)))
+        ]
+        existing = dict(Permission.objects.filter(codename__in=codenames).values_list('codename', 'pk'))
+        created = Permission.objects.bulk_create(
+            Permission(codename=codename, name=codename.replace('.', ' ').capitalize())
+            for codename in codenames if codename not in existing
+        )
+        result.add('permissions', len(created))
+        existing.update((permission.codename, permission.pk) for permission in created)
+        return [existing[codename] for codename in codenames]
+
+    def _seed_companies(self, result):
+        with transaction.atomic():
+            companies = self._bulk_create(Company, (
+                Company(name=f'{self._prefix()} Company {c}') for c in range(self.companies)
+            ), result, 'companies')
+        return [company.pk for company in companies]
+
+    def _seed_roles(self, company_ids, permission_ids, result):
+        """
+        Returns ``{company_id: [role_id, ...]}`` in role order. Role 0 is the
+        administrator; the others form a tree under Role 1 (role ``r``
+        inherits from role ``r // 2``), each adding a few permissions.
+        """
+        count = max(1, self.roles_per_company)
+        roles = {company_id: [] for company_id in company_ids}
+        with transaction.atomic():
+            # One level of the tree at a time, so parents have ids.
+            start = 0
+            while start < count:
+                end = min(count, max(2, 2 * start))
+                created = self._bulk_create(Role, (
+                    Role(
+                        name='Administrator' if r == 0 else f'Role {r}', company_id=company_id,
+                        parent_id=roles[company_id][r // 2] if r >= 2 else None,
+                    )
+                    for company_id in company_ids for r in range(start, end)
+                ), result, 'roles')
+                for role in created:
+                    roles[role.company_id].append(role.pk)
+                start = end
+
+            def ancestry(r):
+                depth = 0
+                yield r, depth
+                while r >= 2:
+                    r //= 2
+                    depth += 1
+                    yield r, depth
+
+            # bulk_create skips the signals that maintain the closure.
+            self._bulk_create(RoleAncestor, (
+                RoleAncestor(descendant_id=role_id, ancestor_id=company_roles[a], depth=depth)
+                for company_roles in roles.values()
+                for r, role_id in enumerate(company_roles)
+                for a, depth in ancestry(r)
+            ), result, 'role_ancestors')
+
+            def links():
+                per_role = min(self.permissions_per_role, len(permission_ids))
+                for company_roles in roles.values():
+                    admin, others = company_roles[0], company_roles[1:]
+                    for permission_id in permission_ids:
+                        yield Role.permissions.through(role_id=admin, permission_id=permission_id)
+                    for role_id in others:
+                        for permission_id in self.random.sample(permission_ids, per_role):
+                            yield Role.permissions.through(role_id=role_id, permission_id=permission_id)
+            self._bulk_create(Role.permissions.through, links(), result, 'role_permissions')
+        return roles
+
+    def _company_size(self):
+        if self.uniform:
+            return self.users_per_company
+        # Skewed like real tenants: most are small, a few are several times the mean.
+        return max(1, round(self.random.expovariate(1 / self.users_per_company)))
+
+    def _seed_users(self, company_ids, roles, result):
+        """Returns ``{company_id: [user_id, ...]}``."""
+        # A salt from the seeded generator keeps the hash deterministic; it is
+        # as long as Django's own so check_password does not re-hash it.
+        salt = ''.join(self.random.choice(RANDOM_STRING_CHARS) for _ in range(22))
+        password_hash = make_password(self.password, salt=salt)
+        members = {}
+        pending = []
+
+        def flush():
+            with transaction.atomic():
+                users = User.objects.bulk_create([user for user, _ in pending])
+                memberships = UserCompanyMembership.objects.bulk_create([
+                    UserCompanyMembership(user_id=user.pk, company_id=company_id)
+                    for user, (company_id, _) in zip(users, (info for _, info in pending))
+                ])
+                UserCompanyMembership.roles.through.objects.bulk_create([
+                    UserCompanyMembership.roles.through(usercompanymembership_id=membership.pk, role_id=role_id)
+                    for membership, (_, (_, role_ids)) in zip(memberships, pending)
+                    for role_id in role_ids
+                ])
+            for user, (company_id, _) in zip(users, (info for _, info in pending)):
+                members.setdefault(company_id, []).append(user.pk)
+            result.add('users', len(users))
+            result.add('memberships', len(memberships))
+            pending.clear()
+            reset_queries()
+
+        for c, company_id in enumerate(company_ids):
+            company_roles = roles[company_id]
+            for u in range(self._company_size()):
+                if u == 0:
+                    role_ids = [company_roles[0]]
+                else:
+                    others = company_roles[1:] or company_roles
+                    role_ids = self.random.sample(others, min(len(others), self.random.randint(1, 3)))
+                username = f'{self._prefix()}c{c}u{u}'
+                user = User(
+                    username=username, email=f'{username}@example.com', password=password_hash,
+                    date_joined=SEED_EPOCH - timedelta(days=self.random.randint(0, 365)),
+                )
+                pending.append((user, (company_id, role_ids)))
+                if len(pending) >= self.batch_size:
+                    flush()
+        if pending:
+            flush()
+        return members
+
+    def _seed_audit_logs(self, company_ids, members, result):
+        span = int(timedelta(days=self.audit_days).total_seconds())
+
+        def entries():
+            for company_id in company_ids:
+                user_ids = members.get(company_id, [None])
+                for _ in range(self.audit_logs_per_company):
+                    action = self.random.choice(AUDIT_ACTIONS)
+                    yield AuditLog(
+                        user_id=self.random.choice(user_ids),
+                        company_id=company_id,
+                        action=action,
+                        description=f'Seeded {action}',
+                        created_at=SEED_EPOCH - timedelta(seconds=self.random.randint(0, span)),
+                    )
+        with transaction.atomic():
+            self._bulk_create(AuditLog, entries(), result, 'audit_logs')
+        # bulk_create goes around the audit writer that keeps the rollups.
+        result.add('audit_rollups', rebuild_rollups(company_ids, batch_size=self.batch_size))
+
+    def _analyze(self):
+        # Fresh planner statistics; without them SQLite prefers the
+        # membership company index for every user list query.
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def _invalidate(self, company_ids):
+        # bulk_create sends no signals, so cached permissions and ETags are
+        # invalidated here.
+        bump_version(PERMISSION_GLOBAL_VERSION_KEY)
+        bump_content_version('permissions')
+        for company_id in company_ids:
+            bump_content_version('roles', company_id)
+            bump_content_version('memberships', company_id)
@@ -1,17 +1,83 @@
 # core/serializers.py
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from .caching import PERMISSION_USER_VERSION_KEY, bump_content_version, bump_version
 from .models import User, Company, UserCompanyMembership
-from .models import User, Company, UserCompanyMembership, Permission, Role
+from .models import User, Company, UserCompanyMembership, Permission, Role, AuditLog, AuditRollup
+from .hierarchy import validate_parent
+from .middleware import get_tenant
 from rest_framework import generics
 
 
 
+def requested_names(request, param):
+    """The comma-separated names in query parameter ``param``, or None if it is absent."""
+    params = getattr(request, 'query_params', None)
+    if params is None or param not in params:
+        return None
+    return [name for name in (part.strip() for part in params[param].split(',')) if name]
+
+
+class SparseFieldsetMixin:
+    """
+    Lets read requests choose what a serializer renders: ``?fields=id,username``
+    keeps only the named fields, and ``?expand=company`` renders a field listed
+    in ``expandable_fields`` as a nested object instead of a key (expanded
+    fields are always rendered). Only the top-level serializer is trimmed.
+
+    core.views.SparseQuerysetMixin trims the queryset to match.
+    """
+    expandable_fields = {}
+
+    def _sparse_request(self):
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        parent = self.parent
+        if parent is not None and not (isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+            return None
+        return request
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self._sparse_request()
+        if request is None:
+            return fields
+        expand = requested_names(request, 'expand') or []
+        unknown = [name for name in expand if name not in self.expandable_fields]
+        if unknown:
+            raise serializers.ValidationError({'expand': f"Cannot expand: {', '.join(unknown)}."})
+        for name in expand:
+            fields[name] = self.expandable_fields[name](read_only=True)
+        wanted = requested_names(request, 'fields')
+        if wanted is not None:
+            unknown = [name for name in wanted if name not in fields]
+            if unknown:
+                raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}."})
+            fields = {name: field for name, field in fields.items() if name in wanted or name in expand}
+        return fields
+
+
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
         fields = ['id', 'name', 'is_active', 'created_at']
         read_only_fields = ['id', 'created_at']
 
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email']
+
+
+class RoleSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Role
+        fields = ['id', 'name']
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     company_name = serializers.CharField(write_only=True)
 
@@ -20,6 +86,12 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         fields = ['username', 'email', 'password', 'company_name']
         extra_kwargs = {'password': {'write_only': True}}
 
+    def validate_company_name(self, value):
+        # The name stays taken until core.purging has removed the company.
+        if Company.objects.filter(name=value, deleted_at__isnull=False).exists():
+            raise serializers.ValidationError("This company is being deleted.")
+        return value
+
     def create(self, validated_data):
         company_name = validated_data.pop('company_name')
         company, created = Company.objects.get_or_create(name=company_name)
@@ -34,7 +106,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         
         return user
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     company_memberships = serializers.StringRelatedField(many=True, source='usercompanymembership_set')
     
     class Meta:
@@ -48,21 +120,38 @@ class PermissionSerializer(serializers.ModelSerializer):
         fields = ['id', 'codename', 'name', 'description']
         read_only_fields = ['id']
 
-class RoleSerializer(serializers.ModelSerializer):
+class RoleSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     permissions = serializers.SlugRelatedField(
         many=True,
         slug_field='codename',
         queryset=Permission.objects.all()
     )
     company = serializers.PrimaryKeyRelatedField(read_only=True)
+    parent = serializers.PrimaryKeyRelatedField(queryset=Role.objects.all(), allow_null=True, required=False)
 
     class Meta:
         model = Role
-        fields = ['id', 'name', 'description', 'company', 'permissions']
+        fields = ['id', 'name', 'description', 'company', 'parent', 'permissions']
         read_only_fields = ['id', 'company']
 
-class UserCompanyMembershipSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    expandable_fields = {'company': CompanySerializer, 'parent': RoleSummarySerializer}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        company_id = get_tenant(request).company_id if request is not None else None
+        if company_id is not None and 'parent' in fields:
+            fields['parent'].queryset = Role.objects.filter(company_id=company_id)
+        return fields
+
+    def validate(self, data):
+        if data.get('parent') is not None and self.instance is not None:
+            # Saving would reject a cycle too, but as a server error.
+            validate_parent(self.instance, data['parent'])
+        return data
+
+class UserCompanyMembershipSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.filter(deleted_at__isnull=True))
     company = serializers.PrimaryKeyRelatedField(read_only=True)
     roles = serializers.SlugRelatedField(
         many=True,
@@ -75,15 +164,143 @@ class UserCompanyMembershipSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'company', 'roles']
         read_only_fields = ['id', 'company']
 
+    expandable_fields = {'user': UserSummarySerializer, 'company': CompanySerializer}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        company_id = get_tenant(request).company_id if request is not None else None
+        if company_id is not None and 'roles' in fields:
+            # Role names are only unique within a company
+            fields['roles'].child_relation.queryset = Role.objects.filter(company_id=company_id)
+        return fields
+
     def validate(self, data):
         # Additional validation to ensure roles belong to the same company
         if 'roles' in data:
-            user_company = self.context['request'].user.usercompanymembership_set.first().company
+            company_id = get_tenant(self.context['request']).company_id
             for role in data['roles']:
-                if role.company != user_company:
+                if role.company_id != company_id:
                     raise serializers.ValidationError("Roles must belong to the same company as the requesting user.")
         return data
 
+class MembershipAssignmentSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    roles = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+
+class BulkMembershipSerializer(serializers.Serializer):
+    """
+    Assigns many users (and their roles) to a company at once.
+
+    Users and roles are looked up once for the whole batch, and memberships
+    and role links are written with ``bulk_create`` in a single transaction.
+    Existing memberships get the listed roles added. Each item is reported
+    separately; an invalid item does not stop the others.
+    """
+    assignments = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def validate_assignments(self, value):
+        # Read per request rather than when the class is defined.
+        max_items = getattr(settings, 'BULK_MEMBERSHIP_MAX_ITEMS', 5000)
+        if len(value) > max_items:
+            raise serializers.ValidationError(f"Ensure this field has no more than {max_items} elements.")
+        return value
+
+    def create(self, validated_data):
+        company = validated_data['company']
+        items = validated_data['assignments']
+        results = [None] * len(items)
+        parsed = {}
+        for index, item in enumerate(items):
+            item_serializer = MembershipAssignmentSerializer(data=item)
+            if item_serializer.is_valid():
+                parsed[index] = item_serializer.validated_data
+            else:
+                results[index] = {'index': index, 'status': 'error', 'errors': item_serializer.errors}
+
+        user_ids = {item['user'] for item in parsed.values()}
+        role_names = {name for item in parsed.values() for name in item['roles']}
+        existing_users = set(
+            User.objects.filter(pk__in=user_ids, deleted_at__isnull=True).values_list('pk', flat=True)
+        )
+        role_ids = dict(
+            Role.objects.filter(company=company, name__in=role_names).values_list('name', 'pk')
+        )
+        memberships = dict(
+            UserCompanyMembership.objects.filter(company=company, user_id__in=user_ids).values_list('user_id', 'pk')
+        )
+
+        assignments = {}
+        for index, item in parsed.items():
+            errors = {}
+            if item['user'] not in existing_users:
+                errors['user'] = [f"Invalid pk \"{item['user']}\" - object does not exist."]
+            elif item['user'] in assignments:
+                errors['user'] = ["User is assigned more than once in this request."]
+            unknown = [name for name in item['roles'] if name not in role_ids]
+            if unknown:
+                errors['roles'] = [f"Object with name={name} does not exist." for name in unknown]
+            if errors:
+                results[index] = {'index': index, 'user': item['user'], 'status': 'error', 'errors': errors}
+            else:
+                assignments[item['user']] = (index, [role_ids[name] for name in item['roles']])
+
+        with transaction.atomic():
+            # A concurrent request may have added some of these memberships
+            # since they were read: those rows are skipped, and the ids of
+            # all of them read back.
+            created = {user_id for user_id in assignments if user_id not in memberships}
+            if created:
+                UserCompanyMembership.objects.bulk_create(
+                    [UserCompanyMembership(user_id=user_id, company=company) for user_id in created],
+                    ignore_conflicts=True,
+                )
+                memberships.update(
+                    UserCompanyMembership.objects.filter(company=company, user_id__in=created)
+                    .values_list('user_id', 'pk')
+                )
+            Through = UserCompanyMembership.roles.through
+            Through.objects.bulk_create(
+                [
+                    Through(usercompanymembership_id=memberships[user_id], role_id=role_id)
+                    for user_id, (index, roles) in assignments.items()
+                    for role_id in set(roles)
+                ],
+                ignore_conflicts=True,
+            )
+            # bulk_create sends no signals, so invalidate cached permissions
+            # and membership listings here.
+            transaction.on_commit(lambda: [
+                bump_version(PERMISSION_USER_VERSION_KEY % user_id) for user_id in assignments
+            ])
+            transaction.on_commit(lambda: bump_content_version('memberships', company.pk))
+
+        for user_id, (index, roles) in assignments.items():
+            results[index] = {
+                'index': index,
+                'user': user_id,
+                'status': 'created' if user_id in created else 'updated',
+                'id': memberships[user_id],
+            }
+        return results
+
+
+class AuditLogSerializer(serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+    company = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = AuditLog
+        fields = ['id', 'user', 'company', 'action', 'description', 'created_at']
+        read_only_fields = fields
+
+
+class AuditRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AuditRollup
+        fields = ['bucket', 'action', 'count']
+        read_only_fields = fields
+
 
 # class CompanySerializer(serializers.ModelSerializer):
 #     class Meta:
@@ -0,0 +1,99 @@
+# core/signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .caching import (
+    PERMISSION_COMPANY_VERSION_KEY,
+    PERMISSION_GLOBAL_VERSION_KEY,
+    PERMISSION_USER_VERSION_KEY,
+    bump_content_version,
+    bump_version,
+)
+from .hierarchy import detach_role, insert_role, move_role
+from .models import Permission, Role, User, UserCompanyMembership
+
+M2M_CHANGE_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+def role_permissions_changed(sender, instance, action, reverse, **kwargs):
+    """Invalidates cached permission sets and role listings when a role's permissions change."""
+    if action not in M2M_CHANGE_ACTIONS:
+        return
+    if reverse:
+        # Changed from the Permission side; the affected roles may span
+        # companies. Role listings also depend on the catalog version.
+        bump_version(PERMISSION_GLOBAL_VERSION_KEY)
+        bump_content_version('permissions')
+    else:
+        bump_version(PERMISSION_COMPANY_VERSION_KEY % instance.company_id)
+        bump_content_version('roles', instance.company_id)
+
+
+@receiver(m2m_changed, sender=UserCompanyMembership.roles.through)
+def membership_roles_changed(sender, instance, action, reverse, **kwargs):
+    """Invalidates cached permission sets and membership listings when a membership's roles change."""
+    if action not in M2M_CHANGE_ACTIONS:
+        return
+    if reverse:
+        # Changed from the Role side; every member of the role's company may be affected.
+        bump_version(PERMISSION_COMPANY_VERSION_KEY % instance.company_id)
+    else:
+        bump_version(PERMISSION_USER_VERSION_KEY % instance.user_id)
+    bump_content_version('memberships', instance.company_id)
+
+
+@receiver(post_save, sender=UserCompanyMembership)
+@receiver(post_delete, sender=UserCompanyMembership)
+def membership_changed(sender, instance, **kwargs):
+    bump_version(PERMISSION_USER_VERSION_KEY % instance.user_id)
+    bump_content_version('memberships', instance.company_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Makes the user's stateless tokens stale when their access flags change."""
+    if created or (update_fields is not None and not set(update_fields) & set(User.ACCESS_FIELDS)):
+        return
+    access = tuple(getattr(instance, field) for field in User.ACCESS_FIELDS)
+    # Instances not loaded from the database may have changed any of them.
+    if access != instance.__dict__.get('_loaded_access', ()):
+        bump_version(PERMISSION_USER_VERSION_KEY % instance.pk)
+    instance._loaded_access = access
+
+
+@receiver(post_save, sender=Role)
+def role_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        insert_role(instance)
+    elif update_fields is None or 'parent' in update_fields:
+        # Instances not loaded from the database may have changed parent.
+        loaded = instance.__dict__.get('_loaded_parent_id', ())
+        if instance.parent_id != loaded:
+            move_role(instance)
+            # Members of the role's subtree gain or lose inherited permissions.
+            bump_version(PERMISSION_COMPANY_VERSION_KEY % instance.company_id)
+    instance._loaded_parent_id = instance.parent_id
+    # Memberships list their roles by name.
+    bump_content_version('roles', instance.company_id)
+    bump_content_version('memberships', instance.company_id)
+
+
+@receiver(pre_delete, sender=Role)
+def role_deleting(sender, instance, **kwargs):
+    detach_role(instance)
+
+
+@receiver(post_delete, sender=Role)
+def role_deleted(sender, instance, **kwargs):
+    # Deleting a role drops its through-table rows without sending m2m_changed.
+    bump_version(PERMISSION_COMPANY_VERSION_KEY % instance.company_id)
+    bump_content_version('roles', instance.company_id)
+    bump_content_version('memberships', instance.company_id)
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def permission_changed(sender, instance, **kwargs):
+    bump_version(PERMISSION_GLOBAL_VERSION_KEY)
+    bump_content_version('permissions')
@@ -1,3 +1,2149 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .audit import AuditLogWriter
+from .benchmarks import (
+    ENDPOINTS, USER_SEARCHES, benchmark_endpoints, benchmark_throttle, benchmark_user, benchmark_user_search,
+    failed_login_load,
+)
+from .exporting import ROWS_PER_WRITE
+from .fastpath import FastJSONRenderer
+from .importing import UserImporter, create_hash_executor, iter_rows
+from .jobs import (
+    WorkerMetrics, WorkerPool, claim_job, enqueue, requeue_expired, retry_delay, run_due_jobs, run_job,
+)
+from .middleware import QueryBudgetExceeded, get_tenant
+from .models import AuditLog, AuditRollup, Company, Job, Permission, Purge, Role, RoleAncestor, User, UserCompanyMembership
+from .pagination import EstimatedCountPaginator, UserPagination
+from .permissions import HasPermission, get_permission_map, permission_cache_stats, reset_permission_cache
+from .purging import Purger, purge_pending, soft_delete_company, soft_delete_user
+from .replicas import ReplicaRouter, end_request, start_request
+from .rollups import bucket_start
+from .seeding import SEED_PASSWORD, VIEW_PERMISSIONS, TenantSeeder
+from .templatetags.core_admin import distinct_periods
+from .throttling import TokenBucket
+from .tokens import TokenPrincipal
+from .utils import log_action
+
+
+class HasPermissionCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        self.permission = Permission.objects.create(codename='role.manage', name='Manage roles')
+        self.role = Role.objects.create(name='Admin', company=self.company)
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        self.membership.roles.add(self.role)
+        self.request = SimpleNamespace(user=self.user)
+
+    def check(self, codename='role.manage'):
+        return HasPermission(codename).has_permission(self.request, None)
+
+    def test_warm_cache_costs_no_queries(self):
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.check())
+        with self.assertNumQueries(0):
+            self.assertTrue(self.check())
+            self.assertFalse(self.check('user.manage_memberships'))
+        stats = permission_cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_role_permission_change_invalidates(self):
+        self.assertFalse(self.check())
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.check())
+        self.role.permissions.remove(self.permission)
+        self.assertFalse(self.check())
+
+    def test_membership_role_change_invalidates(self):
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.check())
+        self.membership.roles.clear()
+        self.assertFalse(self.check())
+
+    def test_shared_cache_survives_local_eviction(self):
+        self.role.permissions.add(self.permission)
+        self.check()
+        reset_permission_cache()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.check())
+        self.assertEqual(permission_cache_stats()['shared_hits'], 1)
+
+
+class AuditLogWriterTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.user = User.objects.create_user(username='alice', password='secret')
+        UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        # A long interval keeps the background thread idle; tests flush explicitly.
+        self.writer = AuditLogWriter(batch_size=100, flush_interval=3600, max_pending=1000)
+        self.addCleanup(self.writer.stop)
+
+    def test_flush_writes_batch_in_constant_queries(self):
+        for i in range(50):
+            self.writer.log(self.user, 'update', f'change {i}')
+        self.assertEqual(AuditLog.objects.count(), 0)
+        # Membership lookup, user and company checks, one INSERT and one rollup upsert.
+        with self.assertNumQueries(5):
+            self.writer.flush()
+        self.assertEqual(AuditLog.objects.filter(company=self.company).count(), 50)
+
+    def test_backpressure_bounds_pending_records(self):
+        writer = AuditLogWriter(batch_size=100, flush_interval=3600, max_pending=5)
+        self.addCleanup(writer.stop)
+        for i in range(12):
+            writer.log(self.user, 'update', f'change {i}')
+            self.assertLessEqual(writer.pending, 5)
+        writer.flush()
+        self.assertEqual(AuditLog.objects.count(), 12)
+
+    def test_deleted_user_is_nulled(self):
+        other = User.objects.create_user(username='bob', password='secret')
+        self.writer.log(other, 'delete', 'bye')
+        other.delete()
+        self.writer.flush()
+        self.assertIsNone(AuditLog.objects.get().user_id)
+
+    def test_failed_batch_is_logged_with_traceback(self):
+        self.writer.log(self.user, 'update', 'lost')
+        with patch.object(AuditLog.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertLogs('core.audit', 'ERROR') as logs:
+                self.writer.flush()
+        self.assertIn('Failed to write 1 audit log entries', logs.output[0])
+        self.assertIn('RuntimeError: disk full', logs.output[0])
+
+    @override_settings(AUDIT_LOG_MODE='sync')
+    def test_sync_mode_writes_inline(self):
+        log_action(self.user, 'login', 'signed in')
+        entry = AuditLog.objects.get()
+        self.assertEqual(entry.company, self.company)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(7))
+        UserCompanyMembership.objects.bulk_create(
+            UserCompanyMembership(user=user, company=self.company) for user in users
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(users[0])
+
+    def test_user_list_walks_cursor_without_count(self):
+        seen = []
+        url = '/api/users/?page_size=3'
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(response.data['results']), 3)
+                seen.extend(user['username'] for user in response.data['results'])
+                url = response.data['next']
+        self.assertEqual(seen, [f'user{i}' for i in range(7)])
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_page_size_is_capped(self):
+        request = Request(APIRequestFactory().get('/api/users/', {'page_size': 100000}))
+        self.assertEqual(UserPagination().get_page_size(request), UserPagination.max_page_size)
+
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        other = Company.objects.create(name='Globex')
+        joined = timezone.make_aware(timezone.datetime(2024, 1, 1))
+        self.users = {}
+        for i, (username, email, is_active) in enumerate((
+            ('Alice', 'alice@acme.test', True),
+            ('alex', 'ax@acme.test', True),
+            ('bob', 'Alpha.bob@acme.test', False),
+            ('carol', 'carol@acme.test', True),
+        )):
+            user = User.objects.create(
+                username=username, email=email, is_active=is_active, date_joined=joined + timedelta(days=i),
+            )
+            UserCompanyMembership.objects.create(user=user, company=self.company)
+            self.users[username] = user
+        User.objects.create(username='alfred', email='alfred@globex.test')
+        self.role = Role.objects.create(name='Support', company=self.company)
+        self.foreign_role = Role.objects.create(name='Support', company=other)
+        UserCompanyMembership.objects.get(user=self.users['carol']).roles.add(self.role)
+        membership = UserCompanyMembership.objects.create(user=self.users['alex'], company=other)
+        membership.roles.add(self.foreign_role)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['Alice'])
+
+    def usernames(self, **params):
+        response = self.client.get('/api/users/', params, HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertEqual(response.status_code, 200, response.data)
+        return [user['username'] for user in response.data['results']]
+
+    def test_search_matches_a_case_insensitive_prefix_of_username_or_email(self):
+        self.assertEqual(self.usernames(search='AL'), ['Alice', 'alex', 'bob'])
+        self.assertEqual(self.usernames(search='ax@'), ['alex'])
+        self.assertEqual(self.usernames(search='lice'), [])
+
+    def test_search_uses_the_lowercase_expression(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.usernames(search='al')
+        self.assertTrue(any('LOWER("core_user"."username") >=' in q['sql'] for q in queries.captured_queries))
+
+    def test_contains_matches_a_substring(self):
+        self.assertEqual(self.usernames(contains='ARO'), ['carol'])
+        self.assertEqual(self.usernames(contains='.bob'), ['bob'])
+
+    def test_filters(self):
+        self.assertEqual(self.usernames(is_active='false'), ['bob'])
+        self.assertEqual(self.usernames(role=self.role.pk), ['carol'])
+        # alex holds the role, but in another company.
+        self.assertEqual(self.usernames(role=self.foreign_role.pk), [])
+        self.assertEqual(self.usernames(joined_since='2024-01-02T00:00:00', joined_until='2024-01-04T00:00:00'),
+                         ['alex', 'bob'])
+
+    def test_ordering(self):
+        self.assertEqual(self.usernames(ordering='-username'), ['carol', 'bob', 'alex', 'Alice'])
+        self.assertEqual(self.usernames(ordering='-date_joined', search='a'), ['bob', 'alex', 'Alice'])
+
+    def test_ordering_breaks_ties_by_id(self):
+        User.objects.update(date_joined=timezone.make_aware(timezone.datetime(2024, 1, 1)))
+        expected = ['carol', 'bob', 'alex', 'Alice']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.usernames(ordering='-date_joined'), expected)
+        # date_joined, then id; the values() read path orders by column position.
+        page_query = next(query['sql'] for query in queries.captured_queries if 'FROM "core_user"' in query['sql'])
+        self.assertRegex(page_query, r'ORDER BY \S+ DESC, \S+ DESC LIMIT')
+        # One user per page, across the tie
+        seen = []
+        url = '/api/users/?ordering=-date_joined&page_size=1'
+        while url:
+            response = self.client.get(url, HTTP_X_COMPANY_ID=str(self.company.pk))
+            seen += [user['username'] for user in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_invalid_filters_are_rejected(self):
+        for params in ({'is_active': 'maybe'}, {'role': 'x'}, {'joined_since': 'yesterday'}):
+            response = self.client.get('/api/users/', params, HTTP_X_COMPANY_ID=str(self.company.pk))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(next(iter(params)), response.data)
+
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        permission = Permission.objects.create(codename='user.manage_memberships', name='Manage memberships')
+        self.role = Role.objects.create(name='Admin', company=self.company)
+        self.role.permissions.add(permission)
+        self.child = Role.objects.create(name='Child', company=self.company, parent=self.role)
+        self.user = User.objects.create_user(username='alice', email='alice@acme.test', password='secret')
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        membership.roles.add(self.role)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params, HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results'], [query['sql'] for query in queries.captured_queries]
+
+    def test_fields_trim_the_output_and_the_query(self):
+        full, full_sql = self.get('/api/users/')
+        self.assertIn('company_memberships', full[0])
+        results, sql = self.get('/api/users/', fields='id,username')
+        self.assertEqual(results, [{'id': self.user.pk, 'username': 'alice'}])
+        self.assertEqual(len(sql), len(full_sql) - 1)
+        user_query = next(query for query in sql if query.startswith('SELECT "core_user"."id"'))
+        self.assertNotIn('"core_user"."email"', user_query)
+        self.assertNotIn('"core_user"."password"', user_query)
+
+    def test_related_lists_are_only_prefetched_when_rendered(self):
+        _, full_sql = self.get('/api/roles/')
+        results, sql = self.get('/api/roles/', fields='id,name')
+        self.assertEqual({tuple(role) for role in results}, {('id', 'name')})
+        self.assertTrue(any('"core_permission"' in query for query in full_sql))
+        self.assertFalse(any('"core_permission"' in query for query in sql))
+
+    def test_expand_renders_nested_objects_with_a_join(self):
+        results, sql = self.get('/api/roles/', fields='id', expand='parent,company')
+        child = next(role for role in results if role['id'] == self.child.pk)
+        self.assertEqual(child['parent'], {'id': self.role.pk, 'name': 'Admin'})
+        self.assertEqual(child['company']['name'], 'Acme')
+        results, _ = self.get('/api/memberships/', expand='user')
+        self.assertEqual(results[0]['user'], {'id': self.user.pk, 'username': 'alice', 'email': 'alice@acme.test'})
+        self.assertEqual(results[0]['roles'], ['Admin'])
+
+    def test_unknown_names_are_rejected(self):
+        for params in ({'fields': 'id,password'}, {'expand': 'permissions'}):
+            response = self.client.get('/api/roles/', params, HTTP_X_COMPANY_ID=str(self.company.pk))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(next(iter(params)), response.data)
+
+    def test_writes_ignore_fields(self):
+        response = self.client.patch(
+            f'/api/users/{self.user.pk}/?fields=id', {'email': 'a@acme.test'}, format='json',
+            HTTP_X_COMPANY_ID=str(self.company.pk),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'a@acme.test')
+        self.assertIn('company_memberships', response.data)
+
+    def test_exports_follow_fields(self):
+        response = self.client.get(
+            '/api/users/', {'format': 'csv', 'fields': 'id,username'}, HTTP_X_COMPANY_ID=str(self.company.pk),
+        )
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(), ['id,username', f'{self.user.pk},alice'])
+
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class FastReadPathTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acmé')
+        other = Company.objects.create(name='Globex')
+        codenames = ('user.manage_memberships', 'permission.view', 'role.manage', 'z.last')
+        permissions = [
+            Permission.objects.create(codename=codename, name=codename, description='Line\u2028break <b>')
+            for codename in codenames
+        ]
+        self.role = Role.objects.create(name='Admin', company=self.company, description='Ünïcode "quoted"')
+        self.role.permissions.add(*reversed(permissions))
+        helper = Role.objects.create(name='Helper', company=self.company, parent=self.role)
+        self.user = User.objects.create_user(username='alice', email='alice@acme.test', password='secret')
+        for i in range(4):
+            user = User.objects.create_user(
+                username=f'user{i}', email='', password='secret', is_active=bool(i % 2),
+            )
+            user.date_joined = timezone.now().replace(microsecond=0 if i == 0 else 123456 * i % 999999)
+            user.save()
+            membership = UserCompanyMembership.objects.create(user=user, company=self.company)
+            membership.roles.add(helper, self.role)
+            UserCompanyMembership.objects.create(user=user, company=other)
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        membership.roles.add(self.role)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fetch(self, path, enabled):
+        with override_settings(FAST_READ_PATH=enabled), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_values_path_renders_identical_bytes(self):
+        for path in (
+            '/api/users/', '/api/users/?ordering=-username&page_size=2', '/api/users/?search=user&is_active=true',
+            '/api/roles/', '/api/permissions/', '/api/memberships/', '/api/memberships/?page_size=3',
+        ):
+            slow, slow_queries = self.fetch(path, False)
+            fast, fast_queries = self.fetch(path, True)
+            self.assertEqual(fast.content, slow.content, path)
+            self.assertLessEqual(fast_queries, slow_queries, path)
+            next_page = json.loads(fast.content)['next']
+            if next_page:
+                path = next_page.replace('http://testserver', '')
+                self.assertEqual(self.fetch(path, True)[0].content, self.fetch(path, False)[0].content, path)
+
+    def test_fields_and_expand_use_the_serializer(self):
+        response, _ = self.fetch('/api/roles/?fields=id,name', True)
+        self.assertEqual(set(json.loads(response.content)['results'][0]), {'id', 'name'})
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'text': 'é \u2028 \u2029 \n\t\x00 "</script>"', 'number': 2 ** 40, 'flag': True, 'none': None,
+            'when': timezone.now(), 'day': timezone.now().date(), 'lazy': _lazy('Lazy'), 'nested': [{'a': [1, 2]}],
+            'decimal': Decimal('1.10'),
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+        self.assertEqual(FastJSONRenderer().render({1: 'int key'}), JSONRenderer().render({1: 'int key'}))
+
+
+@override_settings(
+    QUERY_BUDGET_STRICT=True,
+    AUDIT_LOG_MODE='sync',
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class QueryBudgetTests(TestCase):
+    """
+    Every route in core/urls.py must stay within its view's ``query_budget``
+    regardless of how many rows it returns. QueryBudgetMiddleware raises
+    QueryBudgetExceeded in strict mode, which fails the request.
+    """
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        permissions = [
+            Permission.objects.create(codename=codename, name=codename)
+            for codename in ('role.manage', 'user.manage_memberships', 'permission.view')
+        ]
+        self.roles = []
+        for i in range(5):
+            role = Role.objects.create(name=f'Role {i}', company=self.company)
+            role.permissions.set(permissions)
+            self.roles.append(role)
+        self.admin = User.objects.create_user(username='admin', password='secret', is_staff=True)
+        self.memberships = []
+        for user in [self.admin] + [
+            User.objects.create_user(username=f'user{i}', password='secret') for i in range(5)
+        ]:
+            membership = UserCompanyMembership.objects.create(user=user, company=self.company)
+            membership.roles.set(self.roles)
+            self.memberships.append(membership)
+        self.outsider = User.objects.create_user(username='outsider', password='secret')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin)}')
+
+    def assertWithinBudget(self, response, status_code=200):
+        self.assertEqual(response.status_code, status_code, getattr(response, 'data', None))
+        self.assertIn('X-Query-Count', response)
+
+    def add_rows(self, prefix):
+        """Adds as many rows again to every list route."""
+        permissions = [
+            Permission.objects.create(codename=f'{prefix}.{i}', name=f'{prefix} {i}') for i in range(3)
+        ]
+        roles = []
+        for i in range(5):
+            role = Role.objects.create(name=f'{prefix} role {i}', company=self.company)
+            role.permissions.set(permissions)
+            roles.append(role)
+        for i in range(5):
+            user = User.objects.create_user(username=f'{prefix}{i}', password='secret')
+            UserCompanyMembership.objects.create(user=user, company=self.company).roles.set(roles)
+            Company.objects.create(name=f'{prefix} company {i}')
+
+    def list_query_count(self, path):
+        # The first request warms the caches the rows just added invalidated.
+        self.assertWithinBudget(self.client.get(path))
+        response = self.client.get(path)
+        self.assertWithinBudget(response)
+        return int(response['X-Query-Count'])
+
+    def test_list_routes_query_count_does_not_grow_with_rows(self):
+        paths = ['/api/users/', '/api/companies/', '/api/roles/', '/api/permissions/', '/api/memberships/']
+        counts = {path: self.list_query_count(path) for path in paths}
+        self.add_rows('more')
+        self.assertEqual({path: self.list_query_count(path) for path in paths}, counts)
+
+    def test_user_routes(self):
+        self.assertWithinBudget(self.client.get('/api/users/'))
+        self.assertWithinBudget(self.client.get(f'/api/users/{self.admin.pk}/'))
+        self.assertWithinBudget(self.client.patch(f'/api/users/{self.admin.pk}/', {'email': 'a@example.com'}))
+        self.assertWithinBudget(self.client.delete(f'/api/users/{self.outsider.pk}/'), 204)
+        self.assertWithinBudget(self.client.post('/api/users/register/', {
+            'username': 'new', 'email': 'new@example.com', 'password': 'secret', 'company_name': 'Acme',
+        }), 201)
+
+    def test_company_routes(self):
+        self.assertWithinBudget(self.client.get('/api/companies/'))
+        self.assertWithinBudget(self.client.get(f'/api/companies/{self.company.pk}/'))
+        response = self.client.post('/api/companies/', {'name': 'Other'})
+        self.assertWithinBudget(response, 201)
+        self.assertWithinBudget(self.client.patch(f'/api/companies/{response.data["id"]}/', {'name': 'Renamed'}))
+        self.assertWithinBudget(self.client.delete(f'/api/companies/{response.data["id"]}/'), 204)
+
+    def test_role_routes(self):
+        self.assertWithinBudget(self.client.get('/api/roles/'))
+        self.assertWithinBudget(self.client.get(f'/api/roles/{self.roles[0].pk}/'))
+        response = self.client.post('/api/roles/', {'name': 'New', 'permissions': ['role.manage']}, format='json')
+        self.assertWithinBudget(response, 201)
+        self.assertWithinBudget(self.client.patch(
+            f'/api/roles/{response.data["id"]}/', {'permissions': ['permission.view']}, format='json',
+        ))
+        self.assertWithinBudget(self.client.delete(f'/api/roles/{response.data["id"]}/'), 204)
+
+    def test_permission_routes(self):
+        self.assertWithinBudget(self.client.get('/api/permissions/'))
+        permission = Permission.objects.first()
+        self.assertWithinBudget(self.client.get(f'/api/permissions/{permission.pk}/'))
+
+    def test_membership_routes(self):
+        self.assertWithinBudget(self.client.get('/api/memberships/'))
+        self.assertWithinBudget(self.client.get(f'/api/memberships/{self.memberships[1].pk}/'))
+        response = self.client.post(
+            '/api/memberships/', {'user': self.outsider.pk, 'roles': ['Role 0', 'Role 1']}, format='json',
+        )
+        self.assertWithinBudget(response, 201)
+        self.assertWithinBudget(self.client.patch(
+            f'/api/memberships/{response.data["id"]}/', {'roles': ['Role 2']}, format='json',
+        ))
+        self.assertWithinBudget(self.client.delete(f'/api/memberships/{response.data["id"]}/'), 204)
+
+    def test_over_budget_request_fails(self):
+        with patch('core.views.PermissionViewSet.query_budget', 0):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/permissions/')
+
+
+class TenantContextTests(TestCase):
+    def setUp(self):
+        self.acme = Company.objects.create(name='Acme')
+        self.globex = Company.objects.create(name='Globex')
+        self.user = User.objects.create_user(username='alice', password='secret')
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.acme)
+        UserCompanyMembership.objects.create(user=self.user, company=self.globex)
+        role = Role.objects.create(name='Acme role', company=self.acme)
+        role.permissions.add(Permission.objects.create(codename='role.manage', name='Manage roles'))
+        membership.roles.add(role)
+        Role.objects.create(name='Globex role', company=self.globex)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def role_names(self, **headers):
+        response = self.client.get('/api/roles/', **headers)
+        self.assertEqual(response.status_code, 200)
+        return [role['name'] for role in response.data['results']]
+
+    def test_defaults_to_first_membership(self):
+        self.assertEqual(self.role_names(), ['Acme role'])
+
+    def test_header_selects_company(self):
+        self.assertEqual(self.role_names(HTTP_X_COMPANY_ID=str(self.globex.pk)), ['Globex role'])
+
+    def test_header_for_foreign_company_sees_nothing(self):
+        other = Company.objects.create(name='Initech')
+        Role.objects.create(name='Initech role', company=other)
+        self.assertEqual(self.role_names(HTTP_X_COMPANY_ID=str(other.pk)), [])
+
+    def test_superuser_without_membership_gets_400_on_create(self):
+        root = User.objects.create_superuser(username='root', password='secret')
+        client = APIClient()
+        client.force_authenticate(root)
+        for path, data in (
+            ('/api/roles/', {'name': 'New', 'permissions': []}),
+            ('/api/memberships/', {'user': self.user.pk, 'roles': []}),
+            ('/api/memberships/bulk/', {'assignments': [{'user': self.user.pk}]}),
+        ):
+            response = client.post(path, data, format='json')
+            self.assertEqual(response.status_code, 400, (path, response.data))
+        self.assertFalse(Role.objects.filter(name='New').exists())
+
+    def test_company_resolved_once_per_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/roles/', {'name': 'New', 'permissions': []}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Role.objects.get(name='New').company, self.acme)
+        membership_lookups = [
+            query for query in queries.captured_queries
+            if 'FROM "core_usercompanymembership"' in query['sql'] and '"core_company"."name"' in query['sql']
+        ]
+        self.assertEqual(len(membership_lookups), 1)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class AuditRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        self.other = Company.objects.create(name='Globex')
+        self.user = User.objects.create_user(username='auditor', password='secret')
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        role = Role.objects.create(name='Auditor', company=self.company)
+        role.permissions.add(Permission.objects.create(codename='audit.view', name='View audit log'))
+        membership.roles.add(role)
+        self.now = timezone.now()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def write_entries(self, count, start):
+        records = [
+            AuditLog(
+                user=self.user, company=self.company if i % 5 else self.other,
+                action='failed_login' if i % 3 else 'login', created_at=start + timedelta(minutes=37 * i),
+            )
+            for i in range(count)
+        ]
+        AuditLogWriter().write(records, verify=False)
+
+    def rollups(self):
+        return sorted(AuditRollup.objects.values_list('company_id', 'period', 'action', 'bucket', 'count'))
+
+    def test_writer_keeps_rollups_in_step_with_the_log(self):
+        self.write_entries(100, self.now - timedelta(days=2))
+        self.write_entries(100, self.now - timedelta(days=2, minutes=11))
+        incremental = self.rollups()
+        self.assertEqual(
+            sum(count for _, period, _, _, count in incremental if period == AuditRollup.DAY), AuditLog.objects.count(),
+        )
+        self.assertTrue(all(bucket.minute == 0 and bucket.second == 0 for *_, bucket, _ in incremental))
+        out = io.StringIO()
+        call_command('rebuild_audit_rollups', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['rollups'], len(incremental))
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_summary_counts_per_day(self):
+        self.write_entries(100, self.now - timedelta(days=3))
+        # Entries older than the default 90 days and of another company are not counted.
+        self.write_entries(10, self.now - timedelta(days=120))
+        response = self.client.get('/api/audit-logs/summary/', {'action': 'failed_login'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['period'], 'day')
+        self.assertEqual(
+            parse_datetime(response.data['since']), bucket_start(self.now, 'day') - timedelta(days=89),
+        )
+        expected = AuditLog.objects.filter(
+            company=self.company, action='failed_login', created_at__gte=self.now - timedelta(days=4),
+        )
+        self.assertEqual(response.data['totals'], {'failed_login': expected.count()})
+        days = [parse_datetime(row['bucket']) for row in response.data['results']]
+        self.assertEqual(days, sorted(days))
+        self.assertEqual(
+            response.data['results'][0]['count'],
+            expected.filter(created_at__lt=days[0] + timedelta(days=1)).count(),
+        )
+
+        response = self.client.get('/api/audit-logs/summary/', {
+            'period': 'hour', 'since': (self.now - timedelta(days=3)).isoformat(), 'action': ['login', 'failed_login'],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(response.data['totals'].values()), AuditLog.objects.filter(
+            company=self.company, created_at__gte=bucket_start(self.now - timedelta(days=3), 'hour'),
+        ).count())
+
+    def test_summary_reads_only_rollups(self):
+        self.write_entries(50, self.now - timedelta(days=1))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/audit-logs/summary/')
+        self.assertFalse([q for q in queries.captured_queries if 'core_auditlog' in q['sql']])
+
+    def test_summary_validation(self):
+        for params in ({'period': 'week'}, {'action': 'dance'}, {'since': 'yesterday'},
+                       {'period': 'hour', 'since': (self.now - timedelta(days=60)).isoformat()}):
+            self.assertEqual(self.client.get('/api/audit-logs/summary/', params).status_code, 400, params)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class AuditLogAPITests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        other = Company.objects.create(name='Globex')
+        self.user = User.objects.create_user(username='auditor', password='secret')
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        role = Role.objects.create(name='Auditor', company=self.company)
+        role.permissions.add(Permission.objects.create(codename='audit.view', name='View audit log'))
+        membership.roles.add(role)
+        start = timezone.now() - timedelta(days=10)
+        AuditLog.objects.bulk_create([
+            AuditLog(
+                user=self.user if i % 2 else None,
+                company=self.company if i % 3 else other,
+                action='login' if i % 4 else 'failed_login',
+                created_at=start + timedelta(hours=i),
+            )
+            for i in range(200)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_filters_are_tenant_scoped(self):
+        since = (timezone.now() - timedelta(days=9)).isoformat()
+        response = self.client.get('/api/audit-logs/', {'action': 'failed_login', 'since': since, 'page_size': 500})
+        self.assertEqual(response.status_code, 200)
+        expected = AuditLog.objects.filter(
+            company=self.company, action='failed_login', created_at__gte=parse_datetime(since),
+        )
+        self.assertEqual([entry['id'] for entry in response.data['results']],
+                         list(expected.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_invalid_filter_is_rejected(self):
+        self.assertEqual(self.client.get('/api/audit-logs/', {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/audit-logs/', {'action': 'nope'}).status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'uses SQLite EXPLAIN QUERY PLAN output')
+    def test_no_query_path_scans_the_table(self):
+        since = (timezone.now() - timedelta(days=5)).isoformat()
+        filter_sets = [
+            {},
+            {'since': since},
+            {'since': since, 'until': timezone.now().isoformat()},
+            {'action': 'login'},
+            {'action': 'login', 'since': since},
+            {'user': self.user.pk},
+            {'user': self.user.pk, 'since': since},
+            {'user': self.user.pk, 'action': 'login'},
+        ]
+        for filters in filter_sets:
+            with self.subTest(filters=filters), CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/audit-logs/', {**filters, 'page_size': 10})
+                self.assertEqual(response.status_code, 200)
+                if response.data['next']:
+                    self.client.get(response.data['next'])
+            audit_queries = [q['sql'] for q in queries.captured_queries if 'FROM "core_auditlog"' in q['sql']]
+            self.assertTrue(audit_queries)
+            for sql in audit_queries:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plan = ' / '.join(row[-1] for row in cursor.fetchall())
+                self.assertNotRegex(plan, r'SCAN (TABLE )?core_auditlog\b(?! USING)', plan)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True, AUDIT_LOG_MODE='sync')
+class BulkMembershipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        self.permission = Permission.objects.create(codename='user.manage_memberships', name='Manage memberships')
+        self.manager_role = Role.objects.create(name='Manager', company=self.company)
+        self.manager_role.permissions.add(self.permission)
+        self.staff_role = Role.objects.create(name='Staff', company=self.company)
+        Role.objects.create(name='Staff', company=Company.objects.create(name='Globex'))
+        self.admin = User.objects.create_user(username='admin', password='secret')
+        UserCompanyMembership.objects.create(user=self.admin, company=self.company).roles.add(self.manager_role)
+        self.users = User.objects.bulk_create(User(username=f'user{i}') for i in range(50))
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def post(self, assignments):
+        return self.client.post('/api/memberships/bulk/', {'assignments': assignments}, format='json')
+
+    def test_assigns_many_users_in_constant_queries(self):
+        existing = UserCompanyMembership.objects.create(user=self.users[0], company=self.company)
+        assignments = [{'user': user.pk, 'roles': ['Staff']} for user in self.users]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(assignments)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (49, 1, 0))
+        self.assertEqual(response.data['results'][0], {
+            'index': 0, 'user': self.users[0].pk, 'status': 'updated', 'id': existing.pk,
+        })
+        self.assertLessEqual(len(queries), 13)
+        self.assertEqual(self.staff_role.usercompanymembership_set.count(), 50)
+
+    def test_reports_invalid_items_individually(self):
+        response = self.post([
+            {'user': self.users[0].pk, 'roles': ['Staff']},
+            {'user': 999999},
+            {'user': self.users[1].pk, 'roles': ['Nope']},
+            {'user': self.users[0].pk},
+            {'roles': ['Staff']},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['created', 'error', 'error', 'error', 'error'])
+        self.assertIn('roles', response.data['results'][2]['errors'])
+        self.assertEqual(UserCompanyMembership.objects.filter(company=self.company).count(), 2)
+
+    def test_membership_added_concurrently(self):
+        user = self.users[0]
+        bulk_create = UserCompanyMembership.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # Another request adds the membership after it was looked up.
+            UserCompanyMembership.objects.create(user=user, company=self.company)
+            return bulk_create(objs, **kwargs)
+
+        with patch.object(UserCompanyMembership.objects, 'bulk_create', racing_bulk_create):
+            response = self.post([{'user': user.pk, 'roles': ['Staff']}])
+        self.assertEqual(response.status_code, 200)
+        membership = UserCompanyMembership.objects.get(user=user, company=self.company)
+        self.assertEqual(response.data['results'][0]['id'], membership.pk)
+        self.assertEqual(list(membership.roles.all()), [self.staff_role])
+
+    @override_settings(BULK_MEMBERSHIP_MAX_ITEMS=2)
+    def test_item_limit(self):
+        response = self.post([{'user': user.pk} for user in self.users[:3]])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('assignments', response.data)
+        self.assertEqual(self.post([{'user': user.pk} for user in self.users[:2]]).status_code, 200)
+
+    def test_invalidates_cached_permissions(self):
+        user = self.users[0]
+        request = SimpleNamespace(user=user)
+        self.assertFalse(HasPermission('user.manage_memberships').has_permission(request, None))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post([{'user': user.pk, 'roles': ['Manager']}])
+        request = SimpleNamespace(user=user)
+        self.assertTrue(HasPermission('user.manage_memberships').has_permission(request, None))
+
+
+@override_settings(
+    AUDIT_LOG_MODE='sync',
+    USER_IMPORT_WORKERS=0,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class UserImportTests(TestCase):
+    CSV = (
+        "username,email,password,company_name\n"
+        "alice,alice@example.com,s3cret,Acme\n"
+        "bob,bob@example.com,s3cret,Globex\n"
+        ",nobody@example.com,s3cret,Acme\n"
+        "carol,carol@example.com,s3cret,Acme\n"
+        "alice,again@example.com,s3cret,Acme\n"
+    )
+
+    def test_csv_import_in_batches(self):
+        Company.objects.create(name='Acme')
+        rows = iter_rows(io.StringIO(self.CSV), 'csv')
+        with CaptureQueriesContext(connection) as queries:
+            result = UserImporter(batch_size=2).run(rows)
+        self.assertEqual((result.rows, result.created, result.failed), (5, 3, 2))
+        self.assertEqual([error['line'] for error in result.errors], [4, 6])
+        self.assertEqual(
+            sorted(UserCompanyMembership.objects.values_list('user__username', 'company__name')),
+            [('alice', 'Acme'), ('bob', 'Globex'), ('carol', 'Acme')],
+        )
+        self.assertTrue(User.objects.get(username='alice').check_password('s3cret'))
+        # One multi-row INSERT per batch that had new users
+        user_inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "core_user"')]
+        self.assertEqual(len(user_inserts), 2)
+
+    def test_import_on_spawned_process_pool(self):
+        executor = create_hash_executor(2, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            result = UserImporter(executor=executor).run(iter_rows(io.StringIO(self.CSV), 'csv'))
+        finally:
+            executor.shutdown()
+        self.assertEqual((result.created, result.failed), (3, 2))
+        # Hashed by the workers, with the hashers of the settings module.
+        self.assertTrue(User.objects.get(username='carol').password.startswith('pbkdf2_sha256$'))
+
+    def test_rows_are_normalized_and_validated_like_registration(self):
+        csv_data = (
+            "username,email,password\n"
+            "\uff42ob,Bob@EXAMPLE.com,pw\n"
+            "bob,other@example.com,pw\n"
+            "bad name!,bad@example.com,pw\n"
+            f"{'x' * 151},long@example.com,pw\n"
+            "carol,not-an-email,pw\n"
+        )
+        result = UserImporter().run(iter_rows(io.StringIO(csv_data), 'csv'))
+        self.assertEqual((result.created, result.failed), (1, 4))
+        self.assertEqual(list(User.objects.values_list('username', 'email')), [('bob', 'Bob@example.com')])
+        errors = {error['line']: error['error'] for error in result.errors}
+        self.assertIn('Duplicate username bob', errors[3])
+        self.assertTrue(errors[4].startswith('Invalid username'))
+        self.assertTrue(errors[5].startswith('Invalid username'))
+        self.assertTrue(errors[6].startswith('Invalid email'))
+
+    def test_username_registered_during_the_import(self):
+        write_chunk = UserImporter._write_chunk
+
+        def racing_write_chunk(importer, new_rows):
+            if not User.objects.filter(username='bob').exists():
+                # Registration commits the name after the import checked it.
+                User.objects.create_user(username='bob')
+            return write_chunk(importer, new_rows)
+
+        with patch.object(UserImporter, '_write_chunk', racing_write_chunk):
+            result = UserImporter().run(iter_rows(io.StringIO(self.CSV), 'csv'))
+        self.assertEqual((result.created, result.failed), (2, 3))
+        self.assertIn({'line': 3, 'error': 'A user with username bob already exists.'}, result.errors)
+        self.assertEqual(
+            sorted(UserCompanyMembership.objects.values_list('user__username', 'company__name')),
+            [('alice', 'Acme'), ('carol', 'Acme')],
+        )
+
+    def test_ndjson_import_reports_bad_lines(self):
+        data = b'{"username": "dave", "company_name": "Acme"}\n\nnot json\n[1, 2]\n'
+        result = UserImporter().run(iter_rows(io.BytesIO(data), 'ndjson'))
+        self.assertEqual((result.created, result.failed), (1, 2))
+        self.assertFalse(User.objects.get(username='dave').has_usable_password())
+
+    def test_api_upload(self):
+        admin = User.objects.create_user(username='admin', password='secret', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile('users.csv', self.CSV.encode(), content_type='text/csv')
+        response = client.post('/api/users/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 3)
+        self.assertIn('rows_per_second', response.data)
+
+
+@override_settings(
+    AUDIT_LOG_MODE='sync',
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.user = User.objects.create_user(username='alice', password='s3cret')
+        UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        Role.objects.create(name='Staff', company=self.company)
+        Role.objects.create(name='Other', company=Company.objects.create(name='Globex'))
+
+    async def test_register_and_login(self):
+        client = AsyncClient()
+        response = await client.post('/api/async/users/register/', {
+            'username': 'bob', 'email': 'bob@example.com', 'password': 'pw', 'company_name': 'Acme',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = await client.post(
+            '/api/async/token/', {'username': 'bob', 'password': 'pw'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'access', 'refresh'})
+        response = await client.post(
+            '/api/async/token/', {'username': 'bob', 'password': 'wrong'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_register_normalizes_like_sync_view(self):
+        client = AsyncClient()
+        response = await client.post('/api/async/users/register/', {
+            'username': '\uff42ob', 'email': 'Bob@EXAMPLE.com', 'password': 'pw', 'company_name': 'Acme',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        user = await User.objects.aget(email='Bob@example.com')
+        self.assertEqual(user.username, 'bob')
+
+    async def test_lists_match_sync_views(self):
+        token = f'Bearer {AccessToken.for_user(self.user)}'
+        client = AsyncClient()
+        for path in ('users/', 'roles/'):
+            async_response = await client.get(f'/api/async/{path}', headers={'Authorization': token})
+            sync_response = await sync_to_async(self.client.get)(f'/api/{path}', HTTP_AUTHORIZATION=token)
+            self.assertEqual(async_response.status_code, 200)
+            self.assertEqual(async_response.json()['results'], sync_response.json()['results'])
+
+    async def test_list_pages_forward(self):
+        token = f'Bearer {AccessToken.for_user(self.user)}'
+        client = AsyncClient()
+        await User.objects.abulk_create(User(username=f'user{i}') for i in range(4))
+        async for user in User.objects.filter(username__startswith='user'):
+            await UserCompanyMembership.objects.acreate(user=user, company=self.company)
+        url, names = '/api/async/users/?page_size=2', []
+        while url:
+            page = (await client.get(url, headers={'Authorization': token})).json()
+            names.extend(user['username'] for user in page['results'])
+            url = page['next']
+        self.assertEqual(names, ['alice', 'user0', 'user1', 'user2', 'user3'])
+        self.assertEqual((await AsyncClient().get('/api/async/users/')).status_code, 401)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class StatelessTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        self.other = Company.objects.create(name='Globex')
+        self.role = Role.objects.create(name='Viewer', company=self.company)
+        self.role.permissions.add(Permission.objects.create(codename='permission.view', name='View permissions'))
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        self.membership.roles.add(self.role)
+        UserCompanyMembership.objects.create(user=self.user, company=self.other)
+        self.client = APIClient()
+
+    def obtain(self, **headers):
+        response = self.client.post(
+            '/api/token/stateless/', {'username': 'alice', 'password': 'secret'}, format='json', **headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_permissions(self, access, **headers):
+        return self.client.get('/api/permissions/', HTTP_AUTHORIZATION=f'Bearer {access}', **headers)
+
+    def test_authorization_needs_no_queries(self):
+        access = self.obtain()['access']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_permissions(access)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['codename'] for p in response.data['results']], ['permission.view'])
+        self.assertEqual(len(queries), 1)
+        self.assertIn('FROM "core_permission"', queries[0]['sql'])
+
+    def test_token_is_bound_to_its_company(self):
+        access = self.obtain(HTTP_X_COMPANY_ID=str(self.other.pk))['access']
+        self.assertEqual(self.get_permissions(access).status_code, 403)
+        access = self.obtain()['access']
+        self.assertEqual(self.get_permissions(access, HTTP_X_COMPANY_ID=str(self.other.pk)).status_code, 403)
+
+    def test_role_change_makes_token_stale_until_refreshed(self):
+        tokens = self.obtain()
+        self.membership.roles.remove(self.role)
+        response = self.get_permissions(tokens['access'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'].code, 'token_stale')
+
+        response = self.client.post('/api/token/stateless/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_permissions(response.data['access']).status_code, 403)
+
+    def test_access_flag_change_makes_token_stale(self):
+        self.user.is_staff = True
+        self.user.save()
+        tokens = self.obtain()
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {tokens["access"]}'}
+        self.assertEqual(self.client.get('/api/jobs/metrics/', **auth).status_code, 200)
+        # Saves of other fields, as on every login, leave it current.
+        user = User.objects.get(pk=self.user.pk)
+        user.save(update_fields=['last_login'])
+        user.email = 'alice@example.com'
+        user.save()
+        self.assertEqual(self.client.get('/api/jobs/metrics/', **auth).status_code, 200)
+
+        user.is_staff = False
+        user.save()
+        response = self.client.get('/api/jobs/metrics/', **auth)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'].code, 'token_stale')
+        response = self.client.post('/api/token/stateless/refresh/', {'refresh': tokens['refresh']}, format='json')
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {response.data["access"]}'}
+        self.assertEqual(self.client.get('/api/jobs/metrics/', **auth).status_code, 403)
+
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/jobs/metrics/', **auth).status_code, 401)
+        response = self.client.post('/api/token/stateless/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deleted_company_is_no_tenant(self):
+        tokens = self.obtain()
+        soft_delete_company(self.company)
+        response = self.get_permissions(tokens['access'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'].code, 'token_stale')
+        self.assertNotIn(self.company.pk, get_permission_map(self.user))
+        # Nor does a token naming it act for it, stamp or not.
+        request = APIRequestFactory().get('/api/permissions/')
+        request.user = TokenPrincipal(AccessToken(tokens['access']))
+        self.assertEqual(request.user.token_company_id, self.company.pk)
+        self.assertIsNone(get_tenant(request).company_id)
+
+    def test_queryset_update_of_access_flags_makes_token_stale(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        tokens = self.obtain()
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {tokens["access"]}'}
+        User.objects.filter(pk=self.user.pk).update(email='alice@example.com')
+        self.assertEqual(self.client.get('/api/jobs/metrics/', **auth).status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        response = self.client.get('/api/jobs/metrics/', **auth)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'].code, 'token_stale')
+
+    def test_regular_tokens_still_work(self):
+        response = self.get_permissions(AccessToken.for_user(self.user))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_LOCKOUT_THRESHOLD=3, AUDIT_LOG_MODE='sync',
+)
+class LoginLockoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.client = APIClient()
+
+    def login(self, password, path='/api/token/'):
+        return self.client.post(path, {'username': 'alice', 'password': password}, format='json')
+
+    def user_writes(self, queries):
+        return [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "core_user"')
+        ]
+
+    def test_locks_after_threshold_with_one_row_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            statuses = [self.login('wrong').status_code for _ in range(10)]
+        self.assertEqual(statuses, [401, 401] + [403] * 8)
+        self.assertEqual(len(self.user_writes(queries)), 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_locked_out)
+        self.assertEqual(self.user.failed_login_attempts, 3)
+        self.assertTrue(AuditLog.objects.filter(user=self.user, action='failed_login').exists())
+
+        response = self.login('secret')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['detail'].code, 'account_locked')
+        self.assertLessEqual(int(response['Retry-After']), 900)
+
+    def test_locked_requests_skip_the_database(self):
+        for _ in range(3):
+            self.login('wrong')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.login('secret').status_code, 403)
+        self.assertEqual(len(queries), 0)
+
+    def test_success_resets_counter(self):
+        self.login('wrong')
+        self.login('wrong')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.login('secret').status_code, 200)
+        self.assertEqual(self.user_writes(queries), [])
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(self.login('wrong').status_code, 401)
+
+    def test_row_lockout_survives_cache_loss(self):
+        for _ in range(3):
+            self.login('wrong')
+        cache.clear()
+        self.assertEqual(self.login('secret').status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(lockout_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.login('secret').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.failed_login_attempts, self.user.lockout_until), (0, None))
+
+    def test_stateless_and_async_logins_share_the_lockout(self):
+        for _ in range(3):
+            self.login('wrong', path='/api/token/stateless/')
+        self.assertEqual(self.login('secret', path='/api/async/token/').status_code, 403)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    AUDIT_LOG_MODE='sync',
+    # The burst comes from one address; this measures the lockout alone.
+    API_THROTTLE_BUCKETS={},
+)
+class LoginLockoutLoadTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='target', password='secret')
+
+    def test_failed_login_burst_writes_user_row_once(self):
+        report = failed_login_load('target', attempts=500, rate=10000, concurrency=4)
+        self.assertEqual(report['requests'], 500)
+        self.assertEqual(report['user_row_writes'], 1)
+        self.assertEqual(set(report['statuses']), {'401', '403'})
+        self.assertGreaterEqual(report['statuses']['403'], 500 - 4 - 5)
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.role = Role.objects.create(name='Admin', company=self.company)
+        for codename in ('user.manage_memberships', 'audit.view'):
+            self.role.permissions.add(Permission.objects.create(codename=codename, name=codename))
+        self.user = User.objects.create_user(username='alice', password='secret')
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        membership.roles.add(self.role)
+        User.objects.bulk_create(User(username=f'user{i:03}', email=f'user{i}@example.com') for i in range(120))
+        UserCompanyMembership.objects.bulk_create(
+            UserCompanyMembership(user=user, company=self.company)
+            for user in User.objects.filter(username__startswith='user')
+        )
+        outsider = User.objects.create_user(username='outsider')
+        UserCompanyMembership.objects.create(user=outsider, company=Company.objects.create(name='Globex'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def all_pages(self, path):
+        results = []
+        while path:
+            page = self.client.get(path).json()
+            results.extend(page['results'])
+            path = page['next']
+        return results
+
+    def test_ndjson_matches_paginated_json(self):
+        body = self.export('/api/users/?format=ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 121)
+        self.assertEqual(rows, self.all_pages('/api/users/?page_size=50'))
+        self.assertNotIn('outsider', body)
+
+    @override_settings(EXPORT_CHUNK_SIZE=50)
+    def test_export_follows_requested_ordering(self):
+        User.objects.update(date_joined=timezone.now())
+        for ordering in ('-username', 'date_joined'):
+            body = self.export(f'/api/users/?format=ndjson&ordering={ordering}')
+            rows = [json.loads(line) for line in body.splitlines()]
+            self.assertEqual(rows, self.all_pages(f'/api/users/?page_size=50&ordering={ordering}'))
+        self.assertEqual(rows[0]['id'], self.user.pk)
+        self.assertEqual(rows[1]['username'], 'user000')
+
+    def test_csv_membership_export(self):
+        membership = UserCompanyMembership.objects.get(user=self.user)
+        response = self.client.get('/api/memberships/?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('memberships.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 121)
+        self.assertEqual(rows[0], {
+            'id': str(membership.pk), 'user': str(self.user.pk), 'company': str(self.company.pk), 'roles': '["Admin"]',
+        })
+
+    def test_audit_export_keeps_filters_and_order(self):
+        for i in range(3):
+            log_action(self.user, 'update', f'update {i}', company=self.company)
+        log_action(self.user, 'delete', 'gone', company=self.company)
+        body = self.export('/api/audit-logs/?format=ndjson&action=update')
+        self.assertEqual(
+            [json.loads(line)['description'] for line in body.splitlines()],
+            ['update 2', 'update 1', 'update 0'],
+        )
+
+    def test_audit_export_pages_through_equal_timestamps(self):
+        now = timezone.now()
+        AuditLog.objects.bulk_create(
+            AuditLog(user=self.user, company=self.company, action='update', description=str(i), created_at=now)
+            for i in range(250)
+        )
+        body = self.export('/api/audit-logs/?format=ndjson')
+        ids = [json.loads(line)['id'] for line in body.splitlines()]
+        self.assertEqual(ids, sorted(AuditLog.objects.values_list('id', flat=True), reverse=True))
+
+    def test_export_needs_permission(self):
+        self.client.force_authenticate(User.objects.get(username='user000'))
+        self.assertEqual(self.client.get('/api/audit-logs/?format=csv').status_code, 403)
+
+    def test_first_rows_sent_before_the_rest_are_fetched(self):
+        User.objects.bulk_create(User(username=f'bulk{i}') for i in range(5000))
+        UserCompanyMembership.objects.bulk_create(
+            UserCompanyMembership(user=user, company=self.company)
+            for user in User.objects.filter(username__startswith='bulk')
+        )
+        response = self.client.get('/api/users/?format=ndjson')
+        with CaptureQueriesContext(connection) as queries:
+            first = next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(len(first.splitlines()), ROWS_PER_WRITE)
+        user_queries = [query['sql'] for query in queries.captured_queries if 'FROM "core_user"' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+        self.assertTrue(user_queries[0].endswith(f'LIMIT {ROWS_PER_WRITE}'), user_queries[0])
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        self.other = Company.objects.create(name='Globex')
+        self.role = Role.objects.create(name='Admin', company=self.company)
+        for codename in ('permission.view', 'user.manage_memberships'):
+            self.role.permissions.add(Permission.objects.create(codename=codename, name=codename))
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        self.membership.roles.add(self.role)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def etag(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_not_modified_skips_list_queries(self):
+        for path, table in (
+            ('/api/roles/', 'core_role'),
+            ('/api/permissions/', 'core_permission'),
+            ('/api/memberships/', 'core_usercompanymembership_roles'),
+            (f'/api/roles/{self.role.pk}/', 'core_role'),
+        ):
+            etag = self.etag(path)
+            self.assertTrue(etag.startswith('"'))
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertFalse([query for query in queries.captured_queries if f'FROM "{table}"' in query['sql']])
+
+    def test_etag_varies_with_query_string(self):
+        self.assertNotEqual(self.etag('/api/roles/'), self.etag('/api/roles/?page_size=1'))
+
+    def test_role_changes_invalidate_roles_and_memberships(self):
+        roles, memberships = self.etag('/api/roles/'), self.etag('/api/memberships/')
+        self.role.name = 'Owner'
+        self.role.save()
+        self.assertNotEqual(self.etag('/api/roles/'), roles)
+        self.assertNotEqual(self.etag('/api/memberships/'), memberships)
+
+    def test_changes_are_scoped_to_their_company(self):
+        roles, memberships = self.etag('/api/roles/'), self.etag('/api/memberships/')
+        Role.objects.create(name='Elsewhere', company=self.other)
+        UserCompanyMembership.objects.create(user=self.user, company=self.other)
+        self.assertEqual(self.etag('/api/roles/'), roles)
+        self.assertEqual(self.etag('/api/memberships/'), memberships)
+
+    def test_m2m_changes_invalidate(self):
+        roles, memberships = self.etag('/api/roles/'), self.etag('/api/memberships/')
+        extra = Role.objects.create(name='Extra', company=self.company)
+        self.assertNotEqual(self.etag('/api/roles/'), roles)
+        memberships = self.etag('/api/memberships/')
+        self.membership.roles.add(extra)
+        self.assertNotEqual(self.etag('/api/memberships/'), memberships)
+        roles = self.etag('/api/roles/')
+        Permission.objects.get(codename='permission.view').role_set.remove(extra)
+        self.assertNotEqual(self.etag('/api/roles/'), roles)
+
+    def test_permission_catalog_changes_invalidate(self):
+        permissions, roles = self.etag('/api/permissions/'), self.etag('/api/roles/')
+        Permission.objects.create(codename='audit.view', name='View audit log')
+        self.assertNotEqual(self.etag('/api/permissions/'), permissions)
+        self.assertNotEqual(self.etag('/api/roles/'), roles)
+
+    def test_bulk_assignment_invalidates_memberships(self):
+        memberships = self.etag('/api/memberships/')
+        bob = User.objects.create_user(username='bob')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/memberships/bulk/', {'assignments': [{'user': bob.pk, 'roles': ['Admin']}]}, format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.etag('/api/memberships/'), memberships)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user(username='alice')
+
+    def start(self, method, path, user=None):
+        request = getattr(self.factory, method)(path)
+        request.user = user or AnonymousUser()
+        start_request(request, resolve(path).func)
+        self.addCleanup(end_request)
+        return request
+
+    def test_safe_methods_of_opted_in_views_read_from_replica(self):
+        for method, path, alias in (
+            ('get', '/api/roles/', 'replica'),
+            ('get', '/api/permissions/', 'replica'),
+            ('get', '/api/companies/', 'replica'),
+            ('get', '/api/users/', 'replica'),
+            ('post', '/api/token/refresh/', 'replica'),
+            ('post', '/api/token/stateless/refresh/', 'default'),
+            ('post', '/api/roles/', 'default'),
+            ('get', '/api/memberships/', 'default'),
+        ):
+            self.start(method, path)
+            self.assertEqual(self.router.db_for_read(Role), alias, (method, path))
+            end_request()
+
+    def test_writes_pin_the_request_and_the_user(self):
+        request = self.start('get', '/api/roles/', user=self.user)
+        self.assertEqual(self.router.db_for_read(Role), 'replica')
+        self.assertEqual(self.router.db_for_write(Role), 'default')
+        self.assertEqual(self.router.db_for_read(Role), 'default')
+        end_request()
+
+        self.start('get', '/api/roles/', user=self.user)
+        self.assertEqual(self.router.db_for_read(Role), 'default')
+        end_request()
+        self.start('get', '/api/roles/', user=User.objects.create_user(username='bob'))
+        self.assertEqual(self.router.db_for_read(Role), 'replica')
+
+    def test_outside_requests_use_default(self):
+        self.assertEqual(self.router.db_for_read(Role), 'default')
+        self.assertEqual(self.router.db_for_write(Role), 'default')
+
+
+class ReplicaDatabaseTests(TransactionTestCase):
+    """Runs the router against a real second SQLite file, left unreplicated."""
+    alias = 'replica_test'
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.settings[self.alias] = {
+            **connections['default'].settings_dict, 'NAME': os.path.join(directory.name, 'replica.sqlite3'),
+        }
+        self.addCleanup(self.remove_replica)
+        # Let the test connect to the alias, which did not exist at class setup.
+        type(self).databases = self.databases | {self.alias}
+        call_command('migrate', database=self.alias, verbosity=0)
+        override = override_settings(DATABASE_REPLICAS=[self.alias])
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.admin = User.objects.create_user(username='admin', is_staff=True, is_superuser=True)
+        Company.objects.create(name='Acme')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def remove_replica(self):
+        type(self).databases = self.databases - {self.alias}
+        connections[self.alias].close()
+        del connections[self.alias]
+        del connections.settings[self.alias]
+
+    def replicate(self):
+        """Copies the rows of ``default`` as they are now to the replica."""
+        for alias in (DEFAULT_DB_ALIAS, self.alias):
+            connections[alias].ensure_connection()
+        connections[DEFAULT_DB_ALIAS].connection.backup(connections[self.alias].connection)
+
+    def company_names(self):
+        response = self.client.get('/api/companies/')
+        self.assertEqual(response.status_code, 200)
+        return [company['name'] for company in response.data['results']]
+
+    def test_reads_go_to_replica_until_the_user_writes(self):
+        Company.objects.using(self.alias).create(name='Replicated')
+        self.assertEqual(self.company_names(), ['Replicated'])
+        self.assertEqual(self.client.post('/api/companies/', {'name': 'Globex'}).status_code, 201)
+        self.assertEqual(self.company_names(), ['Acme', 'Globex'])
+        cache.clear()
+        self.assertEqual(self.company_names(), ['Replicated'])
+
+    def test_permissions_cached_during_replica_reads_come_from_default(self):
+        reset_permission_cache()
+        company = Company.objects.get(name='Acme')
+        role = Role.objects.create(name='Manager', company=company)
+        for codename in ('permission.view', 'role.manage'):
+            role.permissions.add(Permission.objects.create(codename=codename, name=codename))
+        user = User.objects.create_user(username='alice')
+        membership = UserCompanyMembership.objects.create(user=user, company=company)
+        membership.roles.add(role)
+        self.replicate()
+        # Revoked on default; the replica has not caught up.
+        membership.roles.remove(role)
+        self.client.force_authenticate(user)
+        self.client.get('/api/permissions/')
+        response = self.client.post('/api/roles/', {'name': 'New', 'permissions': []}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_replica_reads_get_no_etag(self):
+        self.assertNotIn('ETag', self.client.get('/api/permissions/'))
+        # Pinned to default after a write
+        self.assertEqual(self.client.post('/api/companies/', {'name': 'Globex'}).status_code, 201)
+        self.assertIn('ETag', self.client.get('/api/permissions/'))
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    AUDIT_LOG_MODE='sync',
+)
+class EndpointBenchmarkTests(TransactionTestCase):
+    def test_every_endpoint_reports_metrics(self):
+        TenantSeeder(
+            companies=2, users_per_company=5, roles_per_company=2, audit_logs_per_company=20, uniform=True,
+        ).run()
+        report = benchmark_endpoints(benchmark_user(), requests=2, concurrency=1)
+        self.assertEqual(set(report), {name for name, _, _, _ in ENDPOINTS})
+        for name, result in report.items():
+            self.assertEqual(result['errors'], 0, (name, result['statuses']))
+            self.assertEqual(result['requests'], 2)
+            self.assertGreater(result['bytes_per_request'], 0, name)
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'queries_per_request'):
+                self.assertIn(key, result)
+        self.assertGreater(report['users.list']['queries_per_request'], 0)
+
+    def test_user_search_benchmark(self):
+        TenantSeeder(seed=0, companies=1, users_per_company=30, audit_logs_per_company=0, uniform=True).run()
+        report = benchmark_user_search(User.objects.get(username='s0c0u0'), requests=2)
+        self.assertEqual(set(report), {name for name, _ in USER_SEARCHES})
+        for name, result in report.items():
+            self.assertEqual(result['statuses'], {'200': 2}, name)
+            self.assertIn('queries_per_request', result)
+        self.assertEqual(report['search.exact_prefix']['rows'], 0)
+        self.assertEqual(report['search.broad_prefix']['rows'], 11)
+
+
+
+@override_settings(AUDIT_LOG_MODE='sync')
+class RoleHierarchyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_permission_cache()
+        self.company = Company.objects.create(name='Acme')
+        self.permissions = {
+            codename: Permission.objects.create(codename=codename, name=codename)
+            for codename in ('role.manage', 'audit.view', 'user.manage_memberships')
+        }
+        self.root = Role.objects.create(name='Root', company=self.company)
+        self.middle = Role.objects.create(name='Middle', company=self.company, parent=self.root)
+        self.leaf = Role.objects.create(name='Leaf', company=self.company, parent=self.middle)
+        self.root.permissions.add(self.permissions['audit.view'])
+        self.middle.permissions.add(self.permissions['role.manage'])
+        self.user = User.objects.create_user(username='alice', password='secret')
+        membership = UserCompanyMembership.objects.create(user=self.user, company=self.company)
+        membership.roles.add(self.leaf)
+
+    def ancestors(self, role):
+        return dict(RoleAncestor.objects.filter(descendant=role).values_list('ancestor__name', 'depth'))
+
+    def effective(self):
+        return get_permission_map(self.user)[self.company.pk]
+
+    def test_roles_inherit_ancestor_permissions(self):
+        self.assertEqual(self.ancestors(self.leaf), {'Leaf': 0, 'Middle': 1, 'Root': 2})
+        self.assertEqual(self.effective(), {'audit.view', 'role.manage'})
+        self.root.permissions.add(self.permissions['user.manage_memberships'])
+        self.assertIn('user.manage_memberships', self.effective())
+
+    def test_resolution_is_one_query_at_any_depth(self):
+        parent = self.leaf
+        for depth in range(5):
+            parent = Role.objects.create(name=f'Deep {depth}', company=self.company, parent=parent)
+        UserCompanyMembership.objects.get(user=self.user).roles.set([parent])
+        reset_permission_cache()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.effective(), {'audit.view', 'role.manage'})
+        # The membership lookup and the permission join.
+        self.assertEqual(len(queries), 2)
+
+    def test_reparenting_updates_the_subtree(self):
+        self.assertIn('audit.view', self.effective())
+        middle = Role.objects.get(pk=self.middle.pk)
+        middle.parent = None
+        middle.save()
+        self.assertEqual(self.ancestors(self.leaf), {'Leaf': 0, 'Middle': 1})
+        self.assertEqual(self.effective(), {'role.manage'})
+        other = Role.objects.create(name='Other', company=self.company)
+        other.permissions.add(self.permissions['user.manage_memberships'])
+        middle.parent = other
+        middle.save()
+        self.assertEqual(self.ancestors(self.leaf), {'Leaf': 0, 'Middle': 1, 'Other': 2})
+        self.assertEqual(self.effective(), {'role.manage', 'user.manage_memberships'})
+
+    def test_cycles_are_rejected(self):
+        root = Role.objects.get(pk=self.root.pk)
+        root.parent = self.leaf
+        with self.assertRaises(ValidationError):
+            root.full_clean()
+        with self.assertRaises(ValidationError):
+            root.save()
+        self.assertIsNone(Role.objects.get(pk=self.root.pk).parent_id)
+        self.assertEqual(self.ancestors(self.root), {'Root': 0})
+
+    def test_parent_must_share_the_company(self):
+        other = Role.objects.create(name='Foreign', company=Company.objects.create(name='Globex'))
+        with self.assertRaises(ValidationError):
+            Role.objects.create(name='Mixed', company=self.company, parent=other)
+        self.assertFalse(Role.objects.filter(name='Mixed').exists())
+
+    def test_deleting_a_role_detaches_its_children(self):
+        self.middle.delete()
+        self.leaf.refresh_from_db()
+        self.assertIsNone(self.leaf.parent_id)
+        self.assertEqual(self.ancestors(self.leaf), {'Leaf': 0})
+        self.assertEqual(self.effective(), set())
+
+    def test_api_rejects_a_cycle(self):
+        self.middle.permissions.add(self.permissions['role.manage'])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        headers = {'HTTP_X_COMPANY_ID': str(self.company.pk)}
+        response = client.patch(f'/api/roles/{self.root.pk}/', {'parent': self.leaf.pk}, format='json', **headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.data)
+        response = client.patch(f'/api/roles/{self.leaf.pk}/', {'parent': self.root.pk}, format='json', **headers)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['parent'], self.root.pk)
+        self.assertEqual(self.ancestors(self.leaf), {'Leaf': 0, 'Root': 1})
+
+
+@override_settings(AUDIT_LOG_MODE='sync', PURGE_MODE='manual')
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.other = Company.objects.create(name='Globex')
+        permission = Permission.objects.create(codename='role.manage', name='Manage roles')
+        parent = None
+        self.roles = []
+        for i in range(3):
+            parent = Role.objects.create(name=f'Role {i}', company=self.company, parent=parent)
+            parent.permissions.add(permission)
+            self.roles.append(parent)
+        self.admin = User.objects.create_user(username='admin', password='secret', is_staff=True)
+        self.users = [User.objects.create_user(username=f'user{i}', password='secret') for i in range(3)]
+        for user in [self.admin, *self.users]:
+            UserCompanyMembership.objects.create(user=user, company=self.company).roles.add(*self.roles)
+            UserCompanyMembership.objects.create(user=user, company=self.other)
+        for user in self.users:
+            AuditLog.objects.create(user=user, company=self.company, action='login')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.admin)}')
+
+    def test_deleted_company_is_hidden_then_purged(self):
+        response = self.client.delete(f'/api/companies/{self.company.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertTrue(Company.objects.filter(pk=self.company.pk, deleted_at__isnull=False).exists())
+        self.assertEqual([c['id'] for c in self.client.get('/api/companies/').data['results']], [self.other.pk])
+        self.assertEqual(self.client.get(f'/api/companies/{self.company.pk}/').status_code, 404)
+        # The company can no longer be acted for.
+        response = self.client.get('/api/roles/', HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get('/api/users/', HTTP_X_COMPANY_ID=str(self.other.pk))
+        self.assertEqual(
+            [m for user in response.data['results'] for m in user['company_memberships']],
+            [f'{user.username} @ Globex' for user in [self.admin, *self.users]],
+        )
+        response = self.client.post('/api/users/register/', {
+            'username': 'new', 'email': 'new@example.com', 'password': 'secret', 'company_name': 'Acme',
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('company_name', response.data)
+
+        call_command('purge_deleted', chunk_size=2, stdout=io.StringIO())
+        self.assertFalse(Company.objects.filter(pk=self.company.pk).exists())
+        self.assertFalse(Role.objects.filter(company=self.company.pk).exists())
+        self.assertFalse(RoleAncestor.objects.exists())
+        self.assertEqual(UserCompanyMembership.objects.filter(company=self.other).count(), 4)
+        self.assertEqual(UserCompanyMembership.roles.through.objects.count(), 0)
+        # The admin's own log entry of the deletion went to their first company, Acme.
+        self.assertEqual(AuditLog.objects.filter(company__isnull=True).count(), 4)
+        purge = Purge.objects.get()
+        self.assertIsNotNone(purge.finished_at)
+        self.assertEqual(purge.progress, {
+            'audit_logs': 4, 'audit_rollups': 2, 'membership_roles': 12, 'memberships': 4, 'role_permissions': 3,
+            'role_ancestors': 6, 'role_parents': 2, 'roles': 3,
+        })
+
+    @skipUnless(connection.vendor == 'sqlite', 'uses SQLite EXPLAIN QUERY PLAN output')
+    def test_lists_read_live_rows_by_index(self):
+        self.admin.is_superuser = True
+        self.admin.save()
+        soft_delete_company(self.company)
+        soft_delete_user(self.users[0])
+        for path, table in [('/api/companies/', 'core_company'), ('/api/users/', 'core_user')]:
+            with self.subTest(path=path), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(path).status_code, 200)
+            sql = next(q['sql'] for q in queries.captured_queries if f'FROM "{table}"' in q['sql'] and 'ORDER BY' in q['sql'])
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = ' / '.join(row[-1] for row in cursor.fetchall())
+            self.assertNotRegex(plan, rf'SCAN (TABLE )?{table}\b(?! USING)', plan)
+
+    def test_interrupted_purge_resumes(self):
+        soft_delete_company(self.company)
+        save = Purge.save
+        saves = []
+
+        def failing_save(purge, *args, **kwargs):
+            saves.append(purge.step)
+            if len(saves) == 5:
+                raise RuntimeError("Connection lost")
+            save(purge, *args, **kwargs)
+
+        with patch.object(Purge, 'save', failing_save), self.assertRaises(RuntimeError):
+            Purger(chunk_size=2).run(Purge.objects.get())
+        purge = Purge.objects.get()
+        self.assertEqual(purge.step, 'membership_roles')
+        self.assertEqual(purge.progress, {'audit_logs': 3, 'membership_roles': 2})
+        self.assertIsNone(purge.finished_at)
+
+        self.assertEqual(purge_pending(chunk_size=5), [purge])
+        purge.refresh_from_db()
+        self.assertEqual(purge.progress['membership_roles'], 12)
+        self.assertFalse(Company.objects.filter(pk=self.company.pk).exists())
+        self.assertEqual(purge_pending(), [])
+
+    def test_deleted_user_is_hidden_then_purged(self):
+        user = self.users[0]
+        token = AccessToken.for_user(user)
+        response = self.client.delete(f'/api/users/{user.pk}/', HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertEqual(response.status_code, 204)
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertIsNotNone(user.deleted_at)
+
+        self.assertEqual(self.client.get(f'/api/users/{user.pk}/').status_code, 404)
+        response = self.client.get('/api/users/', HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertNotIn(user.pk, [row['id'] for row in response.data['results']])
+        self.admin.is_superuser = True
+        self.admin.save()
+        response = self.client.get('/api/memberships/', HTTP_X_COMPANY_ID=str(self.company.pk))
+        self.assertNotIn(user.pk, [row['user'] for row in response.data['results']])
+        response = self.client.post(
+            '/api/memberships/', {'user': user.pk, 'roles': []}, format='json', HTTP_X_COMPANY_ID=str(self.other.pk),
+        )
+        self.assertEqual(response.status_code, 400)
+        other_client = APIClient()
+        other_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(other_client.get('/api/users/').status_code, 401)
+
+        with self.captureOnCommitCallbacks(execute=True), override_settings(PURGE_MODE='sync'):
+            soft_delete_user(self.users[1])
+        self.assertFalse(User.objects.filter(pk=self.users[1].pk).exists())
+        purge_pending()
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        self.assertEqual(UserCompanyMembership.objects.filter(user__in=self.users[:2]).count(), 0)
+        self.assertEqual(AuditLog.objects.filter(action='login', user__isnull=True).count(), 2)
+        self.assertEqual(Role.objects.count(), 3)
+
+
+JOB_CALLS = []
+
+
+def record_job(index):
+    JOB_CALLS.append(index)
+
+
+def failing_job(message):
+    raise RuntimeError(message)
+
+
+TEST_JOB_HANDLERS = {
+    **settings.JOB_HANDLERS,
+    'record': 'core.tests.record_job',
+    'fail': 'core.tests.failing_job',
+}
+
+
+@override_settings(
+    JOB_HANDLERS=TEST_JOB_HANDLERS,
+    JOB_RETRY_BACKOFF=10,
+    AUDIT_LOG_MODE='sync',
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        JOB_CALLS.clear()
+
+    def run_workers(self):
+        # Worker threads would not see this test's transaction.
+        metrics = WorkerMetrics()
+        run_due_jobs('test', metrics)
+        return metrics.as_dict()
+
+    def test_enqueue_checks_the_job_name(self):
+        with self.assertRaises(KeyError):
+            enqueue('missing')
+
+    def test_jobs_run_in_order_of_due_time(self):
+        later = enqueue('record', index=2)
+        enqueue('record', index=1, delay=-5)
+        future = enqueue('record', index=3, delay=60)
+        metrics = self.run_workers()
+        self.assertEqual(JOB_CALLS, [1, 2])
+        self.assertEqual((metrics['jobs'], metrics['succeeded']), (2, 2))
+        later.refresh_from_db()
+        self.assertEqual((later.status, later.attempts, later.locked_by), (Job.SUCCEEDED, 1, ''))
+        self.assertIsNotNone(later.finished_at)
+        self.assertEqual(Job.objects.get(pk=future.pk).status, Job.QUEUED)
+
+    def test_failed_jobs_retry_with_backoff(self):
+        job = enqueue('fail', max_attempts=3, message='boom')
+        for attempt, delay in ((1, 10), (2, 20)):
+            started = timezone.now()
+            self.assertEqual(self.run_workers()['retried'], 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, attempt))
+            self.assertIn('RuntimeError: boom', job.last_error)
+            self.assertAlmostEqual((job.run_after - started).total_seconds(), delay, delta=1)
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(self.run_workers()['failed'], 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertEqual(retry_delay(20), 3600)
+
+    def test_expired_leases_are_requeued(self):
+        job = enqueue('record', index=1)
+        self.assertEqual(claim_job('gone').pk, job.pk)
+        self.assertIsNone(claim_job('other'))
+        self.assertEqual(requeue_expired(), 0)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_expired(), 1)
+        self.run_workers()
+        self.assertEqual(JOB_CALLS, [1])
+        # The stale worker finishing late does not overwrite the outcome.
+        self.assertEqual(run_job(Job.objects.get(pk=job.pk), 'gone'), Job.SUCCEEDED)
+        self.assertEqual(Job.objects.get(pk=job.pk).attempts, 2)
+
+    def test_expired_lease_of_the_last_attempt_fails_the_job(self):
+        job = enqueue('record', index=1, max_attempts=1)
+        claim_job('gone')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_expired(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (Job.FAILED, 1, ''))
+        self.assertIsNotNone(job.finished_at)
+        self.run_workers()
+        self.assertEqual(JOB_CALLS, [])
+
+    def test_user_deletion_queues_one_purge(self):
+        company = Company.objects.create(name='Acme')
+        users = [User.objects.create_user(username=f'user{i}', password='secret') for i in range(3)]
+        for user in users:
+            UserCompanyMembership.objects.create(user=user, company=company)
+        with override_settings():
+            # Queued is also the default.
+            del settings.PURGE_MODE
+            for user in users[:2]:
+                soft_delete_user(user)
+        self.assertEqual(Job.objects.filter(name='purge', status=Job.QUEUED).count(), 1)
+        self.run_workers()
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['user2'])
+
+    def test_metrics_api(self):
+        enqueue('record', index=1)
+        enqueue('fail', max_attempts=1, message='boom')
+        self.run_workers()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='admin', password='secret', is_staff=True))
+        response = client.get('/api/jobs/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['jobs'], {'record': {'succeeded': 1}, 'fail': {'failed': 1}})
+
+
+@override_settings(JOB_HANDLERS=TEST_JOB_HANDLERS)
+class JobWorkerPoolTests(TransactionTestCase):
+    def setUp(self):
+        JOB_CALLS.clear()
+
+    def test_concurrent_workers_run_each_job_once(self):
+        for index in range(60):
+            enqueue('record', index=index)
+        pool = WorkerPool(concurrency=4, burst=True)
+        pool.start()
+        self.assertTrue(pool.join(timeout=60))
+        self.assertEqual(sorted(JOB_CALLS), list(range(60)))
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 60)
+        self.assertEqual(pool.metrics.as_dict()['jobs'], 60)
+
+    def test_run_workers_command(self):
+        enqueue('record', index=1)
+        enqueue('fail', max_attempts=1, message='boom')
+        out = io.StringIO()
+        call_command('run_workers', concurrency=2, burst=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['workers']['succeeded'], report['workers']['failed']), (1, 1))
+        self.assertEqual(report['queue']['status'], {'queued': 0, 'running': 0, 'succeeded': 1, 'failed': 1})
+
+
+THROTTLE_TEST_BUCKETS = {
+    'user': {'rate': 0.1, 'burst': 3},
+    'company': {'rate': 0.1, 'burst': 5},
+    'anon': {'rate': 0.1, 'burst': 10},
+}
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    AUDIT_LOG_MODE='sync',
+    API_THROTTLE_BUCKETS=THROTTLE_TEST_BUCKETS,
+)
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.company = Company.objects.create(name='Acme')
+        self.other = Company.objects.create(name='Other')
+        permissions = [
+            Permission.objects.create(codename=codename, name=codename)
+            for codename in ('user.manage_memberships', 'permission.view')
+        ]
+        self.users = []
+        for company, username in ((self.company, 'alice'), (self.company, 'bob'), (self.other, 'carol')):
+            user = User.objects.create_user(username=username, password='secret')
+            role = Role.objects.create(name=f'Role {username}', company=company)
+            role.permissions.set(permissions)
+            UserCompanyMembership.objects.create(user=user, company=company).roles.add(role)
+            self.users.append(user)
+
+    def tearDown(self):
+        # Buckets drained here would outlive the test's settings.
+        cache.clear()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client
+
+    def test_user_bucket_refuses_with_retry_after(self):
+        client = self.client_for(self.users[0])
+        for _ in range(3):
+            self.assertEqual(client.get('/api/users/').status_code, 200)
+        response = client.get('/api/users/')
+        self.assertEqual(response.status_code, 429)
+        # One token comes back every ten seconds.
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_company_bucket_is_shared_by_its_members(self):
+        alice, bob, carol = (self.client_for(user) for user in self.users)
+        for _ in range(3):
+            self.assertEqual(alice.get('/api/users/').status_code, 200)
+        self.assertEqual(bob.get('/api/users/').status_code, 200)
+        self.assertEqual(bob.get('/api/users/').status_code, 200)
+        self.assertEqual(bob.get('/api/users/').status_code, 429)
+        # Another company is not affected.
+        self.assertEqual(carol.get('/api/users/').status_code, 200)
+
+    def test_refused_requests_take_no_tokens(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        self.assertEqual(bucket.take('bucket', 1, now=100), 0)
+        self.assertEqual(bucket.take('bucket', 1, now=100), 0)
+        for _ in range(5):
+            self.assertEqual(bucket.take('bucket', 1, now=100), 1.0)
+        self.assertEqual(bucket.take('bucket', 1, now=100.5), 0.5)
+        self.assertEqual(bucket.take('bucket', 1, now=101), 0)
+        # Refilled, but never past ``burst``.
+        self.assertEqual(bucket.take('bucket', 2, now=200), 0)
+        self.assertEqual(bucket.take('bucket', 1, now=200), 1.0)
+        # More than ``burst`` needs a full bucket.
+        self.assertEqual(bucket.take('bucket', 10, now=203), 0)
+
+    def test_endpoint_costs(self):
+        alice, bob, carol = (self.client_for(user) for user in self.users)
+        # An export takes 20 tokens, more than either bucket holds.
+        self.assertEqual(bob.get('/api/users/?format=ndjson').status_code, 200)
+        self.assertEqual(bob.get('/api/users/').status_code, 429)
+        self.assertEqual(alice.get('/api/users/').status_code, 429)
+        # So does the bulk endpoint.
+        response = carol.post('/api/memberships/bulk/', {'items': []}, format='json')
+        self.assertNotEqual(response.status_code, 429)
+        response = carol.get('/api/users/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_anonymous_requests_share_a_bucket_per_address(self):
+        for i in range(2):
+            response = self.client.post('/api/users/register/', {
+                'username': f'new{i}', 'email': '', 'password': 'secret', 'company_name': 'Acme',
+            })
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/token/', {'username': 'alice', 'password': 'secret'})
+        self.assertEqual(response.status_code, 429)
+        response = self.client.post('/api/token/', {'username': 'alice', 'password': 'secret'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_async_views_take_from_the_same_buckets(self):
+        client = AsyncClient()
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.users[0])}'}
+        for path in ('users/', 'roles/', 'permissions/'):
+            self.assertEqual((await client.get(f'/api/async/{path}', headers=headers)).status_code, 200)
+        response = await sync_to_async(self.client_for(self.users[0]).get)('/api/users/')
+        self.assertEqual(response.status_code, 429)
+        response = await client.get('/api/async/users/', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+
+        for i in range(2):
+            response = await client.post('/api/async/users/register/', {
+                'username': f'new{i}', 'email': '', 'password': 'secret', 'company_name': 'Acme',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+        response = await client.post(
+            '/api/async/token/', {'username': 'alice', 'password': 'secret'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(API_THROTTLE_BUCKETS={})
+    def test_empty_buckets_turn_the_throttle_off(self):
+        client = self.client_for(self.users[0])
+        for _ in range(10):
+            self.assertEqual(client.get('/api/users/').status_code, 200)
+
+    @override_settings(API_THROTTLE_BUCKETS={})
+    def test_benchmark(self):
+        report = benchmark_throttle(
+            self.users[0], requests=5, quiet_user=self.users[2],
+            buckets={'user': {'rate': 0.1, 'burst': 2}},
+        )
+        self.assertEqual(set(report['buckets_us_per_take']), {'full', 'draining', 'refusing'})
+        self.assertEqual(report['overhead']['statuses'], {'200': 10})
+        self.assertEqual(report['fairness']['statuses'], {'noisy': {'200': 2, '429': 3}, 'quiet': {'200': 1}})
+        self.assertEqual(report['fairness']['retry_after_seconds'], [10])
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    AUDIT_LOG_MODE='sync',
+)
+class AdminTests(TestCase):
+    CHANGELISTS = [
+        '/admin/core/auditlog/', '/admin/core/usercompanymembership/', '/admin/core/role/',
+        '/admin/core/user/', '/admin/core/company/',
+    ]
+    # Spread over 2023 and 2025, none in 2024.
+    LOG_DATES = [
+        timezone.make_aware(timezone.datetime(2023, 3, 5, 12)),
+        timezone.make_aware(timezone.datetime(2023, 11, 30, 23)),
+        timezone.make_aware(timezone.datetime(2025, 1, 1, 0)),
+        timezone.make_aware(timezone.datetime(2025, 1, 31, 8)),
+    ]
+
+    def setUp(self):
+        self.root = User.objects.create_superuser('root', 'root@example.com', 'secret')
+        self.client.force_login(self.root)
+        self.companies = [Company.objects.create(name=f'Company {i}') for i in range(3)]
+
+    def seed(self, start, count):
+        for i in range(start, start + count):
+            company = self.companies[i % 3]
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='secret')
+            parent = Role.objects.filter(company=company).first()
+            role = Role.objects.create(name=f'Role {i}', company=company, parent=parent)
+            UserCompanyMembership.objects.create(user=user, company=company).roles.add(role)
+            AuditLog.objects.bulk_create(
+                AuditLog(user=user, company=company, action='login', created_at=created_at)
+                for created_at in self.LOG_DATES
+            )
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response, len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.seed(0, 3)
+        before = {url: self.get(url)[1] for url in self.CHANGELISTS}
+        self.seed(3, 15)
+        self.assertEqual({url: self.get(url)[1] for url in self.CHANGELISTS}, before)
+
+    def test_large_tables_are_not_counted(self):
+        self.seed(0, 6)
+        with patch.object(EstimatedCountPaginator, 'exact_count_limit', 5):
+            # Unfiltered: the estimate from the largest id.
+            response, _ = self.get('/admin/core/auditlog/')
+            self.assertEqual(response.context['cl'].result_count, AuditLog.objects.order_by('-pk')[0].pk)
+            # Filtered: counted up to the limit.
+            response, _ = self.get(f'/admin/core/auditlog/?company__id__exact={self.companies[0].pk}')
+            self.assertEqual(response.context['cl'].result_count, 5)
+            self.assertEqual(len(response.context['cl'].result_list), 8)
+        response, _ = self.get('/admin/core/auditlog/?action__exact=login')
+        self.assertEqual(response.context['cl'].result_count, 24)
+
+    def test_company_filters_take_an_id(self):
+        self.seed(0, 6)
+        company = self.companies[1]
+        for url, model in [
+            ('/admin/core/auditlog/', AuditLog),
+            ('/admin/core/usercompanymembership/', UserCompanyMembership),
+            ('/admin/core/role/', Role),
+        ]:
+            with self.subTest(url=url):
+                response, _ = self.get(url)
+                self.assertContains(response, 'name="company__id__exact"')
+                self.assertNotContains(response, f'company__id__exact={company.pk}')
+                response, _ = self.get(f'{url}?company__id__exact={company.pk}&o=1')
+                self.assertEqual(
+                    {obj.pk for obj in response.context['cl'].result_list},
+                    set(model.objects.filter(company=company).values_list('pk', flat=True)),
+                )
+                self.assertContains(response, f'value="{company.pk}"')
+                self.assertContains(response, 'type="hidden" name="o" value="1"')
+
+    def test_date_hierarchy_lists_periods_with_rows(self):
+        self.seed(0, 2)
+        queryset = AuditLog.objects.all()
+        for kind in ('year', 'month', 'day'):
+            self.assertEqual(distinct_periods(queryset, 'created_at', kind), list(queryset.datetimes('created_at', kind)))
+        response, _ = self.get('/admin/core/auditlog/')
+        self.assertContains(response, 'created_at__year=2023')
+        self.assertContains(response, 'created_at__year=2025')
+        self.assertNotContains(response, 'created_at__year=2024')
+        response, _ = self.get('/admin/core/auditlog/?created_at__year=2025&created_at__month=1')
+        self.assertContains(response, 'created_at__day=1')
+        self.assertContains(response, 'created_at__day=31')
+        self.assertNotContains(response, 'created_at__day=2"')
+
+    def test_user_search_matches_a_prefix(self):
+        self.seed(0, 12)
+        response, _ = self.get('/admin/core/user/?q=USER1')
+        self.assertEqual(
+            sorted(user.username for user in response.context['cl'].result_list),
+            ['user1', 'user10', 'user11'],
+        )
+
+    def test_autocomplete_and_forms(self):
+        self.seed(0, 3)
+        response, queries = self.get(
+            '/admin/autocomplete/?app_label=core&model_name=usercompanymembership&field_name=roles&term=Role'
+        )
+        self.assertEqual([result['text'] for result in response.json()['results']], [
+            'Role 0 (Company 0)', 'Role 1 (Company 1)', 'Role 2 (Company 2)',
+        ])
+        membership = UserCompanyMembership.objects.first()
+        self.get(f'/admin/core/usercompanymembership/{membership.pk}/change/')
+        self.get(f'/admin/core/auditlog/{AuditLog.objects.first().pk}/change/')
+        response = self.client.post('/admin/core/user/add/', {
+            'username': 'added', 'password1': 'a-long-secret-1', 'password2': 'a-long-secret-1',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(User.objects.get(username='added').check_password('a-long-secret-1'))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TenantSeederTests(TestCase):
+    def seed(self, seed):
+        TenantSeeder(
+            seed=seed, companies=3, users_per_company=4, roles_per_company=3, permissions=8,
+            permissions_per_role=2, audit_logs_per_company=10, batch_size=3,
+        ).run()
+
+    def snapshot(self):
+        return {
+            'users': list(User.objects.order_by('username').values_list('username', 'date_joined')),
+            'roles': sorted(
+                (role.company.name, role.name, tuple(sorted(p.codename for p in role.permissions.all())))
+                for role in Role.objects.select_related('company').prefetch_related('permissions')
+            ),
+            'memberships': sorted(
+                (m.user.username, m.company.name, tuple(sorted(r.name for r in m.roles.all())))
+                for m in UserCompanyMembership.objects.select_related('user', 'company').prefetch_related('roles')
+            ),
+            'audit': sorted(AuditLog.objects.values_list('user__username', 'company__name', 'action', 'created_at')),
+        }
+
+    def test_same_seed_gives_same_data(self):
+        self.seed(7)
+        first = self.snapshot()
+        for model in (AuditLog, UserCompanyMembership, Role, User, Company):
+            model.objects.all().delete()
+        self.seed(7)
+        self.assertEqual(self.snapshot(), first)
+        self.assertEqual(len(first['audit']), 30)
+        self.assertEqual(Permission.objects.count(), 8)
+
+    def test_company_admin_can_use_the_api(self):
+        self.seed(1)
+        admin = User.objects.get(username='s1c0u0')
+        self.assertTrue(admin.check_password(SEED_PASSWORD))
+        company = Company.objects.get(name='s1 Company 0')
+        self.assertTrue(set(VIEW_PERMISSIONS) <= get_permission_map(admin)[company.pk])
+        # Seeded users share one password hash.
+        self.assertEqual(User.objects.values('password').distinct().count(), 1)
+
+    def test_command_reports_counts(self):
+        out = io.StringIO()
+        call_command('seed_tenants', companies=2, users=3, audit_logs=5, seed=3, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['companies'], 2)
+        self.assertEqual(report['audit_logs'], 10)
+        self.assertEqual(report['users'], User.objects.count())
@@ -0,0 +1,153 @@
+# core/throttling.py
+"""
+Per-tenant API throttling.
+
+Every request takes tokens from two buckets in the shared cache: one of the
+user and one of their active company, so a single user cannot use up their
+company's allowance and a company's batch scripts cannot starve other
+companies. Anonymous requests use a bucket per client address. A bucket
+holds up to ``burst`` tokens and refills at ``rate`` tokens per second
+(``API_THROTTLE_BUCKETS``); a request costs its view's ``throttle_cost``.
+
+A bucket is stored as one integer, the time in milliseconds at which it
+will be full again (the "theoretical arrival time" of GCRA). Taking ``n``
+tokens moves it ``n / rate`` seconds later with an atomic ``incr``, and the
+request is refused when that puts it more than ``burst / rate`` seconds
+ahead of now; the tokens are then given back with ``decr``. A client over
+its limit therefore only ever does atomic operations. A bucket whose time
+has passed is full, and is moved up to now with a plain ``set``: concurrent
+requests of an idle client may overwrite each other there, which only ever
+lets a few extra requests through.
+"""
+import math
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .caching import get_cache
+from .middleware import get_tenant
+
+THROTTLE_KEY = 'throttle:%s:%s'
+
+# Kept for a while after a bucket fills up, in case the client comes back.
+BUCKET_IDLE_TIMEOUT = 60
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def declared_throttle_cost(view, request):
+    """
+    The ``throttle_cost`` declared by ``view`` for ``request``: either an
+    int or a dict keyed by viewset action or lowercase HTTP method, like
+    ``query_budget``. Defaults to 1.
+    """
+    cost = getattr(view, 'throttle_cost', 1)
+    if isinstance(cost, dict):
+        cost = cost.get(getattr(view, 'action', None) or request.method.lower(), 1)
+    return cost
+
+
+def get_throttle_cost(view, request):
+    """The tokens a request costs: the view's ``get_throttle_cost()`` if it has one."""
+    if hasattr(view, 'get_throttle_cost'):
+        return view.get_throttle_cost(request)
+    return declared_throttle_cost(view, request)
+
+
+class TokenBucket:
+    """A bucket of ``burst`` tokens refilled at ``rate`` tokens per second."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.capacity_ms = math.ceil(burst * 1000 / rate)
+        self.timeout = math.ceil(self.capacity_ms / 1000) + BUCKET_IDLE_TIMEOUT
+
+    def take(self, key, cost, now=None):
+        """
+        Takes ``cost`` tokens from the bucket stored under ``key``. Returns 0
+        when they were taken, else the seconds until they will be available.
+        """
+        cache = get_cache()
+        now_ms = int((time.time() if now is None else now) * 1000)
+        # More than a full bucket is never available; such a request only
+        # needs the bucket to be full.
+        step = math.ceil(min(cost, self.burst) * 1000 / self.rate)
+        try:
+            full_at = cache.incr(key, step)
+        except ValueError:
+            # No bucket yet, or it expired: it is full.
+            if cache.add(key, now_ms + step, timeout=self.timeout):
+                return 0
+            full_at = cache.incr(key, step)
+        if full_at - step < now_ms:
+            cache.set(key, now_ms + step, timeout=self.timeout)
+            return 0
+        if full_at - now_ms <= self.capacity_ms:
+            return 0
+        cache.decr(key, step)
+        # Keep an emptied bucket for as long as it takes to refill.
+        cache.touch(key, self.timeout)
+        return (full_at - now_ms - self.capacity_ms) / 1000
+
+    def give_back(self, key, cost):
+        """Returns tokens taken by a request another bucket refused."""
+        try:
+            get_cache().decr(key, math.ceil(min(cost, self.burst) * 1000 / self.rate))
+        except ValueError:
+            pass
+
+
+def get_bucket(scope):
+    """The TokenBucket configured for ``scope`` in API_THROTTLE_BUCKETS, or None."""
+    config = _setting('API_THROTTLE_BUCKETS', {}).get(scope)
+    if not config:
+        return None
+    return TokenBucket(config['rate'], config['burst'])
+
+
+class TenantThrottle(BaseThrottle):
+    """
+    Token buckets per user and per active company, or per client address
+    for anonymous requests. See the module docstring.
+    """
+    def get_buckets(self, request):
+        """``[(bucket, key)]`` a request takes tokens from."""
+        user = request.user
+        if not user or not user.is_authenticated:
+            scopes = [('anon', self.get_ident(request))]
+        else:
+            scopes = [('user', user.pk)]
+            company_id = get_tenant(request).company_id
+            if company_id is not None:
+                scopes.append(('company', company_id))
+        buckets = []
+        for scope, ident in scopes:
+            bucket = get_bucket(scope)
+            if bucket is not None:
+                buckets.append((bucket, THROTTLE_KEY % (scope, ident)))
+        return buckets
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        buckets = self.get_buckets(request)
+        if not buckets:
+            return True
+        cost = get_throttle_cost(view, request)
+        if not cost:
+            return True
+        taken = []
+        for bucket, key in buckets:
+            wait = bucket.take(key, cost)
+            if wait:
+                for other, other_key in taken:
+                    other.give_back(other_key, cost)
+                self.wait_seconds = wait
+                return False
+            taken.append((bucket, key))
+        return True
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,161 @@
+# core/tokens.py
+"""
+Opt-in stateless JWTs.
+
+Besides the user id, a stateless token carries the active company (``cid``),
+a bitmap of the user's permissions in that company (``perms``, one bit per
+``Permission.id``) and a stamp of the permission versions it was built from
+(``pv``). Requests authenticated with one need no user or permission
+queries. The stamp is checked against the cached version counters on every
+request, so a role change, or a change of the user's ``is_active``,
+``is_staff`` or ``is_superuser``, makes older tokens fail with
+``token_stale`` until they are refreshed.
+"""
+import base64
+import hashlib
+
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .caching import (
+    PERMISSION_COMPANY_VERSION_KEY,
+    PERMISSION_GLOBAL_VERSION_KEY,
+    PERMISSION_USER_VERSION_KEY,
+    LRUCache,
+    get_versions,
+)
+from .lockout import LockoutTokenObtainPairSerializer
+from .middleware import TENANT_HEADER, resolve_company
+from .models import Permission, User
+
+COMPANY_CLAIM = 'cid'
+PERMISSIONS_CLAIM = 'perms'
+VERSION_CLAIM = 'pv'
+
+_catalog_cache = LRUCache(maxsize=2)
+
+
+def get_permission_catalog():
+    """Returns ``{codename: id}`` for every Permission, cached per catalog version."""
+    version = get_versions([PERMISSION_GLOBAL_VERSION_KEY])[PERMISSION_GLOBAL_VERSION_KEY]
+    catalog = _catalog_cache.get(version)
+    if catalog is None:
+        # Cached per version, so never read from a lagging replica.
+        catalog = dict(Permission.objects.using(DEFAULT_DB_ALIAS).values_list('codename', 'pk'))
+        _catalog_cache.set(version, catalog)
+    return catalog
+
+
+def encode_bitmap(bits):
+    value = 0
+    for bit in bits:
+        value |= 1 << bit
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_bitmap(encoded):
+    raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    return int.from_bytes(raw, 'little')
+
+
+def permission_stamp(user_id, company_id):
+    """A short digest of the permission versions that apply to a user in a company."""
+    keys = [
+        PERMISSION_GLOBAL_VERSION_KEY,
+        PERMISSION_USER_VERSION_KEY % user_id,
+        PERMISSION_COMPANY_VERSION_KEY % company_id,
+    ]
+    versions = get_versions(keys)
+    payload = ':'.join(str(versions[key]) for key in keys).encode()
+    return hashlib.blake2b(payload, digest_size=6).hexdigest()
+
+
+def add_stateless_claims(token, user, company):
+    """Adds the tenant, permission and version claims to ``token``."""
+    # Imported here: DRF loads this module while rest_framework.generics is
+    # still importing, and core.permissions defines generic views.
+    from .permissions import get_permission_map
+
+    company_id = company.pk if company is not None else None
+    # Stamp first: a change made while the bitmap is built leaves the token stale.
+    token[VERSION_CLAIM] = permission_stamp(user.pk, company_id)
+    catalog = get_permission_catalog()
+    codenames = get_permission_map(user).get(company_id, ())
+    token[COMPANY_CLAIM] = company_id
+    token[PERMISSIONS_CLAIM] = encode_bitmap(catalog[codename] for codename in codenames if codename in catalog)
+    token['username'] = user.username
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    return token
+
+
+class TokenPrincipal(TokenUser):
+    """The request user for a stateless token, built without any query."""
+    stateless = True
+
+    @cached_property
+    def id(self):
+        return int(self.token[jwt_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def token_company_id(self):
+        return self.token.get(COMPANY_CLAIM)
+
+    @cached_property
+    def permission_bits(self):
+        return decode_bitmap(self.token.get(PERMISSIONS_CLAIM, ''))
+
+    def has_company_permission(self, codename):
+        """Whether the token grants ``codename`` in its company."""
+        bit = get_permission_catalog().get(codename)
+        return bit is not None and bool(self.permission_bits >> bit & 1)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that also accepts stateless tokens. Regular tokens are
+    still resolved to a User row.
+    """
+    def get_user(self, validated_token):
+        if PERMISSIONS_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        principal = TokenPrincipal(validated_token)
+        if validated_token.get(VERSION_CLAIM) != permission_stamp(principal.id, principal.token_company_id):
+            raise AuthenticationFailed(
+                "Token permissions are out of date; refresh the token.", code='token_stale',
+            )
+        return principal
+
+
+class StatelessTokenObtainPairSerializer(LockoutTokenObtainPairSerializer):
+    """Issues a stateless token pair for the company picked by ``X-Company-ID``."""
+    def validate(self, attrs):
+        super().validate(attrs)
+        request = self.context.get('request')
+        company = resolve_company(self.user, request.META.get(TENANT_HEADER) if request else None)
+        refresh = add_stateless_claims(self.get_token(self.user), self.user, company)
+        return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+class StatelessTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refreshes a stateless token, rebuilding its claims from the database."""
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(
+            **{jwt_settings.USER_ID_FIELD: refresh[jwt_settings.USER_ID_CLAIM]}, is_active=True,
+        ).first()
+        if user is None:
+            raise AuthenticationFailed("User not found", code='user_not_found')
+        company = resolve_company(user, refresh.get(COMPANY_CLAIM))
+        add_stateless_claims(refresh, user, company)
+        return {'access': str(refresh.access_token)}
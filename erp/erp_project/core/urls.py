@@ -7,15 +7,26 @@ from .models import Company
 from .serializers import CompanySerializer
 
 
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.routers import DefaultRouter
+from .async_views import (
+    AsyncPermissionListView,
+    AsyncRoleListView,
+    AsyncTokenObtainPairView,
+    AsyncUserListView,
+    AsyncUserRegistrationView,
+)
 from .views import (
     UserRegistrationView,
+    UserImportView,
+    JobMetricsView,
     UserListView,
     UserDetailView,
     CompanyViewSet,
     RoleViewSet,
     PermissionViewSet,
-     UserCompanyMembershipViewSet
+     UserCompanyMembershipViewSet,
+    AuditLogViewSet
 )
 
 router = DefaultRouter()
@@ -23,12 +34,22 @@ router.register(r'companies', CompanyViewSet)
 router.register(r'roles', RoleViewSet)
 router.register(r'permissions', PermissionViewSet)
 router.register(r'memberships', UserCompanyMembershipViewSet)
+router.register(r'audit-logs', AuditLogViewSet)
 
 urlpatterns = [
     # API for user authentication and management
     path('users/register/', UserRegistrationView.as_view(), name='user-register'),
+    path('users/import/', UserImportView.as_view(), name='user-import'),
     path('users/', UserListView.as_view(), name='user-list'),
     path('users/<int:pk>/', UserDetailView.as_view(), name='user-detail'),
+    path('jobs/metrics/', JobMetricsView.as_view(), name='job-metrics'),
+
+    # Async versions of the hot endpoints, for ASGI deployments
+    path('async/token/', csrf_exempt(AsyncTokenObtainPairView.as_view()), name='async-token-obtain-pair'),
+    path('async/users/register/', csrf_exempt(AsyncUserRegistrationView.as_view()), name='async-user-register'),
+    path('async/users/', AsyncUserListView.as_view(), name='async-user-list'),
+    path('async/roles/', AsyncRoleListView.as_view(), name='async-role-list'),
+    path('async/permissions/', AsyncPermissionListView.as_view(), name='async-permission-list'),
 
     # API for company, role, and permission management
     path('', include(router.urls)),
@@ -1,18 +1,14 @@
 # core/utils.py
-from .models import AuditLog, UserCompanyMembership
+from .audit import write_audit_log
 from rest_framework import generics
 
-def log_action(user, action, description):
+def log_action(user, action, description, company=None):
+    """
+    Records an audit log entry. Entries are buffered and written in batches
+    by core.audit; ``company`` defaults to the user's first membership.
+    """
     try:
-        membership = UserCompanyMembership.objects.filter(user=user).first()
-        company = membership.company if membership else None
-
-        AuditLog.objects.create(
-            user=user,
-            company=company,
-            action=action,
-            description=description
-        )
+        write_audit_log(user, action, description, company=company)
     except Exception as e:
         # Handle logging failures gracefully
         print(f"Failed to create audit log: {e}")
@@ -1,14 +1,30 @@
 # core/views.py
-from rest_framework import generics, status, viewsets
+import hashlib
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
+from django.utils import timezone
+from django.utils.cache import parse_etags, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework import generics, serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.settings import api_settings
+from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .models import (
     User,
     Company,
     UserCompanyMembership,
     Role,
     Permission,
-    AuditLog
+    AuditLog,
+    AuditRollup,
 )
 from .serializers import (
     UserRegistrationSerializer,
@@ -16,33 +32,260 @@ from .serializers import (
     CompanySerializer,
     RoleSerializer,
     PermissionSerializer,
-    UserCompanyMembershipSerializer
+    UserCompanyMembershipSerializer,
+    BulkMembershipSerializer,
+    AuditLogSerializer,
+    AuditRollupSerializer,
+    requested_names,
+)
+from .caching import ALL_COMPANIES, content_version_key, get_versions
+from .exporting import EXPORT_RENDERERS, streaming_export
+from .fastpath import (
+    ValuesReader, fast_read_enabled, membership_role_names, role_permission_codenames, user_membership_labels,
 )
+from .importing import ImportFormatError, UserImporter, get_hash_executor, guess_format, iter_rows
+from .jobs import queue_stats
+from .middleware import get_tenant
+from .pagination import AuditLogPagination, MembershipPagination, RolePagination, UserPagination
 from .permissions import HasPermission
+from .purging import soft_delete_company, soft_delete_user
+from .replicas import read_from_replica
+from .rollups import PERIOD_LENGTHS, SUMMARY_DEFAULT_BUCKETS, bucket_start
+from .throttling import declared_throttle_cost
+from .tokens import StatelessTokenObtainPairSerializer, StatelessTokenRefreshSerializer
 from .utils import log_action
 
 class CompanyQuerysetMixin:
     """
     A mixin to filter querysets based on the requesting user's company.
+
+    The company comes from the request's tenant context, which is resolved
+    once per request. ``company_field`` is the lookup pointing at the company.
     """
+    company_field = 'company'
+
+    @property
+    def active_company(self):
+        return get_tenant(self.request).company
+
+    def require_active_company(self):
+        """The active company, or a 400 for users acting for none (e.g. superusers without memberships)."""
+        company = self.active_company
+        if company is None:
+            raise ValidationError("You must belong to a company to do this.")
+        return company
+
     def get_queryset(self):
         user = self.request.user
         if user.is_superuser:
             return super().get_queryset()
 
-        try:
-            user_membership = user.usercompanymembership_set.first()
-            if not user_membership:
-                return self.queryset.none()
-            user_company = user_membership.company
-        except UserCompanyMembership.DoesNotExist:
+        company_id = get_tenant(self.request).company_id
+        if company_id is None:
             return self.queryset.none()
 
-        return super().get_queryset().filter(company=user_company)
+        return super().get_queryset().filter(**{self.company_field: company_id})
+
+class ConditionalGetMixin:
+    """
+    Strong ETags for list and retrieve, built from content version counters
+    that signals bump whenever the underlying rows change. A matching
+    ``If-None-Match`` is answered with 304 before the queryset is touched.
+
+    ``etag_resources`` are kept per company, ``etag_global_resources`` are
+    shared by every company (see ``core.caching.bump_content_version``).
+    Responses read from a replica get no ETag, as the replica may not have
+    caught up with the versions yet.
+    """
+    etag_resources = ()
+    etag_global_resources = ()
+
+    def get_etag(self, request):
+        if request.user.is_superuser:
+            company_id = ALL_COMPANIES
+        else:
+            company_id = get_tenant(request).company_id
+            if company_id is None and self.etag_resources:
+                return None
+        keys = [content_version_key(resource, company_id) for resource in self.etag_resources]
+        keys += [content_version_key(resource) for resource in self.etag_global_resources]
+        versions = get_versions(keys)
+        # The same versions render differently per page, format and user.
+        payload = '|'.join([
+            *(str(versions[key]) for key in keys),
+            request.get_full_path(),
+            request.accepted_media_type or '',
+            str(request.user.pk),
+        ])
+        return '"%s"' % hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is not None:
+            if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if etag in if_none_match or '*' in if_none_match:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response['ETag'] = etag
+                return response
+        response = handler(request, *args, **kwargs)
+        if etag is not None and response.status_code == status.HTTP_200_OK and not read_from_replica():
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+class StreamingExportMixin:
+    """
+    Adds ``?format=ndjson`` and ``?format=csv`` to a list view. Those formats
+    stream every row of the filtered queryset instead of returning one page,
+    in the ``?ordering=`` of a TiebreakOrderingFilter (which ends in a unique
+    field, as the keyset needs) or else the pagination's ordering.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *EXPORT_RENDERERS]
+    export_filename = 'export'
+    # Throttle tokens an export takes, instead of the view's throttle_cost
+    export_throttle_cost = 20
+
+    def get_throttle_cost(self, request):
+        if getattr(request.accepted_renderer, 'streaming', False):
+            return self.export_throttle_cost
+        return declared_throttle_cost(self, request)
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not getattr(renderer, 'streaming', False):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return streaming_export(
+            queryset, self.get_export_ordering(queryset),
+            self.get_serializer(), renderer, self.export_filename,
+            chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000),
+        )
+
+    def get_export_ordering(self, queryset):
+        for backend in self.filter_backends:
+            if issubclass(backend, TiebreakOrderingFilter):
+                ordering = backend().get_ordering(self.request, queryset, self)
+                if ordering:
+                    return ordering
+        ordering = self.pagination_class.ordering
+        return (ordering,) if isinstance(ordering, str) else ordering
+
+class TiebreakOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that ends every requested ordering with ``id``, so rows
+    tying on the requested fields keep a stable order and the cursor's
+    offset into them does not repeat or skip rows between pages.
+    """
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering or any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            return ordering
+        # In the direction of the last field, so one index serves both.
+        return [*ordering, '-id' if ordering[-1].startswith('-') else 'id']
+
+def ordering_columns(view):
+    """Fields the view's pagination or OrderingFilter may sort (and read cursor positions) by."""
+    ordering = getattr(view.pagination_class, 'ordering', None) or ()
+    ordering = [ordering] if isinstance(ordering, str) else list(ordering)
+    ordering += getattr(view, 'ordering_fields', None) or []
+    return [name.lstrip('-') for name in ordering]
+
+class SparseQuerysetMixin:
+    """
+    Loads only what a ``?fields=``/``?expand=`` read renders (see
+    core.serializers.SparseFieldsetMixin). The queryset's joins and
+    prefetches are replaced by those of the rendered fields:
+    ``field_prefetches`` maps serializer fields to the prefetch lookups they
+    need, and expanded fields are joined with ``select_related``. With
+    ``?fields=`` only the columns behind the rendered fields, the primary key
+    and the ordering fields are selected.
+    """
+    field_prefetches = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if self.request.method not in SAFE_METHODS or ('fields' not in params and 'expand' not in params):
+            return queryset
+        rendered = self.get_serializer().fields
+        expand = requested_names(self.request, 'expand') or []
+        queryset = queryset.select_related(None).prefetch_related(None)
+        for name in rendered:
+            queryset = queryset.prefetch_related(*self.field_prefetches.get(name, ()))
+        if expand:
+            queryset = queryset.select_related(*(rendered[name].source for name in expand))
+        if 'fields' in params:
+            opts = queryset.model._meta
+            concrete = {field.name for field in opts.concrete_fields}
+            columns = {opts.pk.name}
+            columns.update(field.source for field in rendered.values() if field.source in concrete)
+            columns.update(name for name in ordering_columns(self) if name in concrete)
+            queryset = queryset.only(*columns)
+        return queryset
+
+class FastListMixin:
+    """
+    Serves list reads from ``values_reader`` (a core.fastpath.ValuesReader)
+    instead of the serializer: same filters, ordering, pagination and bytes,
+    without model instances. ``?fields=``/``?expand=`` reads and
+    ``FAST_READ_PATH = False`` use the serializer.
+    """
+    values_reader = None
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if self.values_reader is None or not fast_read_enabled() or 'fields' in params or 'expand' in params:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = self.values_reader.values(queryset, extra=ordering_columns(self))
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.values_reader.read(list(queryset)))
+        return self.get_paginated_response(self.values_reader.read(page))
+
+# Membership strings render "<username> @ <company name>"; the user side is
+# filled in by the prefetch itself, the company needs a join.
+USER_MEMBERSHIPS_PREFETCH = Prefetch(
+    'usercompanymembership_set',
+    queryset=UserCompanyMembership.objects.filter(company__deleted_at__isnull=True).select_related('company')
+    .order_by('pk'),
+)
+# Related lists are ordered so that core.fastpath can render them identically.
+ROLE_PERMISSIONS_PREFETCH = Prefetch('permissions', queryset=Permission.objects.order_by('pk'))
+MEMBERSHIP_ROLES_PREFETCH = Prefetch('roles', queryset=Role.objects.order_by('pk'))
+
+USER_VALUES = ValuesReader(UserSerializer, {'company_memberships': user_membership_labels})
+ROLE_VALUES = ValuesReader(RoleSerializer, {'permissions': role_permission_codenames})
+PERMISSION_VALUES = ValuesReader(PermissionSerializer)
+MEMBERSHIP_VALUES = ValuesReader(UserCompanyMembershipSerializer, {'roles': membership_role_names})
+
+class StatelessTokenObtainPairView(TokenObtainPairView):
+    """Issues tokens that carry the user's company and permissions."""
+    serializer_class = StatelessTokenObtainPairSerializer
+
+class ReplicaTokenRefreshView(TokenRefreshView):
+    """TokenRefreshView that reads the user from a read replica."""
+    replica_methods = ('POST',)
+
+class StatelessTokenRefreshView(TokenRefreshView):
+    """
+    Refreshes stateless tokens. Not served from replicas: the user and company
+    it reads end up in claims stamped with the current permission versions.
+    """
+    serializer_class = StatelessTokenRefreshSerializer
 
 class UserRegistrationView(generics.CreateAPIView):
     serializer_class = UserRegistrationSerializer
     permission_classes = [AllowAny]
+    query_budget = 10
+    # Hashing the password is most of the work.
+    throttle_cost = 5
     
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -56,86 +299,316 @@ class UserRegistrationView(generics.CreateAPIView):
             "message": "User registered successfully."
         }, status=status.HTTP_201_CREATED)
 
-class UserListView(CompanyQuerysetMixin, generics.ListAPIView):
-    queryset = User.objects.all()
+class JobMetricsView(generics.GenericAPIView):
+    """Background job counts per status and name, and the queue's lag (core.jobs)."""
+    permission_classes = [IsAdminUser]
+    query_budget = 4
+
+    def get(self, request):
+        return Response(queue_stats())
+
+class UserImportView(generics.GenericAPIView):
+    """
+    Imports users from an uploaded CSV or NDJSON ``file``, streamed in
+    batches with passwords hashed on the shared process pool.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+    # Queries grow with the number of batches, so there is no fixed budget.
+    query_budget = None
+    throttle_cost = 50
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': "No file was submitted."})
+        format = request.data.get('format') or guess_format(upload.name)
+        try:
+            rows = iter_rows(upload.file, format)
+            importer = UserImporter(
+                batch_size=getattr(settings, 'USER_IMPORT_BATCH_SIZE', 1000),
+                executor=get_hash_executor(),
+            )
+            result = importer.run(rows)
+        except (ImportFormatError, UnicodeDecodeError) as e:
+            raise ValidationError({'file': str(e)})
+        log_action(
+            request.user, 'create', f"Imported {result.created} users from {upload.name}",
+            company=get_tenant(request).company,
+        )
+        return Response(result.as_dict())
+
+def datetime_param(params, name):
+    """The ISO 8601 date/time query parameter ``name``, made aware; a 400 if malformed."""
+    try:
+        value = parse_datetime(params[name])
+    except ValueError:
+        value = None
+    if value is None:
+        raise ValidationError({name: "Enter a valid ISO 8601 date/time."})
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def prefix_range(expression, prefix):
+    """
+    ``expression`` starts with ``prefix``, as a range an index on
+    ``expression`` can serve (unlike ``LIKE``, whose index use varies by
+    database and collation).
+    """
+    return GreaterThanOrEqual(expression, prefix) & LessThan(expression, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+class UserListView(
+    StreamingExportMixin, FastListMixin, SparseQuerysetMixin, CompanyQuerysetMixin, generics.ListAPIView,
+):
+    """
+    The active company's users.
+
+    ``search`` matches a case-insensitive prefix of the username or email
+    through the ``LOWER()`` indexes; ``contains`` matches a substring and
+    has to scan the company's users. ``is_active``, ``role`` (a role id,
+    direct holders only) and ``joined_since``/``joined_until`` (ISO 8601)
+    filter, and ``ordering`` sorts by ``id``, ``username`` or
+    ``date_joined`` (``-`` for descending).
+    """
+    queryset = User.objects.filter(deleted_at__isnull=True).prefetch_related(USER_MEMBERSHIPS_PREFETCH)
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UserPagination
+    filter_backends = [TiebreakOrderingFilter]
+    ordering_fields = ['id', 'username', 'date_joined']
+    field_prefetches = {'company_memberships': (USER_MEMBERSHIPS_PREFETCH,)}
+    values_reader = USER_VALUES
+    company_field = 'usercompanymembership__company'
+    export_filename = 'users'
+    replica_methods = SAFE_METHODS
+    query_budget = 4
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser:
-            return User.objects.all()
-        try:
-            user_membership = user.usercompanymembership_set.first()
-            if not user_membership:
-                return User.objects.none()
-            user_company = user_membership.company
-            return User.objects.filter(usercompanymembership__company=user_company)
-        except UserCompanyMembership.DoesNotExist:
-            return User.objects.none()
-
-class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = User.objects.all()
+        queryset = super().get_queryset()
+        params = self.request.query_params
+
+        search = params.get('search', '').strip().lower()
+        if search:
+            queryset = queryset.filter(
+                prefix_range(Lower('username'), search) | prefix_range(Lower('email'), search)
+            )
+        contains = params.get('contains', '').strip()
+        if contains:
+            queryset = queryset.filter(Q(username__icontains=contains) | Q(email__icontains=contains))
+        if 'is_active' in params:
+            value = params['is_active'].lower()
+            if value not in ('true', 'false', '1', '0'):
+                raise ValidationError({'is_active': "Enter true or false."})
+            queryset = queryset.filter(is_active=value in ('true', '1'))
+        if 'role' in params:
+            if not params['role'].isdigit():
+                raise ValidationError({'role': "Enter a valid role id."})
+            holders = UserCompanyMembership.roles.through.objects.filter(role_id=params['role'])
+            company_id = get_tenant(self.request).company_id
+            if company_id is not None:
+                holders = holders.filter(usercompanymembership__company_id=company_id)
+            queryset = queryset.filter(pk__in=holders.values('usercompanymembership__user_id'))
+        for param, lookup in (('joined_since', 'date_joined__gte'), ('joined_until', 'date_joined__lt')):
+            if param in params:
+                queryset = queryset.filter(**{lookup: datetime_param(params, param)})
+        return queryset
+
+class UserDetailView(SparseQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    """
+    A user's profile. DELETE soft-deletes the user, who disappears at once;
+    core.purging removes their rows afterwards.
+    """
+    queryset = User.objects.filter(deleted_at__isnull=True).prefetch_related(USER_MEMBERSHIPS_PREFETCH)
     serializer_class = UserSerializer
+    field_prefetches = {'company_memberships': (USER_MEMBERSHIPS_PREFETCH,)}
     permission_classes = [IsAuthenticated]
+    query_budget = {'get': 4, 'put': 10, 'patch': 10, 'delete': 13}
     
     def perform_update(self, serializer):
-        instance = self.get_object()
+        instance = serializer.instance
         super().perform_update(serializer)
-        log_action(self.request.user, 'update', f"Updated user profile for {instance.username}")
+        log_action(
+            self.request.user, 'update', f"Updated user profile for {instance.username}",
+            company=get_tenant(self.request).company,
+        )
 
     def perform_destroy(self, instance):
-        log_action(self.request.user, 'delete', f"Deleted user: {instance.username}")
-        super().perform_destroy(instance)
+        log_action(
+            self.request.user, 'delete', f"Deleted user: {instance.username}",
+            company=get_tenant(self.request).company,
+        )
+        soft_delete_user(instance)
 
 class CompanyViewSet(viewsets.ModelViewSet):
-    queryset = Company.objects.all()
+    """Companies. DELETE soft-deletes, like UserDetailView."""
+    queryset = Company.objects.filter(deleted_at__isnull=True)
     serializer_class = CompanySerializer
     permission_classes = [IsAdminUser]
+    replica_methods = SAFE_METHODS
+    query_budget = {'list': 3, 'retrieve': 3, 'create': 4, 'update': 5, 'partial_update': 5, 'destroy': 11}
 
-class PermissionViewSet(viewsets.ReadOnlyModelViewSet):
+    def perform_destroy(self, instance):
+        log_action(self.request.user, 'delete', f"Deleted company: {instance.name}")
+        soft_delete_company(instance)
+
+class PermissionViewSet(ConditionalGetMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Permission.objects.all()
     serializer_class = PermissionSerializer
+    values_reader = PERMISSION_VALUES
     permission_classes = [IsAuthenticated, HasPermission('permission.view')]
+    etag_global_resources = ('permissions',)
+    replica_methods = SAFE_METHODS
+    query_budget = 5
 
-class RoleViewSet(viewsets.ModelViewSet):
-    queryset = Role.objects.all()
+class RoleViewSet(
+    ConditionalGetMixin, FastListMixin, SparseQuerysetMixin, CompanyQuerysetMixin, viewsets.ModelViewSet,
+):
+    queryset = Role.objects.filter(company__deleted_at__isnull=True).select_related('company').prefetch_related(
+        ROLE_PERMISSIONS_PREFETCH,
+    )
     serializer_class = RoleSerializer
+    field_prefetches = {'permissions': (ROLE_PERMISSIONS_PREFETCH,)}
+    values_reader = ROLE_VALUES
     permission_classes = [IsAuthenticated]
+    pagination_class = RolePagination
+    etag_resources = ('roles',)
+    # Roles list their permissions by codename.
+    etag_global_resources = ('permissions',)
+    replica_methods = SAFE_METHODS
+    # Writes include the role closure (core.hierarchy).
+    query_budget = {'list': 4, 'retrieve': 4, 'create': 12, 'update': 17, 'partial_update': 17, 'destroy': 14}
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAuthenticated(), HasPermission('role.manage')]
         return [IsAuthenticated()]
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser:
-            return Role.objects.all()
-        user_company = user.usercompanymembership_set.first().company
-        return Role.objects.filter(company=user_company)
-
     def perform_create(self, serializer):
-        user_company = self.request.user.usercompanymembership_set.first().company
-        serializer.save(company=user_company)
+        serializer.save(company=self.require_active_company())
 
     def perform_destroy(self, instance):
-        log_action(self.request.user, 'delete', f"Deleted role: {instance.name}")
+        log_action(self.request.user, 'delete', f"Deleted role: {instance.name}", company=self.active_company)
         super().perform_destroy(instance)
 
-class UserCompanyMembershipViewSet(viewsets.ModelViewSet):
-    queryset = UserCompanyMembership.objects.all()
+class UserCompanyMembershipViewSet(
+    ConditionalGetMixin, StreamingExportMixin, FastListMixin, SparseQuerysetMixin, CompanyQuerysetMixin,
+    viewsets.ModelViewSet,
+):
+    queryset = UserCompanyMembership.objects.filter(
+        user__deleted_at__isnull=True, company__deleted_at__isnull=True,
+    ).select_related('user', 'company').prefetch_related(
+        MEMBERSHIP_ROLES_PREFETCH,
+    )
     serializer_class = UserCompanyMembershipSerializer
+    field_prefetches = {'roles': (MEMBERSHIP_ROLES_PREFETCH,)}
+    values_reader = MEMBERSHIP_VALUES
     permission_classes = [IsAuthenticated, HasPermission('user.manage_memberships')]
+    pagination_class = MembershipPagination
+    etag_resources = ('memberships',)
+    export_filename = 'memberships'
+    query_budget = {
+        'list': 6, 'retrieve': 6, 'create': 12, 'update': 13, 'partial_update': 13, 'destroy': 8, 'bulk': 13,
+    }
+    throttle_cost = {'bulk': 20}
 
     def perform_create(self, serializer):
-        user_company = self.request.user.usercompanymembership_set.first().company
-        serializer.save(company=user_company)
+        serializer.save(company=self.require_active_company())
+
+    @action(detail=False, methods=['post'], serializer_class=BulkMembershipSerializer)
+    def bulk(self, request):
+        """Creates or extends many memberships in one request, reporting each item."""
+        company = self.require_active_company()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save(company=company)
+        succeeded = sum(1 for result in results if result['status'] != 'error')
+        log_action(
+            request.user, 'update', f"Bulk assigned {succeeded} memberships",
+            company=company,
+        )
+        return Response({
+            'created': sum(1 for result in results if result['status'] == 'created'),
+            'updated': sum(1 for result in results if result['status'] == 'updated'),
+            'failed': len(results) - succeeded,
+            'results': results,
+        })
+
+class AuditLogViewSet(StreamingExportMixin, CompanyQuerysetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    The active company's audit log, newest first.
+
+    Supports ``since``/``until`` (ISO 8601), ``action`` and ``user`` filters,
+    and ``?format=ndjson|csv`` to stream every matching entry. Every
+    combination is served by one of the ``(company, ...)`` indexes on
+    AuditLog, so results are always scoped to a single company, superusers
+    included.
+    """
+    queryset = AuditLog.objects.all()
+    serializer_class = AuditLogSerializer
+    permission_classes = [IsAuthenticated, HasPermission('audit.view')]
+    pagination_class = AuditLogPagination
+    export_filename = 'audit-log'
+    query_budget = 5
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_superuser:
-            return UserCompanyMembership.objects.all()
-        
-        user_company = user.usercompanymembership_set.first().company
-        return UserCompanyMembership.objects.filter(company=user_company)
\ No newline at end of file
+        company_id = get_tenant(self.request).company_id
+        if company_id is None:
+            return self.queryset.none()
+        queryset = self.queryset.filter(company_id=company_id)
+
+        params = self.request.query_params
+        for param, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if param in params:
+                queryset = queryset.filter(**{lookup: datetime_param(params, param)})
+        if 'action' in params:
+            if params['action'] not in dict(AuditLog.ACTION_CHOICES):
+                raise ValidationError({'action': "Unknown action."})
+            queryset = queryset.filter(action=params['action'])
+        if 'user' in params:
+            if not params['user'].isdigit():
+                raise ValidationError({'user': "Enter a valid user id."})
+            queryset = queryset.filter(user_id=params['user'])
+        return queryset
+
+    @action(detail=False, methods=['get'], serializer_class=AuditRollupSerializer, pagination_class=None)
+    def summary(self, request):
+        """
+        Entry counts per ``period`` (``day``, the default, or ``hour``; UTC)
+        and action, read from core.rollups instead of the log itself.
+        ``since`` defaults to 90 days (or 24 hours) back; ``action`` may be
+        repeated. Buckets without entries are left out.
+        """
+        company_id = get_tenant(request).company_id
+        params = request.query_params
+        period = params.get('period', AuditRollup.DAY)
+        if period not in PERIOD_LENGTHS:
+            raise ValidationError({'period': "Enter day or hour."})
+        actions = params.getlist('action') or [action for action, _ in AuditLog.ACTION_CHOICES]
+        if not set(actions) <= set(dict(AuditLog.ACTION_CHOICES)):
+            raise ValidationError({'action': "Unknown action."})
+        length = PERIOD_LENGTHS[period]
+        until = datetime_param(params, 'until') if 'until' in params else timezone.now()
+        if 'since' in params:
+            since = bucket_start(datetime_param(params, 'since'), period)
+        else:
+            since = bucket_start(until, period) - length * (SUMMARY_DEFAULT_BUCKETS[period] - 1)
+        if (until - since) / length > getattr(settings, 'AUDIT_SUMMARY_MAX_BUCKETS', 1000):
+            raise ValidationError({'since': "Too many buckets; narrow the range or use a longer period."})
+
+        rollups = AuditRollup.objects.none() if company_id is None else AuditRollup.objects.filter(
+            company_id=company_id, period=period, action__in=actions, bucket__gte=since, bucket__lt=until,
+        ).order_by('bucket', 'action')
+        results = self.get_serializer(rollups, many=True).data
+        totals = dict.fromkeys(actions, 0)
+        for row in results:
+            totals[row['action']] += row['count']
+        return Response({
+            'period': period,
+            'since': serializers.DateTimeField().to_representation(since),
+            'until': serializers.DateTimeField().to_representation(until),
+            'totals': totals,
+            'results': results,
+        })
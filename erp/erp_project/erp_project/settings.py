@@ -55,6 +55,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.TenantMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'erp_project.urls'
@@ -85,9 +88,109 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas (core.replicas). Views declaring ``replica_methods`` read from
+# one of DATABASE_REPLICAS, aliases of DATABASES that replicate 'default'. A
+# user who wrote reads from 'default' for REPLICA_PIN_SECONDS afterwards.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Effective-permission cache used by core.permissions.HasPermission
+PERMISSION_CACHE_TIMEOUT = 60 * 60
+PERMISSION_CACHE_LOCAL_SIZE = 1024
+
+# Views declare a query_budget; QueryBudgetMiddleware logs requests that go
+# over it, or raises when strict (used by the test suite).
+QUERY_BUDGET_STRICT = False
+
+# Audit log writer (core.audit). 'buffered' writes records in batches from a
+# background thread; 'sync' writes each record inside the request.
+AUDIT_LOG_MODE = 'buffered'
+AUDIT_LOG_BATCH_SIZE = 200
+AUDIT_LOG_FLUSH_INTERVAL = 1.0
+AUDIT_LOG_MAX_PENDING = 10000
+# Most buckets GET /api/audit-logs/summary/ returns per action
+AUDIT_SUMMARY_MAX_BUCKETS = 1000
+
+
+# Deleted companies and users are hidden at once and purged later
+# (core.purging). PURGE_MODE is 'queue' (a job for run_workers),
+# 'background' (a thread of the web process), 'sync' (inside the deleting
+# request) or 'manual' (manage.py purge_deleted only).
+# PURGE_CHUNK_PAUSE is a sleep in seconds between chunks.
+PURGE_MODE = 'queue'
+PURGE_CHUNK_SIZE = 1000
+PURGE_CHUNK_PAUSE = 0.0
+
+
+# Background jobs (core.jobs), run by manage.py run_workers. JOB_HANDLERS
+# maps job names to the functions running them. A failed job is retried
+# after JOB_RETRY_BACKOFF * 2 ** (attempts - 1) seconds, at most
+# JOB_RETRY_MAX_DELAY; a running job whose worker stopped responding for
+# JOB_LEASE_SECONDS is requeued. Succeeded jobs are kept for
+# JOB_RETENTION_SECONDS.
+JOB_HANDLERS = {
+    'purge': 'core.purging.purge_pending',
+}
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 5
+JOB_RETRY_MAX_DELAY = 3600
+JOB_LEASE_SECONDS = 600
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+# Largest number of items accepted by POST /api/memberships/bulk/
+BULK_MEMBERSHIP_MAX_ITEMS = 5000
+
+
+# Bulk user import (core.importing). USER_IMPORT_WORKERS is the size of the
+# password-hashing process pool; None uses every CPU, 0 hashes inline.
+USER_IMPORT_BATCH_SIZE = 1000
+USER_IMPORT_WORKERS = None
+
+# Rows fetched per query by the streaming ?format=ndjson|csv exports
+EXPORT_CHUNK_SIZE = 2000
+
+
+# Threads hashing passwords for the async views in core.async_views
+ASYNC_HASH_WORKERS = 4
+
+# Login lockout (core.lockout): LOGIN_LOCKOUT_THRESHOLD failed logins within
+# a sliding LOGIN_LOCKOUT_WINDOW (seconds) lock the username for
+# LOGIN_LOCKOUT_DURATION seconds.
+LOGIN_LOCKOUT_THRESHOLD = 5
+LOGIN_LOCKOUT_WINDOW = 300
+LOGIN_LOCKOUT_DURATION = 900
+
+# API throttling (core.throttling): token buckets per user, per active
+# company and, for anonymous requests, per client address. A bucket holds
+# up to ``burst`` tokens and refills at ``rate`` tokens per second; a
+# request costs its view's throttle_cost (1 by default). Leaving a scope
+# out turns its bucket off.
+API_THROTTLE_BUCKETS = {
+    'user': {'rate': 20, 'burst': 200},
+    'company': {'rate': 100, 'burst': 1000},
+    'anon': {'rate': 10, 'burst': 100},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -136,11 +239,26 @@ from datetime import timedelta
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.tokens.StatelessJWTAuthentication',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'core.throttling.TenantThrottle',
+    ),
+    # Same bytes as DRF's JSONRenderer, encoded with orjson when installed.
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.fastpath.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
+# Serve plain list reads of users, roles, permissions and memberships from
+# values() instead of the serializers (core.fastpath).
+FAST_READ_PATH = True
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.lockout.LockoutTokenObtainPairSerializer',
 }
@@ -16,11 +16,9 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.http import HttpResponse
+from core.views import ReplicaTokenRefreshView, StatelessTokenObtainPairView, StatelessTokenRefreshView
 from erp_project import views   # 👈 import your view
 
 
@@ -33,6 +31,8 @@ urlpatterns = [
     # path('', home),  # 👈 add this
     path('admin/', admin.site.urls),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/refresh/', ReplicaTokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/stateless/', StatelessTokenObtainPairView.as_view(), name='token_obtain_stateless'),
+    path('api/token/stateless/refresh/', StatelessTokenRefreshView.as_view(), name='token_refresh_stateless'),
     path('api/', include('core.urls')),
 ]
\ No newline at end of file